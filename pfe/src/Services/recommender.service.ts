@@ -28,6 +28,19 @@ export interface RecommendationResponse {
   total_count: number;
 }
 
+export interface BatchRecommendationResponse {
+  type: string;
+  results: RecommendationResponse[];
+  total_count: number;
+}
+
+export interface InteractionEvent {
+  user_id: string;
+  property_id: string;
+  rating: number;
+  interaction_type?: 'view' | 'favorite' | 'contact';
+}
+
 export interface SimilarProperty {
   property_id: string;
   similarity_score: number;
@@ -73,6 +86,31 @@ export class RecommenderService {
     }
   }
 
+  async getBatchRecommendations(user_ids: string[], type: string = 'hybrid', n: number = 5): Promise<BatchRecommendationResponse> {
+    try {
+      const response = await axios.post(`${FLASK_API_URL}/recommendations/batch`, {
+        user_ids, type, n
+      }, {
+        timeout: 120000, // Whole batches are scored in one call
+      });
+      return response.data;
+    } catch (error: any) {
+      logger.error(`Error fetching batch recommendations for ${user_ids.length} users:`, error);
+      throw new Error(error.response?.data?.error || 'Failed to fetch batch recommendations');
+    }
+  }
+
+  async recordInteractions(interactions: InteractionEvent[]): Promise<void> {
+    try {
+      await axios.post(`${FLASK_API_URL}/interactions`, { interactions }, {
+        timeout: 5000,
+      });
+    } catch (error: any) {
+      // Recommendations catch up on the next reload; never fail the user action
+      logger.error(`Error recording ${interactions.length} interactions:`, error);
+    }
+  }
+
   async getSimilarProperties(property_id: string, n: number = 5): Promise<SimilarPropertiesResponse> {
     try {
       const response = await axios.get(`${FLASK_API_URL}/similar-properties`, {
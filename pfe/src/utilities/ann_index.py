@@ -0,0 +1,225 @@
+import copy
+import numpy as np
+import logging
+from ranking import top_k
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def normalize_rows(vectors):
+    """L2-normalize rows so dot products are cosine similarities"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float64))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+class ExactIndex:
+    """Brute-force cosine search over all vectors"""
+
+    backend = 'exact'
+
+    def __init__(self):
+        self.ids = np.array([], dtype=object)
+        self.row_index = {}
+        self.vectors = np.zeros((0, 0))
+        self.active = np.zeros(0, dtype=bool)
+
+    def fit(self, ids, vectors):
+        """Index the given vectors under the given ids"""
+        self.ids = np.asarray(list(ids), dtype=object)
+        self.row_index = {item_id: idx for idx, item_id in enumerate(self.ids)}
+        self.vectors = normalize_rows(vectors)
+        self.active = np.ones(len(self.ids), dtype=bool)
+        return self
+
+    def __len__(self):
+        return len(self.row_index)
+
+    def params(self):
+        """Constructor arguments of this index (see load_index)"""
+        return {}
+
+    def arrays(self):
+        """The index as plain arrays (see engine_store.save_state)"""
+        return {
+            'ids': np.asarray([str(item_id) for item_id in self.ids], dtype=str),
+            'vectors': self.vectors,
+            'active': self.active
+        }
+
+    def restore(self, arrays):
+        """Take over arrays() output, which may be read-only memory maps, without refitting"""
+        self.ids = arrays['ids'].astype(object)
+        self.vectors = arrays['vectors']
+        self.active = arrays['active']
+        self.row_index = {item_id: idx for idx, item_id in enumerate(self.ids) if self.active[idx]}
+        return self
+
+    def copy(self):
+        """Independent copy, so edits can be made without touching an index in use"""
+        index = copy.copy(self)
+        index.row_index = dict(self.row_index)
+        index.vectors, index.active = np.array(self.vectors), np.array(self.active)
+        return index
+
+    def _rank(self, rows, query, k, exclude):
+        """Score candidate rows against a normalized query and keep the best k"""
+        rows = rows[self.active[rows]]
+        if exclude:
+            rows = rows[~np.isin(self.ids[rows], list(exclude))]
+        top, scores = top_k(self.vectors[rows] @ query, k)
+        return [(self.ids[row], float(score)) for row, score in zip(rows[top], scores)]
+
+    def search(self, query, k=5, exclude=None):
+        """Return the k most similar (id, score) pairs, skipping excluded ids"""
+        query = normalize_rows(query)[0]
+        return self._rank(np.arange(len(self.ids)), query, k, exclude)
+
+    def upsert(self, item_id, vector):
+        """Add or replace one vector"""
+        vector = normalize_rows(vector)
+        row = self.row_index.get(item_id)
+        if row is None:
+            row = len(self.ids)
+            self.ids = np.append(self.ids, np.array([item_id], dtype=object))
+            self.vectors = np.vstack([self.vectors, vector])
+            self.active = np.append(self.active, True)
+            self.row_index[item_id] = row
+        else:
+            self.vectors[row] = vector[0]
+        return row
+
+    def remove(self, item_id):
+        """Remove one vector; its row is masked out rather than compacted"""
+        row = self.row_index.pop(item_id, None)
+        if row is None:
+            return False
+        self.active[row] = False
+        return True
+
+class IVFIndex(ExactIndex):
+    """Inverted-file index: spherical k-means partitions, probed nearest-first
+
+    n_probe is the recall/latency knob: each query scores only the vectors in
+    its n_probe closest partitions. Queries fall back to exact search when the
+    probed partitions cannot fill k results, or when n_probe covers every list.
+    """
+
+    backend = 'ivf'
+
+    def __init__(self, n_lists=None, n_probe=8, iterations=10, sample_size=50000, seed=0):
+        super().__init__()
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.iterations = iterations
+        self.sample_size = sample_size
+        self.seed = seed
+        self.centroids = np.zeros((0, 0))
+        self.assignments = np.zeros(0, dtype=np.int64)
+        self.lists = []
+
+    def _assign(self, vectors, block_size=65536):
+        """Nearest centroid of each vector, computed in blocks"""
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), block_size):
+            block = vectors[start:start + block_size]
+            assignments[start:start + block_size] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignments
+
+    def fit(self, ids, vectors):
+        """Index the vectors and partition them with spherical k-means"""
+        super().fit(ids, vectors)
+        size = len(self.ids)
+        n_lists = self.n_lists or max(1, int(np.sqrt(size)))
+        n_lists = min(n_lists, size) if size else 1
+        rng = np.random.default_rng(self.seed)
+
+        # Train centroids on a sample, then assign every vector
+        sample = self.vectors[rng.choice(size, min(size, self.sample_size), replace=False)]
+        self.centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(self.iterations):
+            labels = np.argmax(sample @ self.centroids.T, axis=1)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, labels, sample)
+            empty = ~sums.any(axis=1)
+            sums[empty] = self.centroids[empty]
+            self.centroids = normalize_rows(sums)
+
+        self.assignments = self._assign(self.vectors)
+        order = np.argsort(self.assignments, kind='stable')
+        bounds = np.searchsorted(self.assignments[order], np.arange(n_lists + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(n_lists)]
+
+        logger.info(f"Built IVF index: {size} vectors in {n_lists} lists, n_probe={self.n_probe}")
+        return self
+
+    def params(self):
+        return {
+            'n_lists': len(self.lists), 'n_probe': self.n_probe, 'iterations': self.iterations,
+            'sample_size': self.sample_size, 'seed': self.seed
+        }
+
+    def arrays(self):
+        arrays = super().arrays()
+        # Partition lists are stored concatenated, in their current order, with their bounds
+        arrays['centroids'] = self.centroids
+        arrays['assignments'] = self.assignments
+        arrays['list_rows'] = np.concatenate(self.lists) if self.lists else np.zeros(0, dtype=np.int64)
+        arrays['list_bounds'] = np.cumsum([0] + [len(rows) for rows in self.lists])
+        return arrays
+
+    def restore(self, arrays):
+        super().restore(arrays)
+        self.centroids = arrays['centroids']
+        self.assignments = arrays['assignments']
+        bounds = arrays['list_bounds']
+        self.lists = [arrays['list_rows'][bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+        return self
+
+    def search(self, query, k=5, exclude=None, n_probe=None):
+        """Approximate search over the n_probe partitions closest to the query"""
+        n_probe = n_probe or self.n_probe
+        if n_probe >= len(self.lists):
+            return super().search(query, k, exclude)
+
+        query = normalize_rows(query)[0]
+        probed, _ = top_k(self.centroids @ query, n_probe)
+        rows = np.concatenate([self.lists[i] for i in probed])
+        results = self._rank(rows, query, k, exclude)
+
+        if len(results) < min(k, len(self) - len(exclude or ())):
+            return super().search(query, k, exclude)
+        return results
+
+    def copy(self):
+        index = super().copy()
+        # Partition lists are replaced, never modified, by upsert
+        index.assignments, index.lists = np.array(self.assignments), list(self.lists)
+        return index
+
+    def upsert(self, item_id, vector):
+        """Add or replace one vector and file it under its nearest partition"""
+        previous = self.row_index.get(item_id)
+        row = super().upsert(item_id, vector)
+        list_id = int(np.argmax(self.centroids @ self.vectors[row]))
+
+        if previous is not None:
+            old_list = self.assignments[row]
+            self.lists[old_list] = self.lists[old_list][self.lists[old_list] != row]
+            self.assignments[row] = list_id
+        else:
+            self.assignments = np.append(self.assignments, list_id)
+        self.lists[list_id] = np.append(self.lists[list_id], row)
+        return row
+
+def build_index(backend='exact', **params):
+    """Create a content index by backend name"""
+    backends = {'exact': ExactIndex, 'ivf': IVFIndex}
+    if backend not in backends:
+        raise ValueError(f"Unknown index backend: {backend}. Use: {', '.join(backends)}")
+    return backends[backend](**params)
+
+def load_index(backend, params, arrays):
+    """Recreate a content index from its params() and arrays() output without refitting"""
+    return build_index(backend, **params).restore(arrays)
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Keyword filters accepted by PropertyAttributeIndex.candidates
+FILTER_FIELDS = ('location', 'type', 'min_price', 'max_price', 'min_bedrooms', 'max_bedrooms')
+
+# Listing columns matched by value, and columns matched by range
+CATEGORICAL_COLUMNS = ('location', 'type')
+RANGE_COLUMNS = ('price', 'bedrooms')
+
+class PropertyAttributeIndex:
+    """Inverted indexes over listing attributes, for pre-filtering scoring candidates
+
+    Rows are positions in the engine's feature matrix. location and type
+    map each value to the sorted rows holding it; price and bedrooms keep
+    every row ordered by value, so a range is a searchsorted slice. A query
+    starts from its most selective condition and checks the other
+    conditions only on those rows, so it costs about the size of the
+    smallest match set rather than the catalogue size.
+    """
+
+    def __init__(self, size, rows, columns):
+        self.size = size
+        # column -> (code of every row, -1 if unknown; {value: code}; [sorted rows per code])
+        self.categorical = {}
+        for column in CATEGORICAL_COLUMNS:
+            codes, uniques = pd.factorize(columns[column])
+            row_codes = np.full(size, -1, dtype=np.int64)
+            row_codes[rows] = codes
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            postings = [np.sort(rows[order[start:end]]) for start, end in zip(bounds[:-1], bounds[1:])]
+            self.categorical[column] = (row_codes, {value: code for code, value in enumerate(uniques)}, postings)
+
+        # column -> (value of every row, NaN if unknown; sorted values; rows in that order)
+        self.ranges = {}
+        for column in RANGE_COLUMNS:
+            values = np.asarray(columns[column], dtype=np.float64)
+            row_values = np.full(size, np.nan)
+            row_values[rows] = values
+            order = np.argsort(values, kind='stable')
+            self.ranges[column] = (row_values, values[order], rows[order])
+
+    @classmethod
+    def from_frame(cls, df_properties, feature_ids):
+        """Index df_properties rows at their positions in feature_ids (property_features.index)"""
+        rows = feature_ids.get_indexer(df_properties['property_id'])
+        known = rows >= 0
+        return cls(len(feature_ids), rows[known].astype(np.int64), {
+            column: df_properties[column].to_numpy()[known] for column in CATEGORICAL_COLUMNS + RANGE_COLUMNS
+        })
+
+    def candidates(self, location=None, type=None, min_price=None, max_price=None,
+                   min_bedrooms=None, max_bedrooms=None):
+        """Sorted feature rows matching every given filter
+
+        location and type take one value or a list of accepted values;
+        bounds are inclusive. Returns None when no filter is given.
+        """
+        # Each condition as (match count, rows matching it, test of given rows)
+        conditions = []
+        for column, accepted in (('location', location), ('type', type)):
+            if accepted is None:
+                continue
+            if isinstance(accepted, str):
+                accepted = [accepted]
+            row_codes, code_of, postings = self.categorical[column]
+            codes = sorted({code_of[value] for value in accepted if value in code_of})
+            conditions.append((
+                sum(len(postings[code]) for code in codes),
+                lambda postings=postings, codes=codes: np.sort(np.concatenate(
+                    [postings[code] for code in codes] or [np.zeros(0, dtype=np.int64)]
+                )),
+                lambda rows, row_codes=row_codes, codes=codes: np.isin(row_codes[rows], codes)
+            ))
+
+        for column, low, high in (('price', min_price, max_price), ('bedrooms', min_bedrooms, max_bedrooms)):
+            if low is None and high is None:
+                continue
+            row_values, sorted_values, sorted_rows = self.ranges[column]
+            low = -np.inf if low is None else low
+            high = np.inf if high is None else high
+            start = np.searchsorted(sorted_values, low, side='left')
+            end = max(start, np.searchsorted(sorted_values, high, side='right'))
+            conditions.append((
+                end - start,
+                lambda sorted_rows=sorted_rows, start=start, end=end: np.sort(sorted_rows[start:end]),
+                lambda rows, row_values=row_values, low=low, high=high: (
+                    (row_values[rows] >= low) & (row_values[rows] <= high)
+                )
+            ))
+
+        if not conditions:
+            return None
+        conditions.sort(key=lambda condition: condition[0])
+        rows = conditions[0][1]()
+        for _, _, test in conditions[1:]:
+            if not len(rows):
+                break
+            rows = rows[test(rows)]
+        return rows
@@ -0,0 +1,107 @@
+import argparse
+import json
+import time
+import numpy as np
+import logging
+from ann_index import ExactIndex, IVFIndex
+
+# Configure logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+PROPERTY_TYPES = ['apartment', 'house', 'villa', 'studio']
+
+def synthetic_features(num_properties, num_locations=50, seed=0):
+    """Feature matrix shaped like prepare_content_features: one-hot type/location + scaled numerics"""
+    rng = np.random.default_rng(seed)
+    types = rng.integers(0, len(PROPERTY_TYPES), num_properties)
+    locations = rng.integers(0, num_locations, num_properties)
+
+    features = np.zeros((num_properties, len(PROPERTY_TYPES) + num_locations + 3))
+    features[np.arange(num_properties), types] = 1.0
+    features[np.arange(num_properties), len(PROPERTY_TYPES) + locations] = 1.0
+    features[:, -3:] = rng.standard_normal((num_properties, 3))
+    return features
+
+def synthetic_queries(features, num_queries, history=5, seed=1):
+    """User-profile style queries: means of a few random property vectors"""
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(features), (num_queries, history))
+    return features[rows].mean(axis=1)
+
+def timed_search(index, queries, k, **params):
+    """Run every query, returning the result ids and per-query latency in ms"""
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        found = index.search(query, k, **params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append({item_id for item_id, _ in found})
+    return results, np.array(latencies)
+
+def run_benchmark(num_properties, num_queries=200, k=10, n_lists=None, probes=(1, 2, 4, 8, 16, 32)):
+    """Measure recall@k and latency of IVF search against brute force"""
+    features = synthetic_features(num_properties)
+    queries = synthetic_queries(features, num_queries)
+    ids = np.arange(num_properties)
+
+    exact = ExactIndex().fit(ids, features)
+    truth, exact_latency = timed_search(exact, queries, k)
+
+    start = time.perf_counter()
+    ivf = IVFIndex(n_lists=n_lists).fit(ids, features)
+    build_seconds = time.perf_counter() - start
+
+    report = {
+        'num_properties': num_properties,
+        'num_queries': num_queries,
+        'k': k,
+        'n_lists': len(ivf.lists),
+        'build_seconds': round(build_seconds, 3),
+        'exact': {
+            'p50_ms': round(float(np.percentile(exact_latency, 50)), 3),
+            'p95_ms': round(float(np.percentile(exact_latency, 95)), 3)
+        },
+        'ivf': []
+    }
+    for n_probe in probes:
+        if n_probe > len(ivf.lists):
+            break
+        found, latency = timed_search(ivf, queries, k, n_probe=n_probe)
+        recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+        report['ivf'].append({
+            'n_probe': n_probe,
+            f'recall@{k}': round(float(recall), 4),
+            'p50_ms': round(float(np.percentile(latency, 50)), 3),
+            'p95_ms': round(float(np.percentile(latency, 95)), 3)
+        })
+    return report
+
+def main():
+    """Print recall@K / latency tables for the IVF content index"""
+    parser = argparse.ArgumentParser(description='Benchmark IVF content search against brute force')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--lists', type=int, default=None, help='IVF partitions (default: sqrt(size))')
+    parser.add_argument('--probes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--json', help='Write the full report to this file')
+    args = parser.parse_args()
+
+    reports = []
+    for size in args.sizes:
+        report = run_benchmark(size, args.queries, args.k, args.lists, args.probes)
+        reports.append(report)
+
+        print(f"\n=== {size} properties, {report['n_lists']} lists (built in {report['build_seconds']}s) ===")
+        print(f"exact     p50 {report['exact']['p50_ms']:8.3f} ms  p95 {report['exact']['p95_ms']:8.3f} ms")
+        for row in report['ivf']:
+            print(f"n_probe {row['n_probe']:3d}  p50 {row['p50_ms']:8.3f} ms  p95 {row['p95_ms']:8.3f} ms  "
+                  f"recall@{args.k} {row[f'recall@{args.k}']:.3f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+if __name__ == '__main__':
+    main()
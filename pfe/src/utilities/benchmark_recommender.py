@@ -0,0 +1,302 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import logging
+import generate_synthetic_data
+
+# Configure logging
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = ['100x50x1000', '5000x1000x100000']
+
+# Fixed end of the generated timestamp range, so runs with one seed see identical data
+END_TIME = 1767225600
+
+# Engine hot paths timed per call, and the API endpoints timed in HTTP mode
+ENGINE_PATHS = ('collaborative_filtering', 'content_based_filtering', 'hybrid_recommendations',
+                'get_similar_properties', 'get_trending_properties')
+HTTP_PATHS = {
+    'recommendations_collaborative': '/recommendations?user_id={user}&type=collaborative&n={n}',
+    'recommendations_content': '/recommendations?user_id={user}&type=content&n={n}',
+    'recommendations_hybrid': '/recommendations?user_id={user}&type=hybrid&n={n}',
+    'similar_properties': '/similar-properties?property_id={property}&n={n}',
+    'trending_properties': '/trending-properties?n={n}'
+}
+
+# Metrics where a larger value is a regression, and where a smaller one is
+HIGHER_IS_WORSE = ('p50_ms', 'p95_ms', 'p99_ms')
+LOWER_IS_WORSE = ('throughput_per_s',)
+
+def parse_size(text):
+    """USERSxPROPERTIESxINTERACTIONS, e.g. 5000x1000x100000"""
+    users, properties, interactions = (int(part) for part in text.lower().split('x'))
+    return users, properties, interactions
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def latency_summary(latencies, elapsed):
+    """Percentiles (ms) and throughput of a list of per-call latencies in seconds"""
+    latencies = np.asarray(latencies) * 1000
+    return {
+        'calls': len(latencies),
+        'mean_ms': round(float(latencies.mean()), 3),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'throughput_per_s': round(len(latencies) / elapsed, 2) if elapsed > 0 else None
+    }
+
+def timed_calls(fn, arguments):
+    """Call fn once per argument after one warm-up call; returns latency_summary"""
+    fn(arguments[0])
+    latencies = []
+    start = time.perf_counter()
+    for argument in arguments:
+        call_start = time.perf_counter()
+        fn(argument)
+        latencies.append(time.perf_counter() - call_start)
+    return latency_summary(latencies, time.perf_counter() - start)
+
+def generate_dataset(directory, size, seed):
+    """Write the synthetic CSVs for one grid point"""
+    users, properties, interactions = size
+    generate_synthetic_data.generate(directory, users, properties, interactions, seed=seed, end_time=END_TIME)
+
+def benchmark_engine(directory, size, calls, repeats, n, seed):
+    """Time data loading and each engine hot path on one dataset (run in a child process)"""
+    from enhanced_recommender import PropertyRecommendationEngine
+
+    files = [os.path.join(directory, name) for name in (
+        generate_synthetic_data.USERS_FILE, generate_synthetic_data.PROPERTIES_FILE,
+        generate_synthetic_data.INTERACTIONS_FILE
+    )]
+    paths = {}
+    load_times, prepare_times = [], []
+    for _ in range(repeats):
+        engine = PropertyRecommendationEngine(sparse=True)
+        start = time.perf_counter()
+        if not engine.load_data(*files):
+            raise Exception("Failed to load benchmark data")
+        load_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        if not engine.prepare_content_features():
+            raise Exception("Failed to prepare content features")
+        prepare_times.append(time.perf_counter() - start)
+    paths['load_data'] = latency_summary(load_times, sum(load_times))
+    paths['prepare_content_features'] = latency_summary(prepare_times, sum(prepare_times))
+
+    rng = np.random.default_rng(seed)
+    users = list(rng.choice(np.asarray(engine.user_ids, dtype=object), calls))
+    properties = list(rng.choice(engine.df_properties['property_id'].to_numpy(dtype=object), calls))
+    targets = {
+        'collaborative_filtering': (lambda user: engine.collaborative_filtering(user, n), users),
+        'content_based_filtering': (lambda user: engine.content_based_filtering(user, n), users),
+        'hybrid_recommendations': (lambda user: engine.hybrid_recommendations(user, n), users),
+        'get_similar_properties': (lambda prop: engine.get_similar_properties(prop, n), properties),
+        'get_trending_properties': (lambda _: engine.get_trending_properties(n), users)
+    }
+    for name in ENGINE_PATHS:
+        fn, arguments = targets[name]
+        paths[name] = timed_calls(fn, arguments)
+    return {'paths': paths, 'peak_rss_mb': peak_rss_mb()}
+
+def benchmark_app(directory, calls, n, seed, use_cache):
+    """Time the API endpoints through the Flask test client (run in a child process)"""
+    # The API reads its settings at import and its data files from the working directory
+    os.chdir(directory)
+    if not use_cache:
+        os.environ['RECOMMENDER_CACHE_SIZE'] = '0'
+    import recommendation_api
+
+    start = time.perf_counter()
+    if not recommendation_api.initialize_engine():
+        raise Exception("Failed to initialize the recommendation API")
+    startup_seconds = time.perf_counter() - start
+
+    engine = recommendation_api.recommendation_engine
+    client = recommendation_api.app.test_client()
+    rng = np.random.default_rng(seed)
+    users = list(rng.choice(np.asarray(engine.user_ids, dtype=object), calls))
+    properties = list(rng.choice(engine.df_properties['property_id'].to_numpy(dtype=object), calls))
+
+    def fetch(url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise Exception(f"{url} answered {response.status_code}")
+
+    paths = {}
+    for name, template in HTTP_PATHS.items():
+        urls = [template.format(user=user, property=prop, n=n) for user, prop in zip(users, properties)]
+        paths[name] = timed_calls(fetch, urls)
+    return {'paths': paths, 'startup_seconds': round(startup_seconds, 3), 'peak_rss_mb': peak_rss_mb()}
+
+def benchmark_url(base_url, calls, n, seed, concurrency, num_users, num_properties):
+    """Load a running API server with concurrent requests to each endpoint"""
+    rng = np.random.default_rng(seed)
+    users = [f'user_{i}' for i in rng.integers(1, num_users + 1, calls)]
+    properties = [f'property_{i}' for i in rng.integers(1, num_properties + 1, calls)]
+
+    def fetch(url):
+        start = time.perf_counter()
+        with urllib.request.urlopen(base_url.rstrip('/') + url, timeout=60) as response:
+            response.read()
+        return time.perf_counter() - start
+
+    paths = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for name, template in HTTP_PATHS.items():
+            urls = [template.format(user=user, property=prop, n=n) for user, prop in zip(users, properties)]
+            fetch(urls[0])
+            start = time.perf_counter()
+            latencies = list(executor.map(fetch, urls))
+            paths[name] = latency_summary(latencies, time.perf_counter() - start)
+            paths[name]['concurrency'] = concurrency
+    return {'paths': paths}
+
+def run_isolated(fn, *args):
+    """Run fn in a fresh child process so peak RSS and module state are per grid point"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork')) as executor:
+        return executor.submit(fn, *args).result()
+
+def environment():
+    """Versions and machine details recorded with every report"""
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+def run_benchmarks(sizes, modes, calls=200, repeats=3, n=10, seed=0, use_cache=False):
+    """Run every mode on every grid size; returns the report dict"""
+    report = {'environment': environment(), 'settings': {
+        'calls': calls, 'repeats': repeats, 'n': n, 'seed': seed, 'cache': use_cache
+    }, 'results': []}
+    for label in sizes:
+        size = parse_size(label)
+        directory = tempfile.mkdtemp(prefix='recommender-bench-')
+        try:
+            start = time.perf_counter()
+            run_isolated(generate_dataset, directory, size, seed)
+            print(f"Generated {label} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+            for mode in modes:
+                if mode == 'engine':
+                    result = run_isolated(benchmark_engine, directory, size, calls, repeats, n, seed)
+                else:
+                    result = run_isolated(benchmark_app, directory, calls, n, seed, use_cache)
+                report['results'].append({'size': label, 'mode': mode, **result})
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return report
+
+def result_key(result):
+    return result['size'], result['mode']
+
+def compare_reports(current, baseline, threshold=0.2):
+    """Relative change of every shared metric; regressions are changes for the worse above threshold"""
+    baseline_results = {result_key(result): result for result in baseline['results']}
+    changes = []
+    for result in current['results']:
+        previous = baseline_results.get(result_key(result))
+        if previous is None:
+            continue
+        for path, metrics in result['paths'].items():
+            old_metrics = previous['paths'].get(path)
+            if old_metrics is None:
+                continue
+            for metric in HIGHER_IS_WORSE + LOWER_IS_WORSE:
+                old, new = old_metrics.get(metric), metrics.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                worse = change if metric in HIGHER_IS_WORSE else -change
+                changes.append({
+                    'size': result['size'], 'mode': result['mode'], 'path': path, 'metric': metric,
+                    'baseline': old, 'current': new, 'change': round(change, 4),
+                    'regression': worse > threshold
+                })
+    return changes
+
+def print_report(report):
+    for result in report['results']:
+        extra = f", startup {result['startup_seconds']}s" if 'startup_seconds' in result else ''
+        peak = f", peak RSS {result['peak_rss_mb']} MB" if 'peak_rss_mb' in result else ''
+        print(f"\n=== {result['size']} ({result['mode']}{extra}{peak}) ===")
+        for path, metrics in result['paths'].items():
+            print(f"{path:32s} p50 {metrics['p50_ms']:9.3f} ms  p95 {metrics['p95_ms']:9.3f} ms  "
+                  f"p99 {metrics['p99_ms']:9.3f} ms  {metrics['throughput_per_s'] or 0:10.1f}/s")
+
+def main():
+    """Benchmark the engine hot paths and API endpoints across synthetic data sizes"""
+    parser = argparse.ArgumentParser(description='Benchmark the recommendation engine and API')
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES,
+                        help='Grid of USERSxPROPERTIESxINTERACTIONS sizes')
+    parser.add_argument('--modes', nargs='+', choices=['engine', 'http'], default=['engine'],
+                        help='engine: direct method calls; http: API endpoints via the Flask test client')
+    parser.add_argument('--calls', type=int, default=200, help='Timed calls per path')
+    parser.add_argument('--repeats', type=int, default=3, help='Timed load_data/prepare_content_features runs')
+    parser.add_argument('-n', type=int, default=10, help='Recommendations per call')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cache', action='store_true', help='Keep the API result cache on in http mode')
+    parser.add_argument('--url', help='Load a running API server at this base URL instead of the grid')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent requests with --url')
+    parser.add_argument('--url-users', type=int, default=100, help='user_1..user_N are requested with --url')
+    parser.add_argument('--url-properties', type=int, default=50,
+                        help='property_1..property_N are requested with --url')
+    parser.add_argument('--json', help='Write the full report to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare with an earlier --json report')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative slowdown reported as a regression with --compare')
+    args = parser.parse_args()
+    # Keep the engine's per-call INFO logging out of the timings
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.url:
+        report = {'environment': environment(), 'settings': {
+            'calls': args.calls, 'n': args.n, 'seed': args.seed, 'url': args.url
+        }, 'results': [{
+            'size': args.url, 'mode': 'url',
+            **benchmark_url(args.url, args.calls, args.n, args.seed, args.concurrency,
+                            args.url_users, args.url_properties)
+        }]}
+    else:
+        report = run_benchmarks(args.sizes, args.modes, args.calls, args.repeats, args.n, args.seed, args.cache)
+    print_report(report)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        report['comparison'] = compare_reports(report, baseline, args.threshold)
+        regressions = [change for change in report['comparison'] if change['regression']]
+        print(f"\n=== Compared with {args.compare} ({len(regressions)} regressions over {args.threshold:.0%}) ===")
+        for change in report['comparison']:
+            flag = '  REGRESSION' if change['regression'] else ''
+            print(f"{change['size']:>20s} {change['mode']:6s} {change['path']:32s} {change['metric']:16s} "
+                  f"{change['baseline']:>10} -> {change['current']:>10} ({change['change']:+.1%}){flag}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,298 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import logging
+from similarity_index import PropertySimilarityIndex
+from matrix_factorization import ImplicitALS
+from ann_index import load_index
+from trending import TrendingCounters, COUNTERS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STATE_FORMAT = 'property-recommender-state'
+STATE_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+
+def _file_sha256(path):
+    """SHA-256 of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _column_array(series):
+    """Fixed-width NumPy array for a frame column (strings become unicode, not objects)"""
+    if series.dtype == object or pd.api.types.is_string_dtype(series):
+        return series.astype(str).to_numpy(dtype=str)
+    return series.to_numpy()
+
+def _encode_frame(frame, prefix, arrays):
+    """Store each column of a frame as its own array, returning the column order"""
+    for column in frame.columns:
+        arrays[f'{prefix}.{column}'] = _column_array(frame[column])
+    return list(frame.columns)
+
+def _decode_frame(columns, prefix, arrays):
+    """Rebuild a frame from per-column arrays"""
+    return pd.DataFrame({column: arrays[f'{prefix}.{column}'] for column in columns})
+
+def _encode_csr(matrix, prefix, arrays):
+    """Store the arrays of a CSR matrix under prefix"""
+    arrays[f'{prefix}.indptr'] = matrix.indptr
+    arrays[f'{prefix}.indices'] = matrix.indices
+    arrays[f'{prefix}.data'] = matrix.data
+
+def _decode_csr(prefix, arrays, shape):
+    """CSR matrix over the arrays stored by _encode_csr"""
+    return sparse.csr_matrix(
+        (arrays[f'{prefix}.data'], arrays[f'{prefix}.indices'], arrays[f'{prefix}.indptr']), shape=shape
+    )
+
+def save_state(engine, path):
+    """Persist a prepared engine as a directory of .npy arrays plus a manifest
+
+    The manifest is the header: format name and version, data version,
+    column layouts, fitted StandardScaler parameters and a SHA-256 per array.
+    Arrays are written uncompressed so load_state can memory-map them.
+    Prepared indexes and models (similarity index, content index, item
+    neighbors, MF factors) and the derived event state (trending counters,
+    pair event times, recency-weighted ratings) are stored too when the
+    engine has them, so processes that load the state map them instead of
+    rebuilding or recounting their own.
+    """
+    interactions = engine.all_interactions()
+    user_codes = engine.user_ids.get_indexer(interactions['user_id']).astype(np.int32)
+    item_codes = engine.item_ids.get_indexer(interactions['property_id']).astype(np.int32)
+    type_codes, type_names = pd.factorize(interactions['interaction_type'], sort=True)
+    extra_columns = [
+        column for column in interactions.columns
+        if column not in ('user_id', 'property_id', 'interaction_type')
+    ]
+
+    csc = engine.interaction_matrix_csc
+    arrays = {
+        'user_ids': np.asarray(engine.user_ids.astype(str), dtype=str),
+        'item_ids': np.asarray(engine.item_ids.astype(str), dtype=str),
+        'interactions.user_code': user_codes,
+        'interactions.item_code': item_codes,
+        'interactions.type_code': type_codes.astype(np.int8),
+        'interaction_types': np.asarray(type_names.astype(str), dtype=str),
+        'ratings.indptr': engine.interaction_matrix.indptr,
+        'ratings.indices': engine.interaction_matrix.indices,
+        'ratings.data': engine.interaction_matrix.data,
+        'ratings.counts': engine.interaction_counts.data,
+        'ratings_csc.indptr': csc.indptr,
+        'ratings_csc.indices': csc.indices,
+        'ratings_csc.data': csc.data,
+        'features.matrix': np.ascontiguousarray(engine.feature_matrix),
+        'features.index': np.asarray(engine.property_features.index.astype(str), dtype=str)
+    }
+    for column in extra_columns:
+        arrays[f'interactions.{column}'] = _column_array(interactions[column])
+    if engine.similarity_index is not None:
+        for name, array in engine.similarity_index.arrays().items():
+            arrays[f'similarity.{name}'] = array
+    if engine.content_index is not None:
+        for name, array in engine.content_index.arrays().items():
+            arrays[f'content.{name}'] = array
+    if engine.item_neighbors is not None:
+        _encode_csr(engine.item_neighbors, 'item_neighbors', arrays)
+    if engine.trending is not None:
+        for name in COUNTERS:
+            arrays[f'trending.{name}'] = engine.trending.counters[name]
+    if engine.pair_timestamps is not None:
+        _encode_csr(engine.pair_timestamps, 'pair_timestamps', arrays)
+    if engine.recency_ratings is not None:
+        _encode_csr(engine.recency_ratings, 'recency_ratings', arrays)
+        _encode_csr(engine.recency_indicator, 'recency_indicator', arrays)
+    if engine.mf_model is not None:
+        arrays['mf.user_factors'] = engine.mf_model.user_factors
+        arrays['mf.item_factors'] = engine.mf_model.item_factors
+    user_columns = _encode_frame(engine.df_users, 'users', arrays)
+    property_columns = _encode_frame(engine.df_properties, 'properties', arrays)
+
+    scaler = engine.scaler
+    manifest = {
+        'format': STATE_FORMAT,
+        'version': STATE_VERSION,
+        'data_version': engine.data_version,
+        'shape': list(engine.interaction_matrix.shape),
+        'user_columns': user_columns,
+        'property_columns': property_columns,
+        'interaction_columns': list(interactions.columns),
+        'feature_columns': [str(column) for column in engine.property_features.columns],
+        'scaler': {
+            'feature_names_in': [str(name) for name in scaler.feature_names_in_],
+            'mean': scaler.mean_.tolist(),
+            'scale': scaler.scale_.tolist(),
+            'var': scaler.var_.tolist(),
+            'n_samples_seen': int(scaler.n_samples_seen_)
+        },
+        'similarity': {'k': engine.similarity_index.k} if engine.similarity_index is not None else None,
+        'content_index': {
+            'backend': engine.content_index.backend,
+            'params': engine.content_index.params()
+        } if engine.content_index is not None else None,
+        'item_neighbors': {'k': engine.item_neighbors_k} if engine.item_neighbors is not None else None,
+        'trending': {
+            'half_life': engine.trending.half_life,
+            'reference': float(engine.trending.reference),
+            'refresh_seconds': engine.trending.refresh_seconds
+        } if engine.trending is not None else None,
+        'pair_timestamps': engine.pair_timestamps is not None,
+        'recency': {
+            'half_life': engine.recency_half_life,
+            'reference': float(engine.recency_reference)
+        } if engine.recency_ratings is not None else None,
+        'mf': {
+            'factors': engine.mf_model.factors,
+            'regularization': engine.mf_model.regularization,
+            'alpha': engine.mf_model.alpha,
+            'iterations': engine.mf_model.iterations
+        } if engine.mf_model is not None else None,
+        'arrays': {}
+    }
+
+    # Build in a sibling directory and swap it in, so readers never see a partial state
+    tmp_path = f"{path.rstrip(os.sep)}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, array in arrays.items():
+        file_name = f"{name}.npy"
+        np.save(os.path.join(tmp_path, file_name), array, allow_pickle=False)
+        manifest['arrays'][name] = {
+            'file': file_name,
+            'dtype': str(array.dtype),
+            'shape': list(array.shape),
+            'sha256': _file_sha256(os.path.join(tmp_path, file_name))
+        }
+    with open(os.path.join(tmp_path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    logger.info(f"Saved engine state to {path} ({len(arrays)} arrays, data version {engine.data_version})")
+
+def read_manifest(path):
+    """Read and validate the state header"""
+    with open(os.path.join(path, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != STATE_FORMAT:
+        raise ValueError(f"{path} is not a recommender state directory")
+    if manifest.get('version') != STATE_VERSION:
+        raise ValueError(f"Unsupported state version {manifest.get('version')} (expected {STATE_VERSION})")
+    return manifest
+
+def load_state(engine, path, mmap=True, verify=False):
+    """Restore a prepared engine from save_state output
+
+    With mmap=True the numeric arrays are memory-mapped read-only, so loading
+    costs page-table setup instead of parsing, and processes that map the
+    same state share its pages. verify=True re-hashes every array file.
+    """
+    manifest = read_manifest(path)
+    mmap_mode = 'r' if mmap else None
+
+    arrays = {}
+    for name, entry in manifest['arrays'].items():
+        file_path = os.path.join(path, entry['file'])
+        if verify and _file_sha256(file_path) != entry['sha256']:
+            raise ValueError(f"Checksum mismatch for {entry['file']} in {path}")
+        arrays[name] = np.load(file_path, mmap_mode=mmap_mode, allow_pickle=False)
+
+    engine.data_version = manifest['data_version']
+    engine.df_users = _decode_frame(manifest['user_columns'], 'users', arrays)
+    engine.df_properties = _decode_frame(manifest['property_columns'], 'properties', arrays)
+
+    # Interactions come back as categoricals over the stored codes, no string parsing
+    engine.user_ids = pd.Index(arrays['user_ids'].astype(object))
+    engine.item_ids = pd.Index(arrays['item_ids'].astype(object))
+    interaction_columns = {
+        'user_id': pd.Categorical.from_codes(arrays['interactions.user_code'], categories=engine.user_ids),
+        'property_id': pd.Categorical.from_codes(arrays['interactions.item_code'], categories=engine.item_ids),
+        'interaction_type': pd.Categorical.from_codes(
+            arrays['interactions.type_code'], categories=arrays['interaction_types'].astype(object)
+        )
+    }
+    engine.df_interactions = pd.DataFrame({
+        column: interaction_columns.get(column, arrays.get(f'interactions.{column}'))
+        for column in manifest['interaction_columns']
+    })
+
+    shape = tuple(manifest['shape'])
+    engine.user_index = {user_id: idx for idx, user_id in enumerate(engine.user_ids)}
+    engine.item_index = {prop_id: idx for idx, prop_id in enumerate(engine.item_ids)}
+    engine.interaction_matrix = sparse.csr_matrix(
+        (arrays['ratings.data'], arrays['ratings.indices'], arrays['ratings.indptr']), shape=shape
+    )
+    engine.interaction_counts = sparse.csr_matrix(
+        (arrays['ratings.counts'], arrays['ratings.indices'], arrays['ratings.indptr']), shape=shape
+    )
+    engine.interaction_matrix_csc = sparse.csc_matrix(
+        (arrays['ratings_csc.data'], arrays['ratings_csc.indices'], arrays['ratings_csc.indptr']), shape=shape
+    )
+    engine.rated_indicator = sparse.csr_matrix(
+        (np.ones(len(arrays['ratings.indices'])), arrays['ratings.indices'], arrays['ratings.indptr']), shape=shape
+    )
+
+    # Fitted scaler parameters
+    scaler_state = manifest['scaler']
+    engine.scaler.feature_names_in_ = np.array(scaler_state['feature_names_in'], dtype=object)
+    engine.scaler.n_features_in_ = len(scaler_state['feature_names_in'])
+    engine.scaler.mean_ = np.array(scaler_state['mean'])
+    engine.scaler.scale_ = np.array(scaler_state['scale'])
+    engine.scaler.var_ = np.array(scaler_state['var'])
+    engine.scaler.n_samples_seen_ = scaler_state['n_samples_seen']
+
+    engine.property_features = pd.DataFrame(
+        arrays['features.matrix'],
+        index=pd.Index(arrays['features.index'].astype(object), name='property_id'),
+        columns=manifest['feature_columns'],
+        copy=False
+    )
+    engine.feature_matrix = arrays['features.matrix']
+    engine.item_feature_rows = engine.property_features.index.get_indexer(engine.item_ids)
+    engine.attribute_index = None
+
+    # Optional prepared indexes and models
+    if manifest.get('similarity'):
+        engine.similarity_index = PropertySimilarityIndex.from_arrays(manifest['similarity']['k'], {
+            name: arrays[f'similarity.{name}'] for name in ('ids', 'vectors', 'active', 'neighbors', 'scores')
+        })
+    if manifest.get('content_index'):
+        engine.content_index = load_index(
+            manifest['content_index']['backend'], manifest['content_index']['params'],
+            {name[len('content.'):]: array for name, array in arrays.items() if name.startswith('content.')}
+        )
+    if manifest.get('item_neighbors'):
+        engine.item_neighbors = _decode_csr('item_neighbors', arrays, (shape[1], shape[1]))
+        engine.item_neighbors_k = manifest['item_neighbors']['k']
+
+    # Derived event state; load_state on the engine recounts it from the
+    # interactions when the state predates it
+    if manifest.get('trending'):
+        engine.trending_half_life = manifest['trending']['half_life']
+        engine.trending = engine.listed_trending(TrendingCounters(
+            engine.item_ids, {name: arrays[f'trending.{name}'] for name in COUNTERS}, **manifest['trending']
+        ))
+    if manifest.get('pair_timestamps'):
+        engine.pair_timestamps = _decode_csr('pair_timestamps', arrays, shape)
+    if manifest.get('recency'):
+        engine.recency_half_life = manifest['recency']['half_life']
+        engine.recency_reference = manifest['recency']['reference']
+        engine.recency_ratings = _decode_csr('recency_ratings', arrays, shape)
+        engine.recency_indicator = _decode_csr('recency_indicator', arrays, shape)
+    if manifest.get('mf'):
+        engine.mf_model = ImplicitALS(**manifest['mf'])
+        engine.mf_model.user_factors = arrays['mf.user_factors']
+        engine.mf_model.item_factors = arrays['mf.item_factors']
+
+    logger.info(f"Loaded engine state from {path}: {shape[0]} users x {shape[1]} properties, "
+                f"data version {engine.data_version}")
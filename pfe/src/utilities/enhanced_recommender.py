@@ -1,40 +1,135 @@
 import pandas as pd
 import numpy as np
+from scipy import sparse
+from pandas.api.types import union_categoricals
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.preprocessing import StandardScaler
 import sys
 import os
+import copy
+import json
+import time
+import argparse
+import hashlib
 import logging
+from similarity_index import PropertySimilarityIndex
+from ann_index import build_index
+from recommendation_snapshot import write_snapshot
+import engine_store
+from ranking import top_k, top_k_mask, top_k_rows, top_k_items
+from matrix_factorization import ImplicitALS
+from item_neighbors import (
+    build_item_neighbors, update_item_neighbors, column_norms, save_item_neighbors, load_item_neighbors
+)
+from trending import TrendingCounters, to_epoch_seconds, REBASE_HALF_LIVES
+from sparse_rows import take_rows, replace_rows, replace_columns
+from attribute_index import PropertyAttributeIndex
+import metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Confidence weight of each interaction type for implicit matrix factorization
+INTERACTION_WEIGHTS = {'view': 1.0, 'favorite': 3.0, 'contact': 5.0}
+
 class PropertyRecommendationEngine:
-    def __init__(self):
+    def __init__(self, sparse=False, cf_neighbors=None):
+        self.sparse = sparse
+        self.cf_neighbors = cf_neighbors
         self.df_users = None
         self.df_properties = None
         self.df_interactions = None
+        # Event frames ingested through with_interactions since the last load,
+        # kept beside df_interactions (see all_interactions)
+        self.interaction_log = ()
         self.rating_matrix = None
+        self.data_version = None
+        # property_id -> JSON-ready property record
+        self.property_records = {}
+        # Integer-coded interaction store (users x properties, CSR/CSC)
+        self.user_ids = None
+        self.user_index = {}
+        self.item_ids = None
+        self.item_index = {}
+        self.interaction_matrix = None
+        self.interaction_matrix_csc = None
+        self.interaction_counts = None
+        self.rated_indicator = None
+        # Users whose rows changed through with_interactions since the last load
+        self.updated_users = frozenset()
         self.property_features = None
+        # Float feature rows aligned with property_features, and the feature
+        # row of each rating-store column (-1 for properties without features)
+        self.feature_matrix = None
+        self.item_feature_rows = None
+        # Location/type/price/bedrooms index over feature rows, built on first filtered query
+        self.attribute_index = None
         self.tfidf_vectorizer = None
         self.scaler = StandardScaler()
+        self.similarity_index = None
+        self.content_index = None
+        self.mf_model = None
+        # Sparse properties x properties top-K co-rating similarities for item-based CF
+        self.item_neighbors = None
+        self.item_neighbors_k = None
+        # Column norms of the rating store, kept for incremental neighbor updates
+        self.item_norms = None
+        # Per-property interaction counters behind get_trending_properties,
+        # time-decayed when trending_half_life (seconds) is set
+        self.trending = None
+        self.trending_half_life = None
+        # Latest event time of every rated pair (same pattern as the rating
+        # store), when interactions carry timestamps
+        self.pair_timestamps = None
+        # Optional recency weighting of ratings in CF and content scoring:
+        # half life in seconds and the derived weighted matrices
+        self.recency_half_life = None
+        self.recency_reference = None
+        self.recency_ratings = None
+        self.recency_indicator = None
         
     def load_data(self, users_file='synthetic_users.csv', properties_file='synthetic_properties.csv', 
                   interactions_file='synthetic_interactions.csv'):
         """Load data from CSV files"""
         try:
-            self.df_users = pd.read_csv(users_file)
-            self.df_properties = pd.read_csv(properties_file)
-            self.df_interactions = pd.read_csv(interactions_file)
-            
-            # Create user-item rating matrix
-            self.rating_matrix = self.df_interactions.pivot_table(
-                index='user_id', 
-                columns='property_id', 
-                values='rating'
+            df_interactions = pd.read_csv(interactions_file)
+            if 'timestamp' in df_interactions:
+                df_interactions['timestamp'] = to_epoch_seconds(df_interactions['timestamp'])
+            return self.load_frames(
+                pd.read_csv(users_file),
+                pd.read_csv(properties_file),
+                df_interactions,
+                self.compute_data_version(users_file, properties_file, interactions_file)
             )
+        except Exception as e:
+            logger.error(f"Error loading data: {e}")
+            return False
+    
+    def load_frames(self, df_users, df_properties, df_interactions, data_version):
+        """Load data from in-memory frames (user and property id columns may be categoricals)"""
+        try:
+            self.df_users = df_users
+            self.df_properties = df_properties
+            self.df_interactions = df_interactions
+            self.interaction_log = ()
+            self.item_norms = None
+            self.data_version = data_version
+            
+            # Create sparse user-item rating store
+            self.build_interaction_store()
+            self.build_property_records()
+            self.build_event_state()
+            
+            # Dense user-item rating matrix is only kept outside sparse mode
+            if not self.sparse:
+                self.rating_matrix = self.df_interactions.pivot_table(
+                    index='user_id', 
+                    columns='property_id', 
+                    values='rating',
+                    observed=True
+                )
             
             logger.info(f"Loaded {len(self.df_users)} users, {len(self.df_properties)} properties, {len(self.df_interactions)} interactions")
             return True
@@ -42,6 +137,410 @@ class PropertyRecommendationEngine:
             logger.error(f"Error loading data: {e}")
             return False
     
+    def save_state(self, path):
+        """Persist the prepared engine to a memory-mappable binary state directory"""
+        try:
+            engine_store.save_state(self, path)
+            return True
+        except Exception as e:
+            logger.error(f"Error saving engine state to {path}: {e}")
+            return False
+    
+    def load_state(self, path, mmap=True, verify=False):
+        """Load a prepared engine from save_state output instead of CSVs
+        
+        Replaces both load_data and prepare_content_features. The event
+        state (trending counters, pair event times, recency weights) is
+        recounted from the interactions only if the state does not carry it.
+        """
+        try:
+            self.trending = self.pair_timestamps = None
+            self.recency_ratings = self.recency_indicator = None
+            engine_store.load_state(self, path, mmap=mmap, verify=verify)
+            self.interaction_log = ()
+            self.item_norms = None
+            self.build_property_records()
+            if self.trending is None:
+                self.build_event_state()
+            elif self.recency_ratings is None:
+                self.refresh_recency()
+            
+            if not self.sparse:
+                self.rating_matrix = self.df_interactions.pivot_table(
+                    index='user_id', 
+                    columns='property_id', 
+                    values='rating',
+                    observed=True
+                )
+            return True
+        except Exception as e:
+            logger.error(f"Error loading engine state from {path}: {e}")
+            return False
+    
+    def all_interactions(self):
+        """df_interactions with the interaction_log appended, as one frame
+        
+        Categorical columns (as loaded by load_state) stay categorical, with
+        the categories of the new ids added. Costs a pass over the full
+        history, so only full rebuilds and saves use it.
+        """
+        if not self.interaction_log:
+            return self.df_interactions
+        frames = [self.df_interactions, *self.interaction_log]
+        columns = {}
+        for column in self.df_interactions.columns:
+            if isinstance(self.df_interactions[column].dtype, pd.CategoricalDtype):
+                columns[column] = union_categoricals([pd.Categorical(frame[column]) for frame in frames])
+            else:
+                columns[column] = pd.concat([frame[column] for frame in frames], ignore_index=True)
+        return pd.DataFrame(columns)
+    
+    @staticmethod
+    def compute_data_version(*files):
+        """Content hash of the input files, used to tag derived artifacts"""
+        digest = hashlib.sha1()
+        for path in files:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+        return digest.hexdigest()[:16]
+    
+    def build_interaction_store(self):
+        """Build integer-coded CSR/CSC rating matrices from df_interactions"""
+        # Sorted codes keep the same user/property order as pivot_table
+        user_codes, user_ids = pd.factorize(self.df_interactions['user_id'], sort=True)
+        item_codes, item_ids = pd.factorize(self.df_interactions['property_id'], sort=True)
+        # Plain id indexes, also when the id columns are categoricals
+        self.user_ids = pd.Index(user_ids.astype(object))
+        self.item_ids = pd.Index(item_ids.astype(object))
+        self.user_index = {user_id: idx for idx, user_id in enumerate(self.user_ids)}
+        self.item_index = {prop_id: idx for idx, prop_id in enumerate(self.item_ids)}
+        
+        shape = (len(self.user_ids), len(self.item_ids))
+        ratings = self.df_interactions['rating'].to_numpy(dtype=np.float64)
+        
+        # Duplicate (user, property) pairs are summed by tocsr(); dividing by
+        # the pair counts gives the same mean rating as pivot_table
+        rating_sums = sparse.coo_matrix((ratings, (user_codes, item_codes)), shape=shape).tocsr()
+        self.interaction_counts = sparse.coo_matrix(
+            (np.ones(len(ratings), dtype=np.float64), (user_codes, item_codes)), shape=shape
+        ).tocsr()
+        rating_sums.sort_indices()
+        self.interaction_counts.sort_indices()
+        
+        self.interaction_matrix = rating_sums.copy()
+        self.interaction_matrix.data = rating_sums.data / self.interaction_counts.data
+        self.interaction_matrix_csc = self.interaction_matrix.tocsc()
+        
+        # 0/1 matrix of rated pairs, used as the CF normalizer
+        self.rated_indicator = self.interaction_matrix.copy()
+        self.rated_indicator.data = np.ones_like(self.rated_indicator.data)
+        
+        logger.info(f"Built sparse rating store: {shape[0]} users x {shape[1]} properties, "
+                    f"{self.interaction_matrix.nnz} ratings")
+    
+    @staticmethod
+    def pair_timestamp_matrix(user_codes, item_codes, timestamps, shape):
+        """Sparse users x properties matrix of the latest event time of each coded (user, property) pair"""
+        user_codes = np.asarray(user_codes, dtype=np.int64)
+        item_codes = np.asarray(item_codes, dtype=np.int64)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        
+        # Sort by pair, then time, and keep each pair's last event
+        pairs = user_codes * shape[1] + item_codes
+        order = np.lexsort((timestamps, pairs))
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = pairs[order][1:] != pairs[order][:-1]
+        order = order[last]
+        latest = sparse.csr_matrix((timestamps[order], (user_codes[order], item_codes[order])), shape=shape)
+        latest.sort_indices()
+        return latest
+    
+    def build_event_state(self):
+        """Build the trending counters and, for timestamped data, per-pair event times"""
+        self.trending = self.listed_trending(TrendingCounters.from_interactions(
+            self.df_interactions, self.item_ids, half_life=self.trending_half_life
+        ))
+        self.pair_timestamps = None
+        if 'timestamp' in self.df_interactions:
+            self.pair_timestamps = self.pair_timestamp_matrix(
+                self.user_ids.get_indexer(self.df_interactions['user_id']),
+                self.item_ids.get_indexer(self.df_interactions['property_id']),
+                self.df_interactions['timestamp'],
+                self.interaction_matrix.shape
+            )
+        self.refresh_recency()
+    
+    def set_trending_half_life(self, half_life):
+        """Time-decay trending counters with this half life in seconds (None counts every event once)"""
+        self.trending_half_life = half_life
+        self.trending = self.listed_trending(
+            TrendingCounters.from_interactions(self.all_interactions(), self.item_ids, half_life=half_life)
+        )
+    
+    def listed_trending(self, trending):
+        """Trending counters that never rank properties without a listing (removed or never listed)"""
+        if trending is None or self.item_feature_rows is None:
+            return trending
+        return trending.excluding(self.item_feature_rows < 0)
+    
+    def set_recency_half_life(self, half_life):
+        """Weight ratings by the age of the pair's latest event in CF and content scoring
+        
+        A rating half_life seconds older than the newest event counts half as
+        much. None turns weighting off; data without timestamps is unweighted.
+        """
+        self.recency_half_life = half_life
+        self.refresh_recency()
+    
+    def refresh_recency(self):
+        """Recompute the recency-weighted rating and indicator matrices"""
+        if not self.recency_half_life or self.pair_timestamps is None:
+            self.recency_ratings = self.recency_indicator = None
+            return
+        # Ages are measured from the newest event at this refresh, which
+        # with_interactions keeps as the reference; a common factor cancels
+        # out of every weighted mean, so only relative ages matter
+        self.recency_reference = self.pair_timestamps.data.max() if self.pair_timestamps.nnz else 0.0
+        self.recency_indicator = self.recency_weights(self.pair_timestamps)
+        self.recency_ratings = self.interaction_matrix.multiply(self.recency_indicator).tocsr()
+        self.recency_ratings.sort_indices()
+    
+    def recency_weights(self, pair_timestamps):
+        """Recency weight of each pair of a pair_timestamps block, relative to recency_reference"""
+        weights = pair_timestamps.copy()
+        weights.data = np.exp2((weights.data - self.recency_reference) / self.recency_half_life)
+        return weights
+    
+    def cf_matrices(self):
+        """(ratings, indicator) used by CF predictions: recency-weighted when enabled"""
+        if self.recency_ratings is not None:
+            return self.recency_ratings, self.recency_indicator
+        return self.interaction_matrix, self.rated_indicator
+    
+    def cf_column_matrices(self, columns):
+        """cf_matrices restricted to rating-store columns
+        
+        Sliced from the column-major rating store when recency weighting is
+        off, so the cost follows the ratings of those columns only.
+        """
+        if self.recency_ratings is not None:
+            return self.recency_ratings[:, columns], self.recency_indicator[:, columns]
+        ratings = self.interaction_matrix_csc[:, columns]
+        indicator = ratings.copy()
+        indicator.data = np.ones_like(indicator.data)
+        return ratings, indicator
+    
+    def build_property_records(self):
+        """Index df_properties rows by property_id as JSON-ready dicts"""
+        # to_dict('records') converts NumPy scalars to native Python values
+        self.property_records = {
+            record['property_id']: record
+            for record in self.df_properties.to_dict('records')
+        }
+    
+    def refresh_feature_arrays(self):
+        """Recompute the float feature matrix and rating-store column to feature-row map"""
+        self.feature_matrix = np.asarray(self.property_features.values, dtype=np.float64)
+        self.item_feature_rows = self.property_features.index.get_indexer(self.item_ids)
+        self.attribute_index = None
+        self.trending = self.listed_trending(self.trending)
+    
+    def property_candidates(self, filters):
+        """Feature rows of the listings matching attribute filters; None without filters
+        
+        filters holds keyword arguments of PropertyAttributeIndex.candidates,
+        e.g. {'location': ['CityA'], 'max_price': 500000}.
+        """
+        if not filters:
+            return None
+        with metrics.stage('prefilter'):
+            index = self.attribute_index
+            if index is None:
+                index = self.attribute_index = PropertyAttributeIndex.from_frame(
+                    self.df_properties, self.property_features.index
+                )
+            rows = index.candidates(**filters)
+        metrics.candidates('prefilter', len(rows))
+        return rows
+    
+    def candidate_columns(self, filters):
+        """Sorted rating-store columns of the listings matching attribute filters; None without filters"""
+        rows = self.property_candidates(filters)
+        if rows is None:
+            return None
+        columns = self.item_ids.get_indexer(self.property_features.index[rows])
+        return np.sort(columns[columns >= 0])
+    
+    def user_history(self, user_idx):
+        """Feature rows and mean ratings of the properties a user interacted with
+        
+        Read straight from the user's CSR row, so the cost scales with the
+        user's history rather than the interaction table.
+        """
+        start, end = self.interaction_matrix.indptr[user_idx], self.interaction_matrix.indptr[user_idx + 1]
+        feature_rows = self.item_feature_rows[self.interaction_matrix.indices[start:end]]
+        ratings = self.interaction_matrix.data[start:end]
+        known = feature_rows >= 0
+        return feature_rows[known], ratings[known]
+    
+    def profile_weights(self, user_idx):
+        """Feature rows of a user's properties and their profile weights (rating/5, times recency)"""
+        feature_rows, ratings = self.user_history(user_idx)
+        weights = ratings / 5.0
+        if self.recency_indicator is not None:
+            start, end = self.recency_indicator.indptr[user_idx], self.recency_indicator.indptr[user_idx + 1]
+            known = self.item_feature_rows[self.recency_indicator.indices[start:end]] >= 0
+            weights = weights * self.recency_indicator.data[start:end][known]
+        return feature_rows, weights
+    
+    def with_interactions(self, events):
+        """Return a new engine with interaction events appended
+        
+        Only the delta is encoded: new users/properties get codes after the
+        existing ones, the rows of the users and the columns of the
+        properties in the batch are rebuilt from their old entries plus the
+        events, and spliced into copies of the rating store; no arithmetic
+        touches any other rating. The events are kept in interaction_log
+        beside df_interactions instead of being merged into it. Nothing on
+        this engine is modified, so it can keep serving until the caller
+        swaps the new one in.
+        """
+        try:
+            events = pd.DataFrame(events)
+            columns = ['user_id', 'property_id', 'rating', 'interaction_type']
+            if 'timestamp' in self.df_interactions:
+                # Events without a timestamp happened now
+                columns.append('timestamp')
+                if 'timestamp' not in events:
+                    events['timestamp'] = np.nan
+                events['timestamp'] = to_epoch_seconds(events['timestamp'])
+                events['timestamp'] = events['timestamp'].fillna(time.time())
+            # Ratings stay float64 even where the loaded column is integer, so
+            # fractional ratings are kept (all_interactions then widens the column)
+            events = events.reindex(columns=columns).astype({'rating': np.float64})
+            engine = copy.copy(self)
+            
+            # Extend the id tables; existing codes never change
+            new_users = [user_id for user_id in pd.unique(events['user_id']) if user_id not in self.user_index]
+            new_items = [prop_id for prop_id in pd.unique(events['property_id']) if prop_id not in self.item_index]
+            if new_users:
+                engine.user_ids = self.user_ids.append(pd.Index(new_users, dtype=object))
+                engine.user_index = {**self.user_index, **{
+                    user_id: len(self.user_ids) + i for i, user_id in enumerate(new_users)
+                }}
+            if new_items:
+                engine.item_ids = self.item_ids.append(pd.Index(new_items, dtype=object))
+                engine.item_index = {**self.item_index, **{
+                    prop_id: len(self.item_ids) + i for i, prop_id in enumerate(new_items)
+                }}
+                engine.item_feature_rows = np.concatenate([
+                    self.item_feature_rows, self.property_features.index.get_indexer(new_items)
+                ])
+            
+            shape = (len(engine.user_ids), len(engine.item_ids))
+            user_codes = np.fromiter((engine.user_index[user_id] for user_id in events['user_id']),
+                                     dtype=np.int64, count=len(events))
+            item_codes = np.fromiter((engine.item_index[prop_id] for prop_id in events['property_id']),
+                                     dtype=np.int64, count=len(events))
+            ratings = events['rating'].to_numpy(dtype=np.float64)
+            
+            # Rows of the users in the batch: old rating sums and pair counts
+            # plus the events, then the pair means
+            rows, local_rows = np.unique(user_codes, return_inverse=True)
+            block_shape = (len(rows), shape[1])
+            old_counts = take_rows(self.interaction_counts, rows, shape[1])
+            old_means = take_rows(self.interaction_matrix, rows, shape[1])
+            pairs = (
+                np.concatenate([np.repeat(np.arange(len(rows)), np.diff(old_counts.indptr)), local_rows]),
+                np.concatenate([old_counts.indices, item_codes])
+            )
+            counts = sparse.csr_matrix(
+                (np.concatenate([old_counts.data, np.ones(len(events))]), pairs), shape=block_shape
+            )
+            sums = sparse.csr_matrix(
+                (np.concatenate([old_means.data * old_counts.data, ratings]), pairs), shape=block_shape
+            )
+            counts.sort_indices()
+            sums.sort_indices()
+            means = counts.copy()
+            means.data = sums.data / counts.data
+            indicator = counts.copy()
+            indicator.data = np.ones_like(indicator.data)
+            
+            engine.interaction_counts = replace_rows(self.interaction_counts, rows, counts, shape)
+            engine.interaction_matrix = replace_rows(self.interaction_matrix, rows, means, shape)
+            engine.rated_indicator = replace_rows(self.rated_indicator, rows, indicator, shape)
+            
+            # Columns of the properties in the batch: other users' ratings plus the new rows
+            touched = np.unique(item_codes)
+            old_columns = take_rows(self.interaction_matrix_csc.T, touched, shape[0]).tocoo()
+            others = ~np.isin(old_columns.col, rows)
+            fresh = means.tocoo()
+            in_batch = np.isin(fresh.col, touched)
+            column_block = sparse.csr_matrix((
+                np.concatenate([old_columns.data[others], fresh.data[in_batch]]),
+                (np.concatenate([old_columns.row[others], np.searchsorted(touched, fresh.col[in_batch])]),
+                 np.concatenate([old_columns.col[others], rows[fresh.row[in_batch]]]))
+            ), shape=(len(touched), shape[0]))
+            column_block.sort_indices()
+            engine.interaction_matrix_csc = replace_columns(self.interaction_matrix_csc, touched, column_block, shape)
+            
+            if self.item_neighbors is not None:
+                norms = self.item_norms if self.item_norms is not None else column_norms(self.interaction_matrix)
+                engine.item_neighbors, engine.item_norms = update_item_neighbors(
+                    self.item_neighbors, engine.interaction_matrix, engine.interaction_matrix_csc,
+                    norms, touched, self.item_neighbors_k
+                )
+            
+            # Merge tail frames of similar size so the log stays O(log n) frames long
+            log = [*self.interaction_log, events]
+            while len(log) > 1 and len(log[-2]) <= len(log[-1]):
+                log[-2:] = [pd.concat(log[-2:], ignore_index=True)]
+            engine.interaction_log = tuple(log)
+            if not self.sparse:
+                engine.rating_matrix = engine.all_interactions().pivot_table(
+                    index='user_id', columns='property_id', values='rating', observed=True
+                )
+            
+            engine.trending = engine.listed_trending(
+                self.trending.with_interactions(events, engine.item_ids, item_codes)
+            )
+            if self.pair_timestamps is not None:
+                latest = self.pair_timestamp_matrix(local_rows, item_codes, events['timestamp'], block_shape)
+                times = take_rows(self.pair_timestamps, rows, shape[1]).maximum(latest).tocsr()
+                times.sort_indices()
+                engine.pair_timestamps = replace_rows(self.pair_timestamps, rows, times, shape)
+                if self.recency_ratings is not None:
+                    if (times.data.max() - self.recency_reference) / self.recency_half_life > REBASE_HALF_LIVES:
+                        # New weights would grow too large: move the reference forward
+                        engine.refresh_recency()
+                    else:
+                        weights = self.recency_weights(times)
+                        weighted = means.multiply(weights).tocsr()
+                        weighted.sort_indices()
+                        engine.recency_indicator = replace_rows(self.recency_indicator, rows, weights, shape)
+                        engine.recency_ratings = replace_rows(self.recency_ratings, rows, weighted, shape)
+            engine.updated_users = self.updated_users | frozenset(events['user_id'])
+            batch_hash = hashlib.sha1(pd.util.hash_pandas_object(events, index=False).values.tobytes())
+            engine.data_version = self.next_data_version(batch_hash.hexdigest())
+            
+            logger.info(f"Ingested {len(events)} interactions ({len(new_users)} new users, "
+                        f"{len(new_items)} new properties), data version {engine.data_version}")
+            return engine
+        except Exception as e:
+            logger.error(f"Error ingesting interactions: {e}")
+            metrics.error('ingest_interactions')
+            return None
+    
+    def next_data_version(self, change):
+        """Data version of an engine derived from this one by a change described by the string change"""
+        return hashlib.sha1(f"{self.data_version}:{change}".encode()).hexdigest()[:16]
+    
+    def has_user(self, user_id):
+        """Check whether a user has a row in the rating store"""
+        return user_id in self.user_index
+    
     def prepare_content_features(self):
         """Prepare content-based features from property data"""
         try:
@@ -49,10 +548,10 @@ class PropertyRecommendationEngine:
             features = []
             
             # Property type (one-hot encoded)
-            property_types = pd.get_dummies(self.df_properties['type'], prefix='type')
+            property_types = pd.get_dummies(self.df_properties['type'], prefix='type', dtype=np.float64)
             
             # Location (one-hot encoded)
-            locations = pd.get_dummies(self.df_properties['location'], prefix='location')
+            locations = pd.get_dummies(self.df_properties['location'], prefix='location', dtype=np.float64)
             
             # Numerical features (normalized)
             numerical_features = self.df_properties[['price', 'bedrooms', 'bathrooms']].copy()
@@ -69,6 +568,7 @@ class PropertyRecommendationEngine:
             ], axis=1)
             
             self.property_features.index = self.df_properties['property_id']
+            self.refresh_feature_arrays()
             
             logger.info(f"Prepared {self.property_features.shape[1]} content features")
             return True
@@ -76,158 +576,639 @@ class PropertyRecommendationEngine:
             logger.error(f"Error preparing content features: {e}")
             return False
     
-    def collaborative_filtering(self, user_id, n=5):
-        """Collaborative filtering recommendations"""
+    def predict_ratings(self, user_rows, neighbors=None, columns=None):
+        """Predict ratings for a block of users as one similarity-weighted product
+        
+        Returns a (len(user_rows), n_properties) array; properties a user already
+        rated, or that no positively similar neighbor rated, are NaN. With
+        columns, only those rating-store columns are predicted, in that order.
+        """
+        user_rows = np.asarray(user_rows, dtype=np.int64)
+        neighbors = self.cf_neighbors if neighbors is None else neighbors
+        
+        # Cosine similarity with all users, keeping positive similarities only
+        with metrics.stage('cf_similarity'):
+            similarities = cosine_similarity(
+                self.interaction_matrix[user_rows], self.interaction_matrix, dense_output=True
+            )
+            similarities[np.arange(len(user_rows)), user_rows] = 0.0
+            np.maximum(similarities, 0.0, out=similarities)
+            
+            # Optional top-k neighbor cutoff
+            if neighbors and neighbors < similarities.shape[1]:
+                similarities[~top_k_mask(similarities, neighbors)] = 0.0
+        
+        # sum(sim * rating) / sum(sim) over the neighbors that rated each property
+        # (each rating also weighted by its recency when enabled)
+        with metrics.stage('cf_prediction'):
+            rated = self.rated_indicator[user_rows]
+            if columns is None:
+                ratings, indicator = self.cf_matrices()
+            else:
+                ratings, indicator = self.cf_column_matrices(columns)
+                rated = rated[:, columns]
+            weighted_sum = np.asarray((ratings.T @ similarities.T).T)
+            sim_sum = np.asarray((indicator.T @ similarities.T).T)
+            predictions = np.full(weighted_sum.shape, np.nan)
+            np.divide(weighted_sum, sim_sum, out=predictions, where=sim_sum > 0)
+            
+            # Exclude properties each user already rated
+            rated = rated.tocoo()
+            predictions[rated.row, rated.col] = np.nan
+        metrics.candidates('collaborative', np.count_nonzero(~np.isnan(predictions), axis=1))
+        return predictions
+    
+    def collaborative_filtering(self, user_id, n=5, neighbors=None, filters=None):
+        """Collaborative filtering recommendations, optionally among listings matching attribute filters"""
         try:
-            if user_id not in self.rating_matrix.index:
+            if not self.has_user(user_id):
                 logger.warning(f"User {user_id} not found in rating matrix")
                 return {}
             
-            # Fill missing values with 0
-            filled_matrix = self.rating_matrix.fillna(0)
+            columns = self.candidate_columns(filters)
+            predictions = self.predict_ratings([self.user_index[user_id]], neighbors, columns)[0]
             
-            # Calculate user similarity
-            user_idx = self.rating_matrix.index.get_loc(user_id)
-            user_vector = filled_matrix.iloc[user_idx].values.reshape(1, -1)
-            
-            # Calculate cosine similarity with all users
-            similarities = cosine_similarity(user_vector, filled_matrix)[0]
-            
-            # Get similar users (excluding self)
-            similar_users_idx = np.argsort(similarities)[::-1][1:]
-            similar_users = filled_matrix.index[similar_users_idx]
+            # Return top N recommendations
+            indices, scores = top_k(predictions, n)
+            if columns is not None:
+                indices = columns[indices]
+            return {self.item_ids[idx]: float(score) for idx, score in zip(indices, scores)}
             
-            # Get unrated properties for the target user
-            unrated_properties = self.rating_matrix.loc[user_id][
-                self.rating_matrix.loc[user_id].isna()
-            ].index
+        except Exception as e:
+            logger.error(f"Error in collaborative filtering: {e}")
+            metrics.error('collaborative_filtering')
+            return {}
+    
+    def build_item_neighbors(self, k=50):
+        """Precompute the top-K co-rated neighbors of every property for item-based CF"""
+        try:
+            self.item_neighbors = build_item_neighbors(self.interaction_matrix, k)
+            self.item_neighbors_k = k
+            self.item_norms = column_norms(self.interaction_matrix)
+            return True
+        except Exception as e:
+            logger.error(f"Error building item neighbors: {e}")
+            return False
+    
+    def with_item_neighbors(self, k=50):
+        """Return a new engine with item neighbors built, this engine if it has them at k, or None on failure"""
+        if self.item_neighbors is not None and self.item_neighbors_k == k:
+            return self
+        engine = copy.copy(self)
+        return engine if engine.build_item_neighbors(k) else None
+    
+    def save_item_neighbors(self, path):
+        """Write the item neighbor matrix, tagged with the data version"""
+        try:
+            save_item_neighbors(path, self.item_neighbors, self.item_ids, self.data_version, self.item_neighbors_k)
+            return True
+        except Exception as e:
+            logger.error(f"Error saving item neighbors to {path}: {e}")
+            return False
+    
+    def load_item_neighbors(self, path):
+        """Load item neighbors computed offline; they must match the loaded data version"""
+        try:
+            neighbors, item_ids, data_version, k = load_item_neighbors(path)
+            if data_version != self.data_version:
+                logger.warning(f"Item neighbors {path} were built on data version {data_version}, "
+                               f"not {self.data_version}")
+                return False
+            if not np.array_equal(item_ids, self.item_ids.astype(str)):
+                logger.warning(f"Item neighbors {path} id table does not match the rating store")
+                return False
+            self.item_neighbors = neighbors
+            self.item_neighbors_k = k
+            return True
+        except Exception as e:
+            logger.error(f"Error loading item neighbors from {path}: {e}")
+            return False
+    
+    def item_scores(self, user_rows, columns=None):
+        """Item-based predicted ratings for a block of users
+        
+        Each prediction is the similarity-weighted mean of the user's ratings
+        over the rated properties that list the candidate among their top-K
+        neighbors, so only the neighbor rows of rated properties are read.
+        Rated properties and properties with no such neighbor are NaN. With
+        columns, only those rating-store columns are scored, in that order.
+        """
+        user_rows = np.asarray(user_rows, dtype=np.int64)
+        with metrics.stage('item_scores'):
+            ratings, indicator = self.cf_matrices()
+            weighted_sum = ratings[user_rows] @ self.item_neighbors
+            sim_sum = indicator[user_rows] @ self.item_neighbors
+            rated = self.rated_indicator[user_rows]
+            if columns is not None:
+                # The products are as sparse as the users' neighborhoods
+                weighted_sum, sim_sum, rated = weighted_sum[:, columns], sim_sum[:, columns], rated[:, columns]
+            weighted_sum, sim_sum = weighted_sum.toarray(), sim_sum.toarray()
+            predictions = np.full(weighted_sum.shape, np.nan)
+            np.divide(weighted_sum, sim_sum, out=predictions, where=sim_sum > 0)
             
-            # Calculate predicted ratings
-            scores = {}
-            for prop in unrated_properties:
-                weighted_sum = 0
-                sim_sum = 0
-                
-                for sim_user, sim_score in zip(similar_users, similarities[similar_users_idx]):
-                    if sim_score > 0:  # Only consider positive similarities
-                        rating = self.rating_matrix.loc[sim_user, prop]
-                        if not pd.isna(rating):
-                            weighted_sum += sim_score * rating
-                            sim_sum += sim_score
-                
-                if sim_sum > 0:
-                    scores[prop] = weighted_sum / sim_sum
+            rated = rated.tocoo()
+            predictions[rated.row, rated.col] = np.nan
+        metrics.candidates('item', np.count_nonzero(~np.isnan(predictions), axis=1))
+        return predictions
+    
+    def item_based_filtering(self, user_id, n=5, filters=None):
+        """Item-based collaborative filtering recommendations, optionally among listings matching attribute filters"""
+        try:
+            if self.item_neighbors is None:
+                logger.warning("Item neighbors not built")
+                return {}
+            if not self.has_user(user_id):
+                logger.warning(f"User {user_id} not found in rating matrix")
+                return {}
             
-            # Return top N recommendations
-            top_n = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:n]
-            return dict(top_n)
+            columns = self.candidate_columns(filters)
+            scores = self.item_scores([self.user_index[user_id]], columns)
+            if columns is None:
+                return {self.item_ids[idx]: score for idx, score in top_k_rows(scores, n)[0]}
+            return {self.item_ids[columns[idx]]: score for idx, score in top_k_rows(scores, n)[0]}
             
         except Exception as e:
-            logger.error(f"Error in collaborative filtering: {e}")
+            logger.error(f"Error in item-based filtering: {e}")
+            metrics.error('item_based_filtering')
             return {}
     
-    def content_based_filtering(self, user_id, n=5):
-        """Content-based filtering recommendations"""
+    def content_based_filtering(self, user_id, n=5, filters=None):
+        """Content-based filtering recommendations, optionally among listings matching attribute filters"""
         try:
             # Get user's interaction history
-            user_interactions = self.df_interactions[
-                self.df_interactions['user_id'] == user_id
-            ]
-            
-            if user_interactions.empty:
+            if not self.has_user(user_id):
                 logger.warning(f"No interactions found for user {user_id}")
                 return {}
             
-            # Get properties the user has interacted with
-            interacted_properties = user_interactions['property_id'].unique()
-            
-            # Calculate user profile based on interacted properties
-            user_profile = np.zeros(self.property_features.shape[1], dtype=np.float64)
-            total_weight = 0.0
-            
-            for prop_id in interacted_properties:
-                if prop_id in self.property_features.index:
-                    # Weight by rating (higher ratings = more influence)
-                    rating = user_interactions[
-                        user_interactions['property_id'] == prop_id
-                    ]['rating'].mean()
-                    
-                    weight = float(rating) / 5.0  # Normalize to 0-1 and ensure float
-                    # Ensure property features are numeric
-                    prop_features = self.property_features.loc[prop_id].values.astype(np.float64)
-                    user_profile += weight * prop_features
-                    total_weight += weight
-            
-            if total_weight > 0:
-                user_profile = user_profile / total_weight
-            
-            # Ensure property features matrix is numeric
-            property_features_matrix = self.property_features.values.astype(np.float64)
-            
-            # Find similar properties
-            similarities = cosine_similarity(
-                user_profile.reshape(1, -1),
-                property_features_matrix
-            )[0]
+            with metrics.stage('content_profile'):
+                feature_rows, weights = self.profile_weights(self.user_index[user_id])
+                
+                # User profile: rating-weighted mean of interacted property features
+                # (higher ratings = more influence; recent ones too with recency weighting)
+                user_profile = weights @ self.feature_matrix[feature_rows]
+                if weights.sum() > 0:
+                    user_profile = user_profile / weights.sum()
             
-            # Get properties not yet interacted with
-            uninteracted_properties = self.df_properties[
-                ~self.df_properties['property_id'].isin(interacted_properties)
-            ]
+            # Pluggable (possibly approximate) nearest-neighbor search
+            candidates = self.property_candidates(filters)
+            if candidates is not None and not len(candidates):
+                return {}
+            if self.content_index is not None and candidates is None:
+                interacted_properties = set(self.property_features.index[feature_rows])
+                with metrics.stage('content_index_search'):
+                    return dict(self.content_index.search(user_profile, n, exclude=interacted_properties))
             
-            # Calculate scores for uninteracted properties
-            scores = {}
-            for idx, prop_id in enumerate(self.property_features.index):
-                if prop_id in uninteracted_properties['property_id'].values:
-                    scores[prop_id] = similarities[idx]
+            # Find similar properties (among the filtered candidates only)
+            with metrics.stage('content_similarity'):
+                similarities = cosine_similarity(
+                    user_profile.reshape(1, -1),
+                    self.feature_matrix if candidates is None else self.feature_matrix[candidates]
+                )[0]
             
-            # Return top N recommendations
-            top_n = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:n]
-            return dict(top_n)
+            # Return top N properties not yet interacted with
+            if candidates is None:
+                metrics.candidates('content', len(similarities) - len(feature_rows))
+                indices, scores = top_k(similarities, n, exclude=feature_rows)
+            else:
+                interacted = np.flatnonzero(np.isin(candidates, feature_rows))
+                metrics.candidates('content', len(candidates) - len(interacted))
+                indices, scores = top_k(similarities, n, exclude=interacted)
+                indices = candidates[indices]
+            return {self.property_features.index[idx]: float(score) for idx, score in zip(indices, scores)}
             
         except Exception as e:
             logger.error(f"Error in content-based filtering: {e}")
+            metrics.error('content_based_filtering')
             return {}
     
-    def hybrid_recommendations(self, user_id, n=5, collab_weight=0.6, content_weight=0.4):
-        """Hybrid recommendation combining collaborative and content-based filtering"""
+    @staticmethod
+    def combine_hybrid_scores(weighted_recs, n=5):
+        """Blend max-normalized scores of several methods into a top N list
+        
+        weighted_recs is a list of ({property_id: score}, weight) pairs.
+        """
+        # Candidates in first-seen order, which also breaks score ties
+        all_properties = list(dict.fromkeys(prop_id for recs, _ in weighted_recs for prop_id in recs))
+        metrics.candidates('hybrid', len(all_properties))
+        if not all_properties:
+            return []
+        
+        # Normalize scores
+        max_scores = [max(recs.values()) if recs else 1 for recs, _ in weighted_recs]
+        
+        hybrid_scores = {}
+        for prop_id in all_properties:
+            hybrid_scores[prop_id] = sum(
+                weight * recs.get(prop_id, 0) / max_score
+                for (recs, weight), max_score in zip(weighted_recs, max_scores)
+            )
+        
+        # Return top N recommendations
+        return top_k_items(hybrid_scores, n)
+    
+    def hybrid_recommendations(self, user_id, n=5, collab_weight=0.6, content_weight=0.4,
+                               mf_weight=0.0, item_weight=0.0, filters=None):
+        """Hybrid recommendation combining collaborative, content-based and (optionally) item-based and MF scores
+        
+        With attribute filters every method only scores the matching listings.
+        """
         try:
-            # Get recommendations from both methods
-            collab_recs = self.collaborative_filtering(user_id, n * 2)
-            content_recs = self.content_based_filtering(user_id, n * 2)
-            
-            # Combine recommendations
-            all_properties = set(collab_recs.keys()) | set(content_recs.keys())
+            # Get recommendations from each method
+            weighted_recs = [
+                (self.collaborative_filtering(user_id, n * 2, filters=filters), collab_weight),
+                (self.content_based_filtering(user_id, n * 2, filters=filters), content_weight)
+            ]
+            if item_weight > 0:
+                weighted_recs.append((self.item_based_filtering(user_id, n * 2, filters=filters), item_weight))
+            if mf_weight > 0:
+                weighted_recs.append((self.mf_recommendations(user_id, n * 2, filters=filters), mf_weight))
             
-            if not all_properties:
+            with metrics.stage('hybrid_merge'):
+                top_n = self.combine_hybrid_scores(weighted_recs, n)
+            if not top_n:
                 logger.warning(f"No recommendations found for user {user_id}")
-                return []
+            return top_n
+            
+        except Exception as e:
+            logger.error(f"Error in hybrid recommendations: {e}")
+            metrics.error('hybrid_recommendations')
+            return []
+    
+    def confidence_matrix(self):
+        """Users x properties CSR of summed interaction-type weights"""
+        interactions = self.all_interactions()
+        weights = interactions['interaction_type'].map(INTERACTION_WEIGHTS)
+        weights = weights.astype(np.float64).fillna(1.0).to_numpy()
+        user_codes = self.user_ids.get_indexer(interactions['user_id'])
+        item_codes = self.item_ids.get_indexer(interactions['property_id'])
+        return sparse.csr_matrix(
+            (weights, (user_codes, item_codes)), shape=(len(self.user_ids), len(self.item_ids))
+        )
+    
+    def train_mf(self, factors=32, regularization=0.1, alpha=10.0, iterations=15):
+        """Train the implicit-feedback ALS model on the interaction confidences"""
+        try:
+            self.mf_model = ImplicitALS(factors, regularization, alpha, iterations).fit(self.confidence_matrix())
+            return True
+        except Exception as e:
+            logger.error(f"Error training matrix factorization: {e}")
+            return False
+    
+    def save_mf_model(self, path):
+        """Write the trained factor arrays, tagged with the data version"""
+        try:
+            self.mf_model.save(path, self.user_ids, self.item_ids, self.data_version)
+            return True
+        except Exception as e:
+            logger.error(f"Error saving MF model to {path}: {e}")
+            return False
+    
+    def load_mf_model(self, path):
+        """Load factors trained offline; they must match the loaded data version"""
+        try:
+            model, user_ids, item_ids, data_version = ImplicitALS.load(path)
+            if data_version != self.data_version:
+                logger.warning(f"MF model {path} was trained on data version {data_version}, "
+                               f"not {self.data_version}")
+                return False
+            if not (np.array_equal(user_ids, self.user_ids.astype(str)) and
+                    np.array_equal(item_ids, self.item_ids.astype(str))):
+                logger.warning(f"MF model {path} id tables do not match the rating store")
+                return False
+            self.mf_model = model
+            return True
+        except Exception as e:
+            logger.error(f"Error loading MF model from {path}: {e}")
+            return False
+    
+    def mf_scores(self, user_rows, columns=None):
+        """Factor dot products for a block of users; rated and unfactored properties are NaN
+        
+        Users and properties added after training (see with_interactions)
+        have no factors yet and get no MF scores. With sorted columns, only
+        those rating-store columns are scored, in that order.
+        """
+        user_rows = np.asarray(user_rows, dtype=np.int64)
+        with metrics.stage('mf_scores'):
+            user_factors, item_factors = self.mf_model.user_factors, self.mf_model.item_factors
+            rated = self.rated_indicator[user_rows]
+            width = len(self.item_ids)
+            if columns is not None:
+                # Factored properties are the leading rating-store columns
+                item_factors = item_factors[columns[columns < len(item_factors)]]
+                rated = rated[:, columns]
+                width = len(columns)
+            scores = np.full((len(user_rows), width), np.nan)
             
-            # Normalize scores
-            max_collab = max(collab_recs.values()) if collab_recs else 1
-            max_content = max(content_recs.values()) if content_recs else 1
+            trained = user_rows < len(user_factors)
+            scores[np.ix_(trained, np.arange(len(item_factors)))] = user_factors[user_rows[trained]] @ item_factors.T
             
-            hybrid_scores = {}
-            for prop_id in all_properties:
-                collab_score = collab_recs.get(prop_id, 0) / max_collab
-                content_score = content_recs.get(prop_id, 0) / max_content
+            rated = rated.tocoo()
+            scores[rated.row, rated.col] = np.nan
+        metrics.candidates('mf', np.count_nonzero(~np.isnan(scores), axis=1))
+        return scores
+    
+    def mf_recommendations(self, user_id, n=5, filters=None):
+        """Matrix factorization recommendations, optionally among listings matching attribute filters"""
+        try:
+            if self.mf_model is None:
+                logger.warning("Matrix factorization model not trained")
+                return {}
+            if not self.has_user(user_id):
+                logger.warning(f"User {user_id} not found in rating matrix")
+                return {}
+            
+            columns = self.candidate_columns(filters)
+            scores = self.mf_scores([self.user_index[user_id]], columns)
+            if columns is None:
+                return {self.item_ids[idx]: score for idx, score in top_k_rows(scores, n)[0]}
+            return {self.item_ids[columns[idx]]: score for idx, score in top_k_rows(scores, n)[0]}
+            
+        except Exception as e:
+            logger.error(f"Error in matrix factorization recommendations: {e}")
+            metrics.error('mf_recommendations')
+            return {}
+    
+    def content_scores(self, user_rows):
+        """Content similarity of every property to a block of user profiles
+        
+        Returns a (len(user_rows), n_properties) array aligned with
+        property_features; properties a user interacted with are NaN.
+        """
+        user_rows = np.asarray(user_rows, dtype=np.int64)
+        features = self.feature_matrix
+        
+        # Rating/5 weights (times recency) of each user's properties, as feature-row columns
+        with metrics.stage('content_profile'):
+            history = self.interaction_matrix[user_rows].tocoo()
+            columns = self.item_feature_rows[history.col]
+            known = columns >= 0
+            history_weights = history.data / 5.0
+            if self.recency_indicator is not None:
+                history_weights = history_weights * self.recency_indicator[user_rows].tocoo().data
+            weights = sparse.csr_matrix(
+                (history_weights[known], (history.row[known], columns[known])),
+                shape=(len(user_rows), len(features))
+            )
+            
+            # Weighted mean profile per user
+            total_weight = np.asarray(weights.sum(axis=1))
+            total_weight[total_weight == 0] = 1.0
+            profiles = np.asarray(weights @ features) / total_weight
+        
+        # Compared by cosine to every property
+        with metrics.stage('content_similarity'):
+            similarities = cosine_similarity(profiles, features)
+            similarities[history.row[known], columns[known]] = np.nan
+        metrics.candidates('content', np.count_nonzero(~np.isnan(similarities), axis=1))
+        return similarities
+    
+    def batch_recommendations(self, user_ids, rec_type='hybrid', n=5, chunk_size=256,
+                              collab_weight=0.6, content_weight=0.4, mf_weight=0.0, item_weight=0.0):
+        """Score many users at once with block matrix operations
+        
+        Returns {user_id: [(property_id, score), ...]}; users missing from the
+        rating store are left out.
+        """
+        try:
+            if rec_type not in ('collaborative', 'content', 'hybrid', 'item', 'mf'):
+                raise ValueError(f"Invalid recommendation type: {rec_type}")
+            
+            weights = {'collaborative': collab_weight, 'content': content_weight,
+                       'item': item_weight, 'mf': mf_weight}
+            methods = [rec_type]
+            if rec_type == 'hybrid':
+                methods = ['collaborative', 'content'] + [
+                    method for method in ('item', 'mf') if weights[method] > 0
+                ]
+            if 'item' in methods and self.item_neighbors is None:
+                raise ValueError("Item neighbors not built")
+            if 'mf' in methods and self.mf_model is None:
+                raise ValueError("Matrix factorization model not trained")
+            
+            known_users = [user_id for user_id in user_ids if self.has_user(user_id)]
+            depth = n * 2 if rec_type == 'hybrid' else n
+            results = {}
+            
+            for start in range(0, len(known_users), chunk_size):
+                chunk = known_users[start:start + chunk_size]
+                rows = [self.user_index[user_id] for user_id in chunk]
                 
-                hybrid_scores[prop_id] = (
-                    collab_weight * collab_score + 
-                    content_weight * content_score
-                )
+                method_recs = {}
+                if 'collaborative' in methods:
+                    method_recs['collaborative'] = [
+                        {self.item_ids[idx]: score for idx, score in recs}
+                        for recs in top_k_rows(self.predict_ratings(rows), depth)
+                    ]
+                if 'content' in methods:
+                    if self.content_index is not None:
+                        method_recs['content'] = [self.content_based_filtering(user_id, depth) for user_id in chunk]
+                    else:
+                        method_recs['content'] = [
+                            {self.property_features.index[idx]: score for idx, score in recs}
+                            for recs in top_k_rows(self.content_scores(rows), depth)
+                        ]
+                if 'item' in methods:
+                    method_recs['item'] = [
+                        {self.item_ids[idx]: score for idx, score in recs}
+                        for recs in top_k_rows(self.item_scores(rows), depth)
+                    ]
+                if 'mf' in methods:
+                    method_recs['mf'] = [
+                        {self.item_ids[idx]: score for idx, score in recs}
+                        for recs in top_k_rows(self.mf_scores(rows), depth)
+                    ]
+                
+                if rec_type == 'hybrid':
+                    with metrics.stage('hybrid_merge'):
+                        for i, user_id in enumerate(chunk):
+                            results[user_id] = self.combine_hybrid_scores(
+                                [(method_recs[method][i], weights[method]) for method in methods], n
+                            )
+                else:
+                    for i, user_id in enumerate(chunk):
+                        results[user_id] = list(method_recs[rec_type][i].items())
             
-            # Return top N recommendations
-            top_n = sorted(hybrid_scores.items(), key=lambda x: x[1], reverse=True)[:n]
-            return top_n
+            return results
             
         except Exception as e:
-            logger.error(f"Error in hybrid recommendations: {e}")
-            return []
+            logger.error(f"Error in batch recommendations: {e}")
+            metrics.error('batch_recommendations')
+            return {}
+    
+    def iter_recommendations(self, rec_type='hybrid', n=5, chunk_size=256, cursor=0, limit=None, **weights):
+        """Lazily score every user in rating-store order, one chunk at a time
+
+        Yields (next_cursor, user_id, [(property_id, score), ...]). Passing a
+        yielded next_cursor back as cursor resumes right after that user, as
+        long as the data version has not changed. Only one chunk of results
+        is held at a time.
+        """
+        end = len(self.user_ids) if limit is None else min(len(self.user_ids), cursor + limit)
+        for start in range(max(cursor, 0), end, chunk_size):
+            chunk = list(self.user_ids[start:min(start + chunk_size, end)])
+            recs = self.batch_recommendations(chunk, rec_type, n, chunk_size, **weights)
+            if not recs and chunk:
+                raise Exception(f"Failed to score users {start} to {start + len(chunk)}")
+            for offset, user_id in enumerate(chunk):
+                yield start + offset + 1, user_id, recs.get(user_id, [])
+
+    def export_recommendations(self, out, rec_type='hybrid', n=5, chunk_size=256, cursor=0, limit=None):
+        """Write recommendations for every user to a file object as NDJSON; returns the final cursor"""
+        for cursor, user_id, recs in self.iter_recommendations(rec_type, n, chunk_size, cursor, limit):
+            out.write(json.dumps({
+                'user_id': user_id,
+                'type': rec_type,
+                'recommendations': [
+                    {'property_id': prop_id, 'score': round(float(score), 3)} for prop_id, score in recs
+                ],
+                'cursor': cursor
+            }) + '\n')
+        return cursor
+
+    def precompute_recommendations(self, path, n=5, rec_types=None, chunk_size=256):
+        """Write top-N lists for every user and type to a snapshot tagged with the data version"""
+        try:
+            if rec_types is None:
+                rec_types = ['collaborative', 'content', 'hybrid']
+                rec_types += ['item'] if self.item_neighbors is not None else []
+                rec_types += ['mf'] if self.mf_model is not None else []
+            recommendations = {
+                rec_type: self.batch_recommendations(list(self.user_ids), rec_type, n, chunk_size)
+                for rec_type in rec_types
+            }
+            write_snapshot(path, self.data_version, n, recommendations)
+            return True
+        except Exception as e:
+            logger.error(f"Error precomputing recommendations: {e}")
+            return False
+    
+    def build_content_index(self, backend='exact', **params):
+        """Build the nearest-neighbor index used for content similarity search"""
+        try:
+            index = build_index(backend, **params)
+            index.fit(self.property_features.index, self.feature_matrix)
+            self.content_index = index
+            return True
+        except Exception as e:
+            logger.error(f"Error building {backend} content index: {e}")
+            return False
+    
+    def build_similarity_index(self, k=50):
+        """Precompute the top-K content neighbors of every property"""
+        try:
+            index = PropertySimilarityIndex(k=k)
+            index.build(self.property_features.index, self.feature_matrix)
+            self.similarity_index = index
+            return True
+        except Exception as e:
+            logger.error(f"Error building similarity index: {e}")
+            return False
+    
+    def property_feature_vector(self, property_data):
+        """Encode one property with the fitted one-hot columns and scaler
+        
+        Categories that were not seen when the features were prepared get no
+        one-hot column, so they only contribute through the numeric features.
+        """
+        vector = pd.Series(0.0, index=self.property_features.columns)
+        for prefix in ('type', 'location'):
+            column = f"{prefix}_{property_data[prefix]}"
+            if column in vector.index:
+                vector[column] = 1.0
+        
+        numerical = pd.DataFrame([[property_data[col] for col in self.scaler.feature_names_in_]],
+                                 columns=self.scaler.feature_names_in_)
+        vector[list(self.scaler.feature_names_in_)] = self.scaler.transform(numerical)[0]
+        return vector
+    
+    def with_property(self, property_data):
+        """Return a new engine with a listing added or updated
+        
+        As with with_interactions, nothing on this engine is modified: the
+        listing tables, features and indexes are copied before the edit, so
+        this engine keeps serving consistent results until the caller swaps
+        the new one in. Only the similarity rows the listing affects are
+        recomputed. Returns None if the edit fails.
+        """
+        try:
+            property_id = property_data['property_id']
+            row = {col: property_data.get(col) for col in self.df_properties.columns}
+            vector = self.property_feature_vector(row)
+            engine = copy.copy(self)
+            
+            features = self.property_features.copy()
+            if property_id in features.index:
+                engine.df_properties = self.df_properties.copy()
+                mask = engine.df_properties['property_id'] == property_id
+                engine.df_properties.loc[mask, list(row)] = list(row.values())
+            else:
+                engine.df_properties = pd.concat([self.df_properties, pd.DataFrame([row])], ignore_index=True)
+            features.loc[property_id] = vector.values
+            engine.property_features = features
+            engine.property_records = {**self.property_records, property_id: row}
+            engine.refresh_feature_arrays()
+            engine.data_version = self.next_data_version(
+                f"upsert:{json.dumps(row, sort_keys=True, default=str)}"
+            )
+            
+            if self.similarity_index is not None:
+                engine.similarity_index = self.similarity_index.copy()
+                engine.similarity_index.upsert(property_id, vector.values)
+            if self.content_index is not None:
+                engine.content_index = self.content_index.copy()
+                engine.content_index.upsert(property_id, vector.values)
+            return engine
+        except Exception as e:
+            logger.error(f"Error upserting property {property_data.get('property_id')}: {e}")
+            return None
+    
+    def without_property(self, property_id):
+        """Return a new engine without a listing, or None if it is unknown or the edit fails
+        
+        Copy-on-write like with_property; only the similarity rows that
+        referenced the listing are repaired.
+        """
+        try:
+            if property_id not in self.property_features.index:
+                return None
+            
+            engine = copy.copy(self)
+            engine.df_properties = self.df_properties[
+                self.df_properties['property_id'] != property_id
+            ].reset_index(drop=True)
+            engine.property_features = self.property_features.drop(property_id)
+            engine.property_records = {
+                prop_id: record for prop_id, record in self.property_records.items() if prop_id != property_id
+            }
+            engine.refresh_feature_arrays()
+            engine.data_version = self.next_data_version(f"remove:{property_id}")
+            
+            if self.similarity_index is not None:
+                engine.similarity_index = self.similarity_index.copy()
+                engine.similarity_index.remove(property_id)
+            if self.content_index is not None:
+                engine.content_index = self.content_index.copy()
+                engine.content_index.remove(property_id)
+            return engine
+        except Exception as e:
+            logger.error(f"Error removing property {property_id}: {e}")
+            return None
     
-    def get_similar_properties(self, property_id, n=5):
-        """Get similar properties based on content similarity"""
+    def get_similar_properties(self, property_id, n=5, filters=None):
+        """Get similar properties based on content similarity
+        
+        With attribute filters, only the matching listings are compared.
+        """
         try:
+            # Precomputed neighbor lists cover any n up to the index's K
+            if self.similarity_index is not None and n <= self.similarity_index.k and not filters:
+                similar_properties = self.similarity_index.get_neighbors(property_id, n)
+                if similar_properties is None:
+                    logger.warning(f"Property {property_id} not found")
+                    return []
+                return similar_properties
+            
             if property_id not in self.property_features.index:
                 logger.warning(f"Property {property_id} not found")
                 return []
@@ -235,94 +1216,105 @@ class PropertyRecommendationEngine:
             # Get property features
             prop_features = self.property_features.loc[property_id].values.reshape(1, -1)
             
-            # Calculate similarity with all properties
-            similarities = cosine_similarity(prop_features, self.property_features.values)[0]
+            candidates = self.property_candidates(filters)
+            if candidates is not None:
+                if not len(candidates):
+                    return []
+                similarities = cosine_similarity(prop_features, self.feature_matrix[candidates])[0]
+                own_row = self.property_features.index.get_loc(property_id)
+                indices, scores = top_k(similarities, n, exclude=np.flatnonzero(candidates == own_row))
+                return [(self.property_features.index[idx], float(score)) for idx, score in zip(candidates[indices], scores)]
             
-            # Get most similar properties (excluding self)
-            similar_indices = np.argsort(similarities)[::-1][1:n+1]
-            similar_properties = []
+            if self.content_index is not None:
+                return self.content_index.search(prop_features, n, exclude={property_id})
             
-            for idx in similar_indices:
-                prop_id = self.property_features.index[idx]
-                score = similarities[idx]
-                similar_properties.append((prop_id, score))
+            # Calculate similarity with all properties
+            similarities = cosine_similarity(prop_features, self.feature_matrix)[0]
             
-            return similar_properties
+            # Get most similar properties (excluding self)
+            indices, scores = top_k(similarities, n, exclude=[self.property_features.index.get_loc(property_id)])
+            return [(self.property_features.index[idx], float(score)) for idx, score in zip(indices, scores)]
             
         except Exception as e:
             logger.error(f"Error getting similar properties: {e}")
+            metrics.error('similar_properties')
             return []
     
-    def get_trending_properties(self, n=5):
-        """Get trending properties based on popularity and ratings"""
+    def get_user_preferences(self, user_id):
+        """Summarize a user's preferences from their row in the rating store"""
         try:
-            # Calculate popularity score (number of interactions + average rating)
-            popularity_scores = self.df_interactions.groupby('property_id').agg({
-                'rating': ['count', 'mean'],
-                'interaction_type': lambda x: (x == 'view').sum()  # Number of views
-            }).reset_index()
-            
-            # Flatten column names
-            popularity_scores.columns = ['property_id', 'rating_count', 'avg_rating', 'view_count']
-            
-            # Fill NaN values
-            popularity_scores['avg_rating'] = popularity_scores['avg_rating'].fillna(0)
-            
-            # Calculate trending score (weighted combination of views, ratings, and rating count)
-            popularity_scores['trending_score'] = (
-                0.4 * popularity_scores['view_count'] +
-                0.3 * popularity_scores['rating_count'] +
-                0.3 * popularity_scores['avg_rating']
-            )
+            if not self.has_user(user_id):
+                return None
             
-            # Sort by trending score and get top n
-            trending = popularity_scores.nlargest(n, 'trending_score')
+            user_idx = self.user_index[user_id]
+            start, end = self.interaction_matrix.indptr[user_idx], self.interaction_matrix.indptr[user_idx + 1]
+            mean_ratings = self.interaction_matrix.data[start:end]
+            counts = self.interaction_counts.data[start:end]
+            property_ids = self.item_ids[self.interaction_matrix.indices[start:end]]
             
-            # Return as list of tuples (property_id, score)
-            return [(row['property_id'], row['trending_score']) 
-                   for _, row in trending.iterrows()]
+            user_properties = pd.DataFrame(
+                self.get_properties_details(property_ids),
+                columns=self.df_properties.columns
+            )
+            
+            return {
+                'favorite_types': user_properties['type'].value_counts().to_dict(),
+                'favorite_locations': user_properties['location'].value_counts().to_dict(),
+                'avg_price_range': {
+                    'min': int(user_properties['price'].min()),
+                    'max': int(user_properties['price'].max()),
+                    'avg': int(user_properties['price'].mean())
+                },
+                'bedroom_preference': int(user_properties['bedrooms'].mode().iloc[0]) if not user_properties['bedrooms'].empty else None,
+                'bathroom_preference': int(user_properties['bathrooms'].mode().iloc[0]) if not user_properties['bathrooms'].empty else None,
+                # Pair means weighted by pair counts give the mean over raw interactions
+                'avg_rating': float(np.dot(mean_ratings, counts) / counts.sum()),
+                'interaction_count': int(counts.sum())
+            }
+        except Exception as e:
+            logger.error(f"Error getting user preferences for {user_id}: {e}")
+            metrics.error('user_preferences')
+            return None
+    
+    def get_trending_properties(self, n=5, mode='popularity', filters=None):
+        """Get trending properties based on popularity and ratings
+        
+        Served from the maintained counters (see trending.py); 'popularity'
+        weighs views, interaction count and mean rating, 'rating' favours
+        the mean rating. Attribute filters rank only the matching listings.
+        """
+        try:
+            columns = self.candidate_columns(filters)
+            if columns is not None:
+                return self.trending.top_among(columns, n, mode)
+            return self.trending.top(n, mode)
         
         except Exception as e:
             logger.error(f"Error getting trending properties: {e}")
+            metrics.error('trending_properties')
             # Fallback: return first n properties
             return [(prop_id, 1.0) for prop_id in self.df_properties['property_id'].head(n)]
     
     def get_property_details(self, property_id):
         """Get detailed property information for a single property"""
-        try:
-            prop_info = self.df_properties[
-                self.df_properties['property_id'] == property_id
-            ]
-            if not prop_info.empty:
-                return prop_info.iloc[0].to_dict()
-            return None
-        except Exception as e:
-            logger.error(f"Error getting property details for {property_id}: {e}")
-            return None
-
-    def get_property_details(self, property_ids):
-        """Get detailed property information"""
-        try:
-            details = []
-            for prop_id in property_ids:
-                prop_info = self.df_properties[
-                    self.df_properties['property_id'] == prop_id
-                ]
-                if not prop_info.empty:
-                    details.append(prop_info.iloc[0].to_dict())
-            return details
-        except Exception as e:
-            logger.error(f"Error getting property details: {e}")
-            return []
-
+        return self.property_records.get(property_id)
+    
+    def get_properties_details(self, property_ids):
+        """Get detailed property information for several properties, skipping unknown ids"""
+        return [
+            self.property_records[prop_id]
+            for prop_id in property_ids
+            if prop_id in self.property_records
+        ]
+    
     def map_real_user_to_synthetic(self, real_user_id):
         """Map a real user ID to a synthetic user ID for testing"""
         try:
             # Simple hash-based mapping to ensure consistency
             import hashlib
             hash_value = int(hashlib.md5(real_user_id.encode()).hexdigest(), 16)
-            synthetic_user_index = hash_value % len(self.rating_matrix.index)
-            synthetic_user_id = self.rating_matrix.index[synthetic_user_index]
+            synthetic_user_index = hash_value % len(self.user_ids)
+            synthetic_user_id = self.user_ids[synthetic_user_index]
             
             logger.info(f"Mapped real user {real_user_id} to synthetic user {synthetic_user_id}")
             return synthetic_user_id
@@ -332,40 +1324,125 @@ class PropertyRecommendationEngine:
 
 def main():
     """Main function for testing"""
-    engine = PropertyRecommendationEngine()
+    parser = argparse.ArgumentParser(description='Property recommendation engine')
+    parser.add_argument('user_id', nargs='?', help='User to generate recommendations for (default: first user)')
+    parser.add_argument('--precompute', metavar='PATH', help='Write a precomputed recommendation snapshot to PATH')
+    parser.add_argument('--top-n', type=int, default=5, help='List length stored by --precompute or --export')
+    parser.add_argument('--state', metavar='DIR', help='Load a binary state directory instead of the CSVs')
+    parser.add_argument('--convert', metavar='DIR', help='Convert the CSVs to a binary state directory and exit')
+    parser.add_argument('--verify', action='store_true', help='Check array checksums when loading --state')
+    parser.add_argument('--train-mf', metavar='PATH', help='Train the matrix factorization model, save it to PATH and exit')
+    parser.add_argument('--mf-model', metavar='PATH', help='Load a trained MF model (used by --precompute)')
+    parser.add_argument('--build-item-neighbors', metavar='PATH',
+                        help='Compute the top-K item neighbor matrix, save it to PATH and exit')
+    parser.add_argument('--item-neighbors', metavar='PATH', help='Load item neighbors (used by --precompute)')
+    parser.add_argument('--item-k', type=int, default=50, help='Neighbors kept per property for item-based CF')
+    parser.add_argument('--similar-k', type=int, default=50,
+                        help='Neighbors kept per property in the similarity index saved by --convert '
+                             '(match RECOMMENDER_SIMILAR_K)')
+    parser.add_argument('--with-item-neighbors', action='store_true',
+                        help='Also compute item neighbors (at --item-k) into the --convert state')
+    parser.add_argument('--export', metavar='PATH',
+                        help="Stream recommendations for every user to PATH as NDJSON ('-' for stdout)")
+    parser.add_argument('--export-type', default='hybrid',
+                        choices=['collaborative', 'content', 'hybrid', 'item', 'mf'], help='Recommendation type for --export')
+    parser.add_argument('--cursor', type=int, default=0, help='Resume --export from a cursor it wrote')
+    args = parser.parse_args()
+    
+    engine = PropertyRecommendationEngine(
+        sparse=bool(args.precompute or args.convert or args.state or args.train_mf or args.build_item_neighbors
+                    or args.export)
+    )
     
-    # Load data
-    if not engine.load_data():
+    if args.state:
+        if not engine.load_state(args.state, verify=args.verify):
+            return
+    else:
+        # Load data
+        if not engine.load_data():
+            return
+        
+        # Prepare content features
+        if not engine.prepare_content_features():
+            return
+    
+    if args.convert:
+        # Carry the precomputed indexes so servers loading the state skip their O(P^2) build
+        if not engine.build_similarity_index(k=args.similar_k):
+            return
+        if args.with_item_neighbors and not engine.build_item_neighbors(args.item_k):
+            return
+        if engine.save_state(args.convert):
+            print(f"State for data version {engine.data_version} written to {args.convert}")
+        return
+    
+    if args.train_mf:
+        if engine.train_mf() and engine.save_mf_model(args.train_mf):
+            print(f"MF model for data version {engine.data_version} written to {args.train_mf}")
+        return
+    
+    if args.build_item_neighbors:
+        if engine.build_item_neighbors(args.item_k) and engine.save_item_neighbors(args.build_item_neighbors):
+            print(f"Item neighbors for data version {engine.data_version} written to {args.build_item_neighbors}")
+        return
+    
+    if args.mf_model and not engine.load_mf_model(args.mf_model):
         return
     
-    # Prepare content features
-    if not engine.prepare_content_features():
+    if args.item_neighbors and not engine.load_item_neighbors(args.item_neighbors):
+        return
+    
+    if args.precompute:
+        if engine.precompute_recommendations(args.precompute, n=args.top_n):
+            print(f"Snapshot for data version {engine.data_version} written to {args.precompute}")
+        return
+    
+    if args.export:
+        if args.export_type == 'item' and not engine.build_item_neighbors(args.item_k):
+            return
+        # Resumed exports append to what the interrupted run wrote
+        out = sys.stdout if args.export == '-' else open(args.export, 'a' if args.cursor else 'w')
+        try:
+            cursor = engine.export_recommendations(out, args.export_type, n=args.top_n, cursor=args.cursor)
+        except Exception as e:
+            logger.error(f"Error exporting recommendations: {e}")
+            return
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        logger.info(f"Exported recommendations up to cursor {cursor} for data version {engine.data_version}")
         return
     
     # Get user_id from command line or use first user
-    user_id = sys.argv[1] if len(sys.argv) > 1 else engine.rating_matrix.index[0]
+    user_id = args.user_id or engine.user_ids[0]
     
     print(f"Generating recommendations for user: {user_id}")
     
     # Get recommendations
     collaborative = engine.collaborative_filtering(user_id, n=5)
+    item_based = engine.item_based_filtering(user_id, n=5) if engine.build_item_neighbors(args.item_k) else {}
     content_based = engine.content_based_filtering(user_id, n=5)
     hybrid = engine.hybrid_recommendations(user_id, n=5)
     
     # Print results
     print("\n=== Collaborative Filtering ===")
     for prop_id, score in collaborative.items():
-        prop_info = engine.df_properties[engine.df_properties['property_id'] == prop_id].iloc[0]
+        prop_info = engine.get_property_details(prop_id)
+        print(f"Property: {prop_id}, Score: {score:.3f}, Type: {prop_info['type']}, Price: {prop_info['price']}, Location: {prop_info['location']}")
+    
+    print("\n=== Item-Based Filtering ===")
+    for prop_id, score in item_based.items():
+        prop_info = engine.get_property_details(prop_id)
         print(f"Property: {prop_id}, Score: {score:.3f}, Type: {prop_info['type']}, Price: {prop_info['price']}, Location: {prop_info['location']}")
     
     print("\n=== Content-Based Filtering ===")
     for prop_id, score in content_based.items():
-        prop_info = engine.df_properties[engine.df_properties['property_id'] == prop_id].iloc[0]
+        prop_info = engine.get_property_details(prop_id)
         print(f"Property: {prop_id}, Score: {score:.3f}, Type: {prop_info['type']}, Price: {prop_info['price']}, Location: {prop_info['location']}")
     
     print("\n=== Hybrid Recommendations ===")
     for prop_id, score in hybrid:
-        prop_info = engine.df_properties[engine.df_properties['property_id'] == prop_id].iloc[0]
+        prop_info = engine.get_property_details(prop_id)
         print(f"Property: {prop_id}, Score: {score:.3f}, Type: {prop_info['type']}, Price: {prop_info['price']}, Location: {prop_info['location']}")
 
 if __name__ == '__main__':
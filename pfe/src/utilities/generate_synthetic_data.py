@@ -1,60 +1,292 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import logging
 import pandas as pd
 import numpy as np
-import random
+from trending import to_epoch_seconds
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 # Parameters
 NUM_USERS = 100
 NUM_PROPERTIES = 50
 NUM_INTERACTIONS = 1000
+HISTORY_DAYS = 90
+CHUNK_SIZE = 1000000
+# --state builds the engine in memory, at roughly 140 bytes per interaction at peak
+STATE_MAX_INTERACTIONS = 10000000
+
+LOCATIONS = ['CityA', 'CityB', 'CityC', 'CityD']
+PROPERTY_TYPES = ['apartment', 'house', 'villa', 'studio']
+USER_TYPES = ['buyer', 'renter', 'agent']
+INTERACTION_TYPES = ['view', 'favorite', 'contact']
+# Share of each interaction type among all interactions
+INTERACTION_TYPE_SHARES = [0.7, 0.2, 0.1]
+
+USERS_FILE = 'synthetic_users.csv'
+PROPERTIES_FILE = 'synthetic_properties.csv'
+INTERACTIONS_FILE = 'synthetic_interactions.csv'
+
+def location_names(count):
+    """City names: CityA..CityZ, then City27, City28, ..."""
+    return [f"City{chr(ord('A') + i)}" if i < 26 else f"City{i + 1}" for i in range(count)]
+
+def power_law_weights(rng, size, exponent):
+    """Probabilities where the k-th ranked entry gets weight 1/k**exponent, ranks assigned at random"""
+    weights = 1.0 / np.arange(1, size + 1, dtype=np.float64) ** exponent
+    rng.shuffle(weights)
+    return weights / weights.sum()
 
 # Generate users
-def generate_users(num_users):
-    users = []
-    for i in range(num_users):
-        users.append({
-            'user_id': f'user_{i+1}',
-            'age': np.random.randint(18, 70),
-            'location': random.choice(['CityA', 'CityB', 'CityC', 'CityD']),
-            'user_type': random.choice(['buyer', 'renter', 'agent'])
-        })
-    return pd.DataFrame(users)
+def generate_users(num_users, rng, locations=LOCATIONS):
+    return pd.DataFrame({
+        'user_id': [f'user_{i + 1}' for i in range(num_users)],
+        'age': rng.integers(18, 70, num_users),
+        'location': np.asarray(locations, dtype=object)[rng.integers(0, len(locations), num_users)],
+        'user_type': np.asarray(USER_TYPES, dtype=object)[rng.integers(0, len(USER_TYPES), num_users)]
+    })
 
 # Generate properties
-def generate_properties(num_properties):
-    properties = []
-    for i in range(num_properties):
-        properties.append({
-            'property_id': f'property_{i+1}',
-            'type': random.choice(['apartment', 'house', 'villa', 'studio']),
-            'price': np.random.randint(50000, 1000000),
-            'location': random.choice(['CityA', 'CityB', 'CityC', 'CityD']),
-            'bedrooms': np.random.randint(1, 6),
-            'bathrooms': np.random.randint(1, 4)
-        })
-    return pd.DataFrame(properties)
-
-# Generate interactions (e.g., ratings)
-def generate_interactions(users, properties, num_interactions):
-    interactions = []
-    for _ in range(num_interactions):
-        user = users.sample(1).iloc[0]
-        property_ = properties.sample(1).iloc[0]
-        interactions.append({
-            'user_id': user['user_id'],
-            'property_id': property_['property_id'],
-            'rating': np.random.randint(1, 6),  # 1 to 5 stars
-            'interaction_type': random.choice(['view', 'favorite', 'contact'])
-        })
-    return pd.DataFrame(interactions)
+def generate_properties(num_properties, rng, locations=LOCATIONS):
+    return pd.DataFrame({
+        'property_id': [f'property_{i + 1}' for i in range(num_properties)],
+        'type': np.asarray(PROPERTY_TYPES, dtype=object)[rng.integers(0, len(PROPERTY_TYPES), num_properties)],
+        'price': rng.integers(50000, 1000000, num_properties),
+        'location': np.asarray(locations, dtype=object)[rng.integers(0, len(locations), num_properties)],
+        'bedrooms': rng.integers(1, 6, num_properties),
+        'bathrooms': rng.integers(1, 4, num_properties)
+    })
 
-if __name__ == '__main__':
-    users_df = generate_users(NUM_USERS)
-    properties_df = generate_properties(NUM_PROPERTIES)
-    interactions_df = generate_interactions(users_df, properties_df, NUM_INTERACTIONS)
+class InteractionSampler:
+    """Vectorized interaction generator with skewed popularity and activity
+
+    Users are drawn with power-law activity and properties with power-law
+    popularity. With probability locality an interaction stays in the
+    user's city, and with probability type_affinity within the user's
+    preferred property type; each of those subsets is sampled by its own
+    popularity. Ratings follow a per-property quality plus a per-user bias.
+    """
+
+    def __init__(self, users, properties, rng, popularity_skew=1.1, activity_skew=0.8,
+                 locality=0.6, type_affinity=0.4, history_days=HISTORY_DAYS, end_time=None):
+        self.rng = rng
+        self.locality = locality
+        self.type_affinity = type_affinity
+        self.history_seconds = int(history_days * 86400)
+        self.end_time = int(end_time if end_time is not None else time.time())
+
+        self.user_weights = power_law_weights(rng, len(users), activity_skew)
+        self.popularity = power_law_weights(rng, len(properties), popularity_skew)
+        self.quality = rng.uniform(1.5, 4.5, len(properties))
+        self.user_bias = rng.normal(0.0, 0.5, len(users))
+
+        locations = sorted(set(users['location']) | set(properties['location']))
+        self.user_location = pd.Index(locations).get_indexer(users['location'])
+        self.user_type = rng.integers(0, len(PROPERTY_TYPES), len(users))
+        property_location = pd.Index(locations).get_indexer(properties['location'])
+        property_type = pd.Index(PROPERTY_TYPES).get_indexer(properties['type'])
+
+        # Candidate properties and popularity CDF per (location or any, type or any)
+        self.n_locations = len(locations)
+        self.groups = {}
+        for location in range(self.n_locations + 1):
+            for property_type_code in range(len(PROPERTY_TYPES) + 1):
+                members = np.ones(len(properties), dtype=bool)
+                if location < self.n_locations:
+                    members &= property_location == location
+                if property_type_code < len(PROPERTY_TYPES):
+                    members &= property_type == property_type_code
+                members = np.flatnonzero(members)
+                if len(members):
+                    cdf = np.cumsum(self.popularity[members])
+                    self.groups[(location, property_type_code)] = (members, cdf / cdf[-1])
+
+    def sample(self, size):
+        """One chunk of interactions as integer-coded arrays"""
+        rng = self.rng
+        user_idx = rng.choice(len(self.user_weights), size=size, p=self.user_weights).astype(np.int32)
+
+        local = rng.random(size) < self.locality
+        affine = rng.random(size) < self.type_affinity
+        location_key = np.where(local, self.user_location[user_idx], self.n_locations)
+        type_key = np.where(affine, self.user_type[user_idx], len(PROPERTY_TYPES))
+
+        property_idx = np.empty(size, dtype=np.int32)
+        draws = rng.random(size)
+        everything = self.groups[(self.n_locations, len(PROPERTY_TYPES))]
+        keys = location_key * (len(PROPERTY_TYPES) + 1) + type_key
+        for key in np.unique(keys):
+            rows = np.flatnonzero(keys == key)
+            group = (int(key) // (len(PROPERTY_TYPES) + 1), int(key) % (len(PROPERTY_TYPES) + 1))
+            members, cdf = self.groups.get(group, everything)
+            property_idx[rows] = members[np.minimum(np.searchsorted(cdf, draws[rows]), len(members) - 1)]
+
+        noise = rng.normal(0.0, 0.75, size)
+        rating = np.clip(np.rint(self.quality[property_idx] + self.user_bias[user_idx] + noise), 1, 5).astype(np.int64)
+        type_code = rng.choice(len(INTERACTION_TYPES), size=size, p=INTERACTION_TYPE_SHARES).astype(np.int8)
+        timestamp = (self.end_time - rng.integers(0, self.history_seconds + 1, size)).astype(np.float64)
+        return {'user': user_idx, 'property': property_idx, 'rating': rating,
+                'interaction_type': type_code, 'timestamp': timestamp}
+
+    def chunks(self, num_interactions, chunk_size=CHUNK_SIZE):
+        """Yield coded interaction chunks until num_interactions have been produced"""
+        for start in range(0, num_interactions, chunk_size):
+            yield self.sample(min(chunk_size, num_interactions - start))
 
-    # Save to CSV
-    users_df.to_csv('synthetic_users.csv', index=False)
-    properties_df.to_csv('synthetic_properties.csv', index=False)
-    interactions_df.to_csv('synthetic_interactions.csv', index=False)
+def interactions_frame(chunk, user_ids, property_ids):
+    """CSV rows for one coded chunk, with ISO 8601 UTC timestamps"""
+    return pd.DataFrame({
+        'user_id': user_ids[chunk['user']],
+        'property_id': property_ids[chunk['property']],
+        'rating': chunk['rating'],
+        'interaction_type': np.asarray(INTERACTION_TYPES, dtype=object)[chunk['interaction_type']],
+        'timestamp': np.datetime_as_string(chunk['timestamp'].astype('datetime64[s]'), unit='s', timezone='UTC')
+    })
 
-    print('Synthetic data generated and saved as CSV files.') 
\ No newline at end of file
+def sorted_categorical(codes, ids):
+    """Categorical over ids sorted as strings, the id order the engine factorizes into"""
+    order = np.argsort(ids.astype(str), kind='stable')
+    rank = np.empty(len(ids), dtype=np.int32)
+    rank[order] = np.arange(len(ids), dtype=np.int32)
+    return pd.Categorical.from_codes(rank[codes], categories=pd.Index(ids[order]))
+
+def write_state(path, users, properties, coded, data_version):
+    """Build an engine straight from coded arrays and save it in the binary state format
+
+    The whole engine is built in memory first (see STATE_MAX_INTERACTIONS).
+    """
+    from enhanced_recommender import PropertyRecommendationEngine
+
+    # Only properties and users that occur end up in the rating store, as with the CSVs
+    interactions = pd.DataFrame({
+        'user_id': sorted_categorical(coded['user'], users['user_id'].to_numpy(dtype=object)),
+        'property_id': sorted_categorical(coded['property'], properties['property_id'].to_numpy(dtype=object)),
+        'rating': coded['rating'],
+        'interaction_type': pd.Categorical.from_codes(coded['interaction_type'], categories=INTERACTION_TYPES),
+        'timestamp': coded['timestamp']
+    })
+    engine = PropertyRecommendationEngine(sparse=True)
+    if not engine.load_frames(users, properties, interactions, data_version):
+        raise Exception("Failed to build engine from generated data")
+    if not engine.prepare_content_features():
+        raise Exception("Failed to prepare content features")
+    if not engine.save_state(path):
+        raise Exception(f"Failed to write engine state to {path}")
+
+def generate(output_dir='.', num_users=NUM_USERS, num_properties=NUM_PROPERTIES, num_interactions=NUM_INTERACTIONS,
+             seed=None, num_locations=len(LOCATIONS), chunk_size=CHUNK_SIZE, write_csv=True, state_path=None,
+             **sampler_params):
+    """Generate users, properties and interactions, streaming interactions to disk chunk by chunk
+
+    Same seed and parameters (chunk size and end_time included) give the
+    same data.
+    CSV output holds one chunk in memory at a time. state_path is not
+    streamed: it keeps every integer-coded interaction and builds the whole
+    engine in memory before saving it, so its peak memory grows with
+    num_interactions (about 140 bytes each).
+    """
+    rng = np.random.default_rng(seed)
+    locations = location_names(num_locations)
+    users = generate_users(num_users, rng, locations)
+    properties = generate_properties(num_properties, rng, locations)
+    sampler = InteractionSampler(users, properties, rng, **sampler_params)
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = [os.path.join(output_dir, name) for name in (USERS_FILE, PROPERTIES_FILE, INTERACTIONS_FILE)]
+    if write_csv:
+        users.to_csv(paths[0], index=False)
+        properties.to_csv(paths[1], index=False)
+
+    user_ids = users['user_id'].to_numpy(dtype=object)
+    property_ids = properties['property_id'].to_numpy(dtype=object)
+    coded = {name: [] for name in ('user', 'property', 'rating', 'interaction_type', 'timestamp')}
+    written = 0
+    for i, chunk in enumerate(sampler.chunks(num_interactions, chunk_size)):
+        if write_csv:
+            interactions_frame(chunk, user_ids, property_ids).to_csv(
+                paths[2], mode='w' if i == 0 else 'a', header=i == 0, index=False
+            )
+        if state_path:
+            for name, values in chunk.items():
+                coded[name].append(values)
+        written += len(chunk['user'])
+        logger.info(f"Generated {written}/{num_interactions} interactions")
+
+    if state_path:
+        coded = {name: np.concatenate(values) for name, values in coded.items()}
+        if write_csv:
+            # Same tag as an engine loaded from these CSVs
+            from enhanced_recommender import PropertyRecommendationEngine
+            data_version = PropertyRecommendationEngine.compute_data_version(*paths)
+        else:
+            parameters = {'users': num_users, 'properties': num_properties, 'interactions': num_interactions,
+                          'seed': seed if seed is not None else os.urandom(8).hex(), 'locations': num_locations,
+                          'chunk_size': chunk_size, 'end_time': sampler.end_time, **sampler_params}
+            data_version = hashlib.sha1(json.dumps(parameters, sort_keys=True).encode()).hexdigest()[:16]
+        write_state(state_path, users, properties, coded, data_version)
+
+def epoch_seconds(value):
+    """argparse type for times given as Unix seconds or as a date string"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return float(to_epoch_seconds([value])[0])
+    except (ValueError, TypeError) as e:
+        raise argparse.ArgumentTypeError(f"not Unix seconds or a date: {value}") from e
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic users, properties and interactions')
+    parser.add_argument('--users', type=int, default=NUM_USERS, help='Number of users')
+    parser.add_argument('--properties', type=int, default=NUM_PROPERTIES, help='Number of properties')
+    parser.add_argument('--interactions', type=int, default=NUM_INTERACTIONS, help='Number of interactions')
+    parser.add_argument('--seed', type=int, help='Random seed for reproducible output')
+    parser.add_argument('--locations', type=int, default=len(LOCATIONS), help='Number of cities')
+    parser.add_argument('--popularity-skew', type=float, default=1.1,
+                        help='Power-law exponent of property popularity (0 = uniform)')
+    parser.add_argument('--activity-skew', type=float, default=0.8,
+                        help='Power-law exponent of user activity (0 = uniform)')
+    parser.add_argument('--locality', type=float, default=0.6,
+                        help="Probability that an interaction is in the user's city")
+    parser.add_argument('--type-affinity', type=float, default=0.4,
+                        help="Probability that an interaction is with the user's preferred property type")
+    parser.add_argument('--history-days', type=float, default=HISTORY_DAYS, help='Length of the timestamp range')
+    parser.add_argument('--end-time', type=epoch_seconds, help='Latest timestamp, Unix seconds or ISO 8601 (default: now)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Interactions generated per chunk')
+    parser.add_argument('--output-dir', default='.', help='Directory for the CSV files')
+    parser.add_argument('--state', metavar='DIR',
+                        help='Also write the engine binary state to DIR (built in memory, about 140 bytes '
+                             'per interaction)')
+    parser.add_argument('--max-state-interactions', type=int, default=STATE_MAX_INTERACTIONS,
+                        help='Largest --interactions accepted with --state')
+    parser.add_argument('--no-csv', action='store_true', help='Skip the CSV files (use with --state)')
+    args = parser.parse_args()
+
+    if args.no_csv and not args.state:
+        parser.error('--no-csv needs --state')
+    if args.state and args.interactions > args.max_state_interactions:
+        parser.error(f'--state builds the engine in memory (about 140 bytes per interaction); '
+                     f'{args.interactions} interactions exceed --max-state-interactions '
+                     f'{args.max_state_interactions}')
+
+    generate(
+        args.output_dir, args.users, args.properties, args.interactions, seed=args.seed,
+        num_locations=args.locations, chunk_size=args.chunk_size, write_csv=not args.no_csv, state_path=args.state,
+        popularity_skew=args.popularity_skew, activity_skew=args.activity_skew, locality=args.locality,
+        type_affinity=args.type_affinity, history_days=args.history_days,
+        end_time=args.end_time
+    )
+
+    if not args.no_csv:
+        print('Synthetic data generated and saved as CSV files.')
+    if args.state:
+        print(f'Engine state written to {args.state}')
+
+if __name__ == '__main__':
+    main()
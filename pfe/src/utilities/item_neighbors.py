@@ -0,0 +1,144 @@
+import os
+import numpy as np
+from scipy import sparse
+import logging
+from sparse_rows import take_rows, replace_rows
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+NEIGHBORS_FORMAT = 1
+
+def _normalized_columns(ratings):
+    """Users x properties ratings with every property column scaled to unit length"""
+    ratings = sparse.csr_matrix(ratings, dtype=np.float64)
+    norms = np.sqrt(np.asarray(ratings.multiply(ratings).sum(axis=0)).ravel())
+    inverse = np.zeros_like(norms)
+    np.divide(1.0, norms, out=inverse, where=norms > 0)
+    return (ratings @ sparse.diags(inverse)).tocsr()
+
+def _top_k_entries(rows, cols, values, k):
+    """Positions of the k largest positive entries per row of a COO triple
+
+    Ties are broken by the lower column index, so builds are deterministic.
+    """
+    positive = np.flatnonzero(values > 0)
+    order = positive[np.lexsort((cols[positive], -values[positive], rows[positive]))]
+    sorted_rows = rows[order]
+    rank = np.arange(len(order)) - np.searchsorted(sorted_rows, sorted_rows, side='left')
+    return order[rank < k]
+
+def _similarity_block(normalized_t, normalized, items):
+    """Cosine similarities (co-rating based) of some properties to all properties, self excluded"""
+    block = (normalized_t[items] @ normalized).tocoo()
+    not_self = items[block.row] != block.col
+    return items[block.row[not_self]], block.col[not_self], block.data[not_self]
+
+def build_item_neighbors(ratings, k=50, block_size=1024):
+    """Sparse properties x properties matrix holding each property's top-K co-rated neighbors
+
+    Similarity is the cosine between property columns of the rating matrix,
+    so only properties rated by at least one common user are ever compared.
+    """
+    normalized = _normalized_columns(ratings)
+    normalized_t = normalized.T.tocsr()
+    n_items = normalized.shape[1]
+
+    rows, cols, values = [], [], []
+    for start in range(0, n_items, block_size):
+        items = np.arange(start, min(start + block_size, n_items))
+        block_rows, block_cols, block_values = _similarity_block(normalized_t, normalized, items)
+        keep = _top_k_entries(block_rows, block_cols, block_values, k)
+        rows.append(block_rows[keep])
+        cols.append(block_cols[keep])
+        values.append(block_values[keep])
+
+    if not rows:
+        return sparse.csr_matrix((n_items, n_items))
+    neighbors = sparse.csr_matrix(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), shape=(n_items, n_items)
+    )
+    logger.info(f"Built item neighbors: {n_items} properties, k={k}, {neighbors.nnz} pairs")
+    return neighbors
+
+def column_norms(ratings):
+    """L2 norm of every property column of a users x properties rating matrix"""
+    ratings = sparse.csr_matrix(ratings)
+    return np.sqrt(np.bincount(ratings.indices, weights=np.square(ratings.data), minlength=ratings.shape[1]))
+
+def update_item_neighbors(neighbors, ratings, ratings_csc, norms, touched, k=50):
+    """Refresh the neighbor matrix after the rating columns of touched properties changed
+
+    ratings and ratings_csc are the new rating store (CSR and CSC, possibly
+    with more users and properties than before) and norms the column_norms
+    of the old one; returns the new neighbor matrix and norms. A similarity
+    only changes when one of its two properties was touched, so only the
+    touched columns' raters are read, and only the rows of the touched
+    properties and of the properties co-rated with them are rebuilt and cut
+    back to k; every other row is copied unchanged. An entry that a row
+    pruned earlier cannot re-enter until the next full build.
+    """
+    n_items = ratings.shape[1]
+    touched = np.unique(np.asarray(touched, dtype=np.int64))
+    norms = np.concatenate([norms, np.zeros(n_items - len(norms))])
+    touched_t = sparse.csr_matrix(ratings_csc[:, touched].T)
+    norms[touched] = np.sqrt(np.asarray(touched_t.multiply(touched_t).sum(axis=1)).ravel())
+    inverse = np.zeros_like(norms)
+    np.divide(1.0, norms, out=inverse, where=norms > 0)
+
+    # Fresh similarities of the touched properties, from the rows of the users who rated them
+    users = np.unique(touched_t.indices)
+    local = sparse.csr_matrix(
+        (touched_t.data, np.searchsorted(users, touched_t.indices), touched_t.indptr),
+        shape=(len(touched), len(users))
+    )
+    dots = (local @ take_rows(ratings, users, n_items)).tocoo()
+    fresh_rows, fresh_cols = touched[dots.row], dots.col
+    fresh_values = dots.data * inverse[fresh_rows] * inverse[fresh_cols]
+    not_self = fresh_rows != fresh_cols
+    fresh_rows, fresh_cols, fresh_values = fresh_rows[not_self], fresh_cols[not_self], fresh_values[not_self]
+
+    # Rebuild the affected rows: old pairs that involve no touched property,
+    # plus the fresh similarities in both directions
+    affected = np.union1d(touched, fresh_cols)
+    old = take_rows(neighbors, affected, n_items).tocoo()
+    old_rows = affected[old.row]
+    kept = ~np.isin(old_rows, touched) & ~np.isin(old.col, touched)
+    mirrored = ~np.isin(fresh_cols, touched)
+    rows = np.concatenate([old_rows[kept], fresh_rows, fresh_cols[mirrored]])
+    cols = np.concatenate([old.col[kept], fresh_cols, fresh_rows[mirrored]])
+    values = np.concatenate([old.data[kept], fresh_values, fresh_values[mirrored]])
+
+    rows = np.searchsorted(affected, rows)
+    keep = _top_k_entries(rows, cols, values, k)
+    block = sparse.csr_matrix((values[keep], (rows[keep], cols[keep])), shape=(len(affected), n_items))
+    block.sort_indices()
+    return replace_rows(neighbors, affected, block, (n_items, n_items)), norms
+
+def save_item_neighbors(path, neighbors, item_ids, data_version, k):
+    """Write the neighbor matrix with the property id table it is aligned to"""
+    neighbors = sparse.csr_matrix(neighbors)
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(
+        tmp_path,
+        format=np.array(NEIGHBORS_FORMAT),
+        data_version=np.array(data_version),
+        k=np.array(k),
+        item_ids=np.asarray(item_ids, dtype=str),
+        indptr=neighbors.indptr,
+        indices=neighbors.indices,
+        data=neighbors.data.astype(np.float32)
+    )
+    os.replace(tmp_path, path)
+
+def load_item_neighbors(path):
+    """Read saved neighbors; returns (neighbors, item_ids, data_version, k)"""
+    with np.load(path, allow_pickle=False) as data:
+        if int(data['format']) != NEIGHBORS_FORMAT:
+            raise ValueError(f"Unsupported item neighbors format {int(data['format'])}")
+        item_ids = data['item_ids'].astype(object)
+        neighbors = sparse.csr_matrix(
+            (data['data'].astype(np.float64), data['indices'], data['indptr']), shape=(len(item_ids), len(item_ids))
+        )
+        return neighbors, item_ids, str(data['data_version']), int(data['k'])
@@ -0,0 +1,148 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'recommender_stage_seconds': ('histogram', 'Time spent in each scoring or response stage', LATENCY_BUCKETS),
+    'recommender_candidates': ('histogram', 'Candidate properties scored per user and method', SIZE_BUCKETS),
+    'recommender_request_seconds': ('histogram', 'HTTP request latency by endpoint and status', LATENCY_BUCKETS),
+    'recommender_requests_total': ('counter', 'HTTP requests by endpoint and status', None),
+    'recommender_errors_total': ('counter', 'Exceptions caught (and logged) by stage', None),
+    'recommender_trending_fallbacks_total': ('counter', 'Requests answered with trending properties instead', None)
+}
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms, rendered in the Prometheus text format
+
+    Samples are kept per process; in multi-process serving every worker
+    reports its own.
+    """
+
+    def __init__(self, metrics=METRICS):
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def increment(self, name, amount=1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + amount
+
+    def observe(self, name, value, **labels):
+        self.observe_many(name, (value,), **labels)
+
+    def observe_many(self, name, values, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.metrics[name][2]
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            for value in values:
+                histogram[0][bisect.bisect_left(buckets, value)] += 1
+                histogram[1] += value
+                histogram[2] += 1
+
+    def render(self, extra=None):
+        """Prometheus exposition text
+        
+        extra adds values kept elsewhere, as {name: (type, help, [(labels, value)])}.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self._histograms.items()}
+
+        lines = []
+        for name, (kind, help_text, buckets) in self.metrics.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'counter':
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                continue
+            for (metric, labels), (counts, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(list(buckets) + ['+Inf'], counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+
+        for name, (kind, help_text, samples) in (extra or {}).items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+# Process-wide registry used by the engine and the API
+registry = MetricsRegistry()
+
+# Per-thread stage list of the request being profiled, if any
+_profile = threading.local()
+
+def increment(name, amount=1.0, **labels):
+    registry.increment(name, amount, **labels)
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+def error(stage):
+    """Count an exception that was caught and logged at a stage"""
+    registry.increment('recommender_errors_total', stage=stage)
+
+def candidates(method, counts):
+    """Record candidate-set sizes: one count, or one per user of a scored block"""
+    if not hasattr(counts, '__iter__'):
+        counts = (counts,)
+    registry.observe_many('recommender_candidates', [int(count) for count in counts], method=method)
+
+@contextmanager
+def stage(name):
+    """Time a block into recommender_stage_seconds, and into the thread's profile when one is active"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe('recommender_stage_seconds', elapsed, stage=name)
+        stages = getattr(_profile, 'stages', None)
+        if stages is not None:
+            stages.append((name, elapsed))
+
+def start_profile():
+    """Start collecting this thread's stage timings"""
+    _profile.stages = []
+
+def end_profile():
+    """Stop collecting and return the timings as [{'stage', 'ms'}] in completion order"""
+    stages = getattr(_profile, 'stages', None) or []
+    _profile.stages = None
+    return [{'stage': name, 'ms': round(elapsed * 1000, 3)} for name, elapsed in stages]
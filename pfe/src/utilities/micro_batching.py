@@ -0,0 +1,109 @@
+import queue
+import threading
+import time
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class PendingRequest:
+    """One caller waiting for its share of a batch"""
+
+    def __init__(self, engine, user_id, rec_type, n, weights):
+        self.engine = engine
+        self.user_id = user_id
+        self.key = (id(engine), rec_type, n, tuple(sorted(weights.items())))
+        self.rec_type = rec_type
+        self.n = n
+        self.weights = weights
+        self.result = None
+        self.done = threading.Event()
+
+class MicroBatcher:
+    """Groups concurrent single-user recommendation requests into batched scoring calls
+
+    A dispatcher thread waits for a request, then keeps collecting for up to
+    window_ms (or until max_batch requests are queued). Requests that share
+    an engine, type, n and hybrid weights are scored with one
+    batch_recommendations call, i.e. one stacked similarity and top-k pass,
+    and each caller is handed its own list. A request therefore waits at
+    most one window plus the scoring time of its batch.
+    """
+
+    def __init__(self, window_ms=2.0, max_batch=64):
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+
+    def start(self):
+        """Start the dispatcher thread if it is not running"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+                self._thread.start()
+
+    def submit(self, engine, user_id, rec_type='hybrid', n=5, weights=None, timeout=30.0):
+        """Queue one request and wait for it; returns [(property_id, score), ...] or None on failure"""
+        self.start()
+        pending = PendingRequest(engine, user_id, rec_type, n, weights or {})
+        self._queue.put(pending)
+        if not pending.done.wait(timeout):
+            logger.error(f"Timed out waiting for batched recommendations for {user_id}")
+            return None
+        return pending.result
+
+    def _collect(self):
+        """Block for the first request, then gather more until the window closes or the batch is full"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            groups = {}
+            for pending in batch:
+                groups.setdefault(pending.key, []).append(pending)
+            for group in groups.values():
+                self._score(group)
+
+    def _score(self, group):
+        """Score one group of compatible requests and hand out the results"""
+        first = group[0]
+        try:
+            user_ids = list(dict.fromkeys(pending.user_id for pending in group))
+            recs = first.engine.batch_recommendations(
+                user_ids, first.rec_type, first.n, chunk_size=len(user_ids), **first.weights
+            )
+            for pending in group:
+                pending.result = recs.get(pending.user_id)
+        except Exception as e:
+            logger.error(f"Error scoring batch of {len(group)} requests: {e}")
+        finally:
+            with self._lock:
+                self.batches += 1
+                self.requests += len(group)
+            for pending in group:
+                pending.done.set()
+
+    def stats(self):
+        """Counters for tuning the window and batch size"""
+        with self._lock:
+            return {
+                'window_ms': self.window * 1000.0,
+                'max_batch': self.max_batch,
+                'batches': self.batches,
+                'requests': self.requests,
+                'mean_batch_size': round(self.requests / self.batches, 2) if self.batches else 0.0
+            }
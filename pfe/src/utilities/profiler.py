@@ -0,0 +1,177 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from functools import lru_cache
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Sampled stacks are kept only if they pass through a module of this service
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Innermost frames of threads that are parked rather than working
+IDLE_FRAMES = {
+    ('threading', 'Condition.wait'), ('threading', 'Event.wait'), ('threading', 'Thread.join'),
+    ('queue', 'Queue.get'), ('selectors', '_PollLikeSelector.select'), ('selectors', 'SelectSelector.select'),
+    ('socket', 'socket.accept')
+}
+
+ENGINE_PREFIX = 'enhanced_recommender.PropertyRecommendationEngine.'
+PANDAS_INDEXING_PREFIXES = ('pandas.core.indexing', 'pandas.core.indexes', 'pandas._libs.index')
+
+@lru_cache(maxsize=None)
+def module_name(filename):
+    """Dotted module name of a source file: the package path for installed packages, else the file name"""
+    path = filename.replace(os.sep, '/')
+    for marker in ('/site-packages/', '/dist-packages/'):
+        if marker in path:
+            path = path.split(marker, 1)[1]
+            break
+    else:
+        path = os.path.basename(path)
+    return path[:-3].replace('/', '.') if path.endswith('.py') else path
+
+def code_label(code):
+    """module.qualname of a Python code object, safe for collapsed-stack lines"""
+    return f"{module_name(code.co_filename)}.{code.co_qualname}".replace(';', ',').replace(' ', '_')
+
+def builtin_label(func):
+    """module.qualname of a C function seen by the profiler hook"""
+    module = getattr(func, '__module__', None)
+    qualname = getattr(func, '__qualname__', None) or getattr(func, '__name__', repr(func))
+    label = f"{module}.{qualname}" if module else qualname
+    return label.replace(';', ',').replace(' ', '_')
+
+def frame_stack(frame):
+    """Labels of a frame and its callers, outermost first"""
+    labels = []
+    while frame is not None:
+        labels.append(code_label(frame.f_code))
+        frame = frame.f_back
+    return tuple(reversed(labels))
+
+def is_idle(frame):
+    """True for threads parked in a wait, select or accept"""
+    code = frame.f_code
+    return (module_name(code.co_filename), code.co_qualname) in IDLE_FRAMES
+
+@lru_cache(maxsize=None)
+def is_service_file(filename):
+    return os.path.dirname(os.path.abspath(filename)) == SERVICE_DIR and not filename.endswith('profiler.py')
+
+def in_service(frame):
+    """True if any frame of the stack runs code from this service's modules"""
+    while frame is not None:
+        if is_service_file(frame.f_code.co_filename):
+            return True
+        frame = frame.f_back
+    return False
+
+class StackProfiler:
+    """Deterministic profiler for the calling thread, accumulating self time per call stack
+
+    Uses sys.setprofile, so C functions (numpy, pandas internals) appear as
+    leaf frames too. Every call pays the hook, which inflates absolute times;
+    compare stacks by their share of the total.
+    """
+
+    def __init__(self):
+        self.stacks = Counter()
+        self._stack = []
+        self._last = None
+
+    def _event(self, frame, event, arg):
+        now = time.perf_counter()
+        if self._stack:
+            self.stacks[tuple(self._stack)] += now - self._last
+        if event == 'call':
+            self._stack.append(code_label(frame.f_code))
+        elif event == 'c_call':
+            self._stack.append(builtin_label(arg))
+        elif self._stack:
+            # return, c_return or c_exception
+            self._stack.pop()
+        self._last = time.perf_counter()
+
+    def run(self, func, *args, **kwargs):
+        """Call func under the profiler; returns its result"""
+        self._last = time.perf_counter()
+        sys.setprofile(self._event)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sys.setprofile(None)
+
+    def weights(self):
+        """{stack: microseconds}"""
+        return {stack: int(seconds * 1e6) for stack, seconds in self.stacks.items() if seconds >= 1e-6}
+
+def sample_stacks(seconds, interval=0.005):
+    """Sample every other working thread of this process for a number of seconds
+
+    Returns ({stack: samples}, number of sampling rounds). Threads that are
+    parked, or whose stack never enters this service's modules, are skipped.
+    """
+    own_thread = threading.get_ident()
+    stacks = Counter()
+    rounds = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread or is_idle(frame) or not in_service(frame):
+                continue
+            stacks[frame_stack(frame)] += 1
+        rounds += 1
+        time.sleep(interval)
+    return dict(stacks), rounds
+
+def collapsed(stacks):
+    """Collapsed-stack text ("frame;frame;frame weight" per line) for flamegraph.pl or speedscope"""
+    return ''.join(
+        f"{';'.join(stack)} {weight}\n"
+        for stack, weight in sorted(stacks.items(), key=lambda item: -item[1])
+    )
+
+def pandas_in_engine(stacks):
+    """Weight spent in pandas below each engine method, and the part of it in indexing
+
+    Each stack is charged to its innermost PropertyRecommendationEngine
+    method that calls into pandas.
+    """
+    methods = {}
+    for stack, weight in stacks.items():
+        engine_frames = [i for i, label in enumerate(stack) if label.startswith(ENGINE_PREFIX)]
+        if not engine_frames:
+            continue
+        # Comprehensions and closures count toward their method
+        method = stack[engine_frames[-1]][len(ENGINE_PREFIX):].split('.')[0]
+        below = stack[engine_frames[-1] + 1:]
+        entry = methods.setdefault(method, {'method': method, 'total': 0, 'pandas': 0, 'pandas_indexing': 0})
+        entry['total'] += weight
+        if any(label.startswith('pandas') for label in below):
+            entry['pandas'] += weight
+            if any(label.startswith(PANDAS_INDEXING_PREFIXES) for label in below):
+                entry['pandas_indexing'] += weight
+
+    for entry in methods.values():
+        entry['pandas_share'] = round(entry['pandas'] / entry['total'], 4) if entry['total'] else 0.0
+    return sorted(methods.values(), key=lambda entry: -entry['pandas'])
+
+def report(stacks, unit, top=20):
+    """JSON-friendly summary of weighted stacks"""
+    total = sum(stacks.values())
+    hot = sorted(stacks.items(), key=lambda item: -item[1])[:top]
+    engine = pandas_in_engine(stacks)
+    return {
+        'unit': unit,
+        'total': total,
+        'engine_pandas': sum(entry['pandas'] for entry in engine),
+        'engine_pandas_indexing': sum(entry['pandas_indexing'] for entry in engine),
+        'engine_methods': engine,
+        'hot_stacks': [{'stack': ';'.join(stack), 'weight': weight} for stack, weight in hot],
+        'collapsed': collapsed(stacks)
+    }
@@ -0,0 +1,99 @@
+import numpy as np
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _candidate_mask(scores, exclude):
+    """Non-NaN scores minus the excluded positions (a boolean mask or an index array)"""
+    valid = ~np.isnan(scores)
+    if exclude is not None:
+        exclude = np.asarray(exclude)
+        if exclude.dtype == bool:
+            valid &= ~exclude
+        elif len(exclude):
+            valid[exclude.astype(np.int64)] = False
+    return valid
+
+def top_k(scores, k, exclude=None):
+    """Indices and scores of the k highest entries of a 1-D score array
+
+    NaN entries and excluded positions are never returned. Selection is an
+    O(N) partition followed by an O(k log k) sort of the survivors; ties are
+    broken by the lower index, so results are deterministic.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    candidates = np.flatnonzero(_candidate_mask(scores, exclude))
+    if k <= 0 or not len(candidates):
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    values = scores[candidates]
+
+    if k < len(candidates):
+        # Everything above the k-th largest value, then the lowest-index ties
+        kth = np.partition(values, len(values) - k)[len(values) - k]
+        above = np.flatnonzero(values > kth)
+        tied = np.flatnonzero(values == kth)[:k - len(above)]
+        keep = np.sort(np.concatenate([above, tied]))
+        candidates, values = candidates[keep], values[keep]
+
+    order = np.argsort(-values, kind='stable')
+    return candidates[order], values[order]
+
+def top_k_mask(scores, k):
+    """Boolean mask selecting the k highest non-NaN entries of every row of a 2-D block
+
+    Same selection and tie-breaking as top_k, vectorized across rows.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    valid = ~np.isnan(scores)
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.zeros(scores.shape, dtype=bool)
+
+    ranked = np.where(valid, scores, -np.inf)
+    kth = np.partition(ranked, scores.shape[1] - k, axis=1)[:, [scores.shape[1] - k]]
+    above = ranked > kth
+    tied = ranked == kth
+    needed = k - above.sum(axis=1, keepdims=True)
+    return (above | (tied & (np.cumsum(tied, axis=1) <= needed))) & valid
+
+def top_k_block(scores, k):
+    """Sorted per-row top k of a 2-D block as (indices, scores) arrays of width min(k, columns)
+
+    Rows with fewer than k candidates are padded with index -1 and score -inf.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.zeros((len(scores), 0), dtype=np.int64), np.zeros((len(scores), 0))
+
+    selected = top_k_mask(scores, k)
+    ranked = np.where(selected, scores, -np.inf)
+    top = np.argpartition(-ranked, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(ranked, top, axis=1)
+    empty = ~np.take_along_axis(selected, top, axis=1)
+    top[empty] = scores.shape[1]
+
+    # Score descending, then index ascending; padding sorts last
+    order = np.lexsort((top, -top_scores, empty), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    empty = np.take_along_axis(empty, order, axis=1)
+    top[empty] = -1
+    top_scores[empty] = -np.inf
+    return top, top_scores
+
+def top_k_rows(scores, k):
+    """Per-row top k (index, score) lists of a 2-D block, skipping NaN"""
+    top, top_scores = top_k_block(scores, k)
+    return [
+        [(idx, float(score)) for idx, score in zip(row_top, row_scores) if idx >= 0]
+        for row_top, row_scores in zip(top, top_scores)
+    ]
+
+def top_k_items(scores, k):
+    """Top k (key, score) pairs of a {key: score} dict, ties broken by insertion order"""
+    keys = list(scores)
+    indices, values = top_k(np.fromiter((scores[key] for key in keys), dtype=np.float64, count=len(keys)), k)
+    return [(keys[idx], float(value)) for idx, value in zip(indices, values)]
@@ -1,11 +1,21 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g, abort
 from flask_cors import CORS
 import pandas as pd
 import numpy as np
 from enhanced_recommender import PropertyRecommendationEngine
+from recommendation_snapshot import RecommendationSnapshot
+from micro_batching import MicroBatcher
+from trending import to_epoch_seconds
+import metrics
+import profiler
 import logging
+import json
+import hmac
 import os
 import sys
+import threading
+import time
+from collections import OrderedDict
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -14,22 +24,277 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)
 
+class ResultCache:
+    """Thread-safe LRU cache with per-entry TTL and hit/miss/eviction counters"""
+    
+    def __init__(self, max_entries=10000, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    def get(self, key):
+        """Return the cached value, or None on a miss or expired entry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def peek(self, key):
+        """Like get, but a miss is not counted (for probes that fall back to get)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries when full"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        """Drop every entry, keeping the counters"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        """Counters for sizing the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
 # Global recommendation engine instance
 recommendation_engine = None
 
-def initialize_engine():
-    """Initialize the recommendation engine"""
-    global recommendation_engine
+# Serializes engine writers (reloads, ingestion, listing edits); readers never lock.
+# Reentrant so writers can install the engine they built while holding it.
+engine_lock = threading.RLock()
+
+# Data version of the engine whose item neighbor build was last requested (see ensure_item_neighbors)
+item_neighbors_requested = None
+item_neighbors_lock = threading.Lock()
+
+# Precomputed recommendations matching the engine's data version, if any
+recommendation_snapshot = None
+
+# Set by recommendation_server in multi-process mode: hands writes to the
+# serving master instead of applying them to this process's engine
+update_forwarder = None
+
+# Formatted recommendation results keyed on (user, type, n, data version)
+result_cache = ResultCache(
+    max_entries=int(os.environ.get('RECOMMENDER_CACHE_SIZE', 10000)),
+    ttl_seconds=float(os.environ.get('RECOMMENDER_CACHE_TTL', 300))
+)
+
+# Groups concurrent live-scored /recommendations requests into one batched
+# scoring pass; disabled unless RECOMMENDER_MICROBATCH_WINDOW_MS is set
+micro_batch_window = float(os.environ.get('RECOMMENDER_MICROBATCH_WINDOW_MS', 0))
+micro_batcher = MicroBatcher(
+    window_ms=micro_batch_window,
+    max_batch=int(os.environ.get('RECOMMENDER_MICROBATCH_SIZE', 64))
+) if micro_batch_window > 0 else None
+
+def load_snapshot(engine):
+    """Load the precomputed snapshot named by RECOMMENDER_SNAPSHOT if it matches the data"""
+    path = os.environ.get('RECOMMENDER_SNAPSHOT')
+    if not path:
+        return None
     try:
-        recommendation_engine = PropertyRecommendationEngine()
-        
+        snapshot = RecommendationSnapshot(path)
+        if snapshot.data_version != engine.data_version:
+            logger.warning(f"Ignoring snapshot {path}: data version {snapshot.data_version} "
+                           f"does not match {engine.data_version}")
+            return None
+        logger.info(f"Serving {len(snapshot)} users from snapshot {path}")
+        return snapshot
+    except Exception as e:
+        logger.error(f"Error loading snapshot {path}: {e}")
+        return None
+
+def build_engine():
+    """Create and fully prepare a new recommendation engine"""
+    sparse_mode = os.environ.get('RECOMMENDER_SPARSE', 'True').lower() == 'true'
+    engine = PropertyRecommendationEngine(sparse=sparse_mode)
+    
+    state_path = os.environ.get('RECOMMENDER_STATE')
+    if state_path:
+        # Prepared binary state (see enhanced_recommender.py --convert)
+        verify = os.environ.get('RECOMMENDER_STATE_VERIFY', 'False').lower() == 'true'
+        if not engine.load_state(state_path, verify=verify):
+            raise Exception("Failed to load engine state")
+    else:
         # Load data
-        if not recommendation_engine.load_data():
+        if not engine.load_data():
             raise Exception("Failed to load data")
         
         # Prepare content features
-        if not recommendation_engine.prepare_content_features():
+        if not engine.prepare_content_features():
             raise Exception("Failed to prepare content features")
+    
+    prepare_engine(engine)
+    return engine
+
+def prepare_engine(engine):
+    """Build the indexes and models a loaded engine does not already carry"""
+    # Optional approximate nearest-neighbor backend for content search; an
+    # index loaded with the state is kept unless it was built differently
+    ann_backend = os.environ.get('RECOMMENDER_ANN_BACKEND')
+    if ann_backend:
+        ann_params = {}
+        if ann_backend == 'ivf':
+            ann_params['n_probe'] = int(os.environ.get('RECOMMENDER_ANN_PROBES', 8))
+            if os.environ.get('RECOMMENDER_ANN_LISTS'):
+                ann_params['n_lists'] = int(os.environ['RECOMMENDER_ANN_LISTS'])
+        index = engine.content_index
+        if (index is None or index.backend != ann_backend
+                or ann_params.get('n_lists', index.params().get('n_lists')) != index.params().get('n_lists')):
+            if not engine.build_content_index(ann_backend, **ann_params):
+                raise Exception("Failed to build content index")
+        elif 'n_probe' in ann_params:
+            # Query-time setting only
+            index.n_probe = ann_params['n_probe']
+    
+    # Optional matrix factorization model for type=mf (see enhanced_recommender.py --train-mf)
+    mf_path = os.environ.get('RECOMMENDER_MF_MODEL')
+    if mf_path and engine.mf_model is None:
+        if not (os.path.exists(mf_path) and engine.load_mf_model(mf_path)):
+            logger.info(f"Training matrix factorization model for data version {engine.data_version}")
+            if not engine.train_mf():
+                raise Exception("Failed to train matrix factorization model")
+            engine.save_mf_model(mf_path)
+    
+    # Item-based CF neighbors: computed offline (enhanced_recommender.py --build-item-neighbors)
+    # or here when a neighbors file or a hybrid item weight is configured; otherwise they are
+    # built on the first type=item request (see ensure_item_neighbors)
+    item_path = os.environ.get('RECOMMENDER_ITEM_NEIGHBORS')
+    item_weight = float(os.environ.get('RECOMMENDER_HYBRID_ITEM_WEIGHT', 0.0))
+    if engine.item_neighbors is None and (item_path or item_weight > 0):
+        if not (item_path and os.path.exists(item_path) and engine.load_item_neighbors(item_path)):
+            if not engine.build_item_neighbors(k=int(os.environ.get('RECOMMENDER_ITEM_K', 50))):
+                raise Exception("Failed to build item neighbors")
+            if item_path:
+                engine.save_item_neighbors(item_path)
+    
+    # Optional time decay of trending counters and recency weighting of ratings
+    # (both need timestamped interactions to have an effect)
+    trending_hours = os.environ.get('RECOMMENDER_TRENDING_HALF_LIFE_HOURS')
+    trending_half_life = float(trending_hours) * 3600 if trending_hours else None
+    if engine.trending_half_life != trending_half_life:
+        engine.set_trending_half_life(trending_half_life)
+    recency_days = os.environ.get('RECOMMENDER_RECENCY_HALF_LIFE_DAYS')
+    recency_half_life = float(recency_days) * 86400 if recency_days else None
+    if engine.recency_half_life != recency_half_life:
+        engine.set_recency_half_life(recency_half_life)
+    
+    # Precompute neighbor lists for /similar-properties
+    similar_k = int(os.environ.get('RECOMMENDER_SIMILAR_K', 50))
+    if engine.similarity_index is None or engine.similarity_index.k != similar_k:
+        if not engine.build_similarity_index(k=similar_k):
+            raise Exception("Failed to build similarity index")
+
+def ensure_item_neighbors(engine):
+    """True if the engine has item neighbors; otherwise request them once and return False
+    
+    The build is an ordinary write (submit_update) run off the request
+    thread: an engine copy with the neighbors is swapped in, or in
+    multi-process mode published by the master, when it is ready.
+    """
+    global item_neighbors_requested
+    if engine.item_neighbors is not None:
+        return True
+    with item_neighbors_lock:
+        if item_neighbors_requested != engine.data_version:
+            item_neighbors_requested = engine.data_version
+            logger.info(f"Requesting item neighbors for data version {engine.data_version}")
+            threading.Thread(target=request_item_neighbors, daemon=True).start()
+    return False
+
+def request_item_neighbors():
+    """Build item neighbors as a write; a failed local build can be requested again"""
+    global item_neighbors_requested
+    engine = submit_update('item_neighbors', int(os.environ.get('RECOMMENDER_ITEM_K', 50)))
+    if engine is None and update_forwarder is None:
+        with item_neighbors_lock:
+            item_neighbors_requested = None
+
+def install_engine(engine, snapshot):
+    """Make a prepared engine (and its snapshot) the one requests are served from"""
+    global recommendation_engine, recommendation_snapshot
+    with engine_lock:
+        recommendation_engine = engine
+        recommendation_snapshot = snapshot
+        result_cache.clear()
+
+def apply_engine_update(engine, kind, payload):
+    """Apply one write to an engine; returns the engine to serve next, or None if it failed
+    
+    Every write builds a new engine (or returns the given one when there is
+    nothing to change) and leaves the given one untouched, so requests
+    already reading it are never affected.
+    """
+    if kind == 'interactions':
+        return engine.with_interactions(payload)
+    if kind == 'upsert_property':
+        return engine.with_property(payload)
+    if kind == 'remove_property':
+        return engine.without_property(payload)
+    if kind == 'item_neighbors':
+        return engine.with_item_neighbors(payload)
+    raise ValueError(f"Unknown update kind: {kind}")
+
+def submit_update(kind, payload):
+    """Apply a write to the serving engine, or forward it to the master in multi-process mode"""
+    if update_forwarder is not None:
+        return update_forwarder(kind, payload)
+    
+    with engine_lock:
+        engine = apply_engine_update(recommendation_engine, kind, payload)
+        if engine is not None and engine is not recommendation_engine:
+            # The snapshot stays valid for users not in engine.updated_users after
+            # ingestion, but a listing edit can change any user's lists
+            keep_snapshot = kind in ('interactions', 'item_neighbors')
+            install_engine(engine, recommendation_snapshot if keep_snapshot else None)
+    return engine
+
+def initialize_engine():
+    """Initialize the recommendation engine"""
+    try:
+        # Build off to the side; requests keep using the old engine until the swap
+        engine = build_engine()
+        install_engine(engine, load_snapshot(engine))
         
         logger.info("Recommendation engine initialized successfully")
         return True
@@ -37,19 +302,199 @@ def initialize_engine():
         logger.error(f"Error initializing recommendation engine: {e}")
         return False
 
+def health_status():
+    """Health report; cheap enough to build without leaving an event loop"""
+    engine = recommendation_engine
+    return {
+        'status': 'healthy',
+        'service': 'recommendation-api',
+        'engine_ready': engine is not None,
+        'data_version': engine.data_version if engine else None,
+        'snapshot_users': len(recommendation_snapshot) if recommendation_snapshot else 0,
+        'cache': result_cache.stats(),
+        'micro_batching': micro_batcher.stats() if micro_batcher else None
+    }
+
+@app.before_request
+def start_request_timer():
+    """Time every request; ?profile=1 also collects its per-stage breakdown"""
+    g.request_start = time.perf_counter()
+    g.profiling = request.args.get('profile') == '1'
+    if g.profiling:
+        metrics.start_profile()
+
+@app.after_request
+def record_request_metrics(response):
+    """Count the request and, when profiled, add the stage breakdown to its JSON body"""
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unknown'
+    status = str(response.status_code)
+    metrics.observe('recommender_request_seconds', elapsed, endpoint=endpoint, status=status)
+    metrics.increment('recommender_requests_total', endpoint=endpoint, status=status)
+    
+    if g.profiling:
+        stages = metrics.end_profile()
+        if response.is_json and not response.is_streamed:
+            body = response.get_json()
+            if isinstance(body, dict):
+                body['profile'] = {'total_ms': round(elapsed * 1000, 3), 'stages': stages}
+                response.set_data(app.json.response(body).get_data())
+    return response
+
+@app.teardown_request
+def end_request_profile(exc):
+    if g.get('profiling'):
+        metrics.end_profile()
+
+def cache_metrics():
+    """Result cache and micro-batching counters in the /metrics layout"""
+    cache = result_cache.stats()
+    extra = {
+        'recommender_cache_entries': ('gauge', 'Formatted results held in the result cache',
+                                      [({}, cache['entries'])]),
+        'recommender_cache_lookups_total': ('counter', 'Result cache lookups by outcome', [
+            ({'result': 'hit'}, cache['hits']),
+            ({'result': 'miss'}, cache['misses'])
+        ]),
+        'recommender_cache_evictions_total': ('counter', 'Result cache entries dropped by reason', [
+            ({'reason': 'capacity'}, cache['evictions']),
+            ({'reason': 'expired'}, cache['expirations'])
+        ])
+    }
+    if micro_batcher is not None:
+        batching = micro_batcher.stats()
+        extra['recommender_micro_batches_total'] = ('counter', 'Micro-batched scoring passes',
+                                                   [({}, batching['batches'])])
+        extra['recommender_micro_batched_requests_total'] = ('counter', 'Requests scored in micro-batches',
+                                                            [({}, batching['requests'])])
+    return extra
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text exposition of this process's counters and stage timings"""
+    return Response(metrics.registry.render(cache_metrics()), mimetype='text/plain; version=0.0.4')
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'service': 'recommendation-api',
-        'engine_ready': recommendation_engine is not None
-    })
+    return jsonify(health_status())
+
+def cached_recommendations(user_id, rec_type='hybrid', n=5):
+    """The /recommendations response body if it is already cached, else None
+    
+    Only probes the cache (no scoring, user mapping or fallbacks), so async
+    front ends can answer hits without going through the worker pool.
+    """
+    engine = recommendation_engine
+    if not engine or not user_id or not engine.has_user(user_id):
+        return None
+    results = result_cache.peek((user_id, rec_type, n, engine.data_version))
+    if results is None:
+        return None
+    return {
+        'user_id': user_id,
+        'type': rec_type,
+        'recommendations': results,
+        'total_count': len(results)
+    }
+
+def hybrid_weights(engine):
+    """Weights of the optional item-based and MF scores in hybrid lists; 0 unless configured"""
+    return {
+        'item_weight': float(os.environ.get('RECOMMENDER_HYBRID_ITEM_WEIGHT', 0.0))
+        if engine.item_neighbors is not None else 0.0,
+        'mf_weight': float(os.environ.get('RECOMMENDER_HYBRID_MF_WEIGHT', 0.0))
+        if engine.mf_model is not None else 0.0
+    }
+
+def resolve_user_id(engine, user_id):
+    """Return the rating-store user for a request, mapping real user IDs if needed"""
+    if engine.has_user(user_id):
+        return user_id
+    
+    # Try to map real user ID to synthetic user ID
+    mapped_user_id = None
+    if len(user_id) == 24:  # MongoDB ObjectId length
+        mapped_user_id = engine.map_real_user_to_synthetic(user_id)
+        if mapped_user_id:
+            logger.info(f"Using mapped user ID: {mapped_user_id} for real user: {user_id}")
+        else:
+            logger.warning(f"Failed to map user {user_id}, falling back to trending properties")
+    
+    if not mapped_user_id or not engine.has_user(mapped_user_id):
+        logger.warning(f"User {user_id} not found in synthetic data, falling back to trending properties")
+        return None
+    return mapped_user_id
+
+def property_item(engine, prop_id, **fields):
+    """Response item for one property: the given score fields plus its details"""
+    details = engine.get_property_details(prop_id)
+    if details is None:
+        return None
+    return {
+        'property_id': prop_id,
+        **fields,
+        'type': details['type'],
+        'price': int(details['price']),
+        'location': details['location'],
+        'bedrooms': int(details['bedrooms']),
+        'bathrooms': int(details['bathrooms'])
+    }
+
+def format_recommendations(engine, recs):
+    """Build response items with property details for (property_id, score) pairs"""
+    results = []
+    with metrics.stage('property_details'):
+        for prop_id, score in recs:
+            item = property_item(engine, prop_id, score=round(float(score), 3))
+            if item:
+                results.append(item)
+    return results
+
+# Listing attribute filters of /recommendations and /similar-properties
+# (property_type, since type already selects the recommendation method)
+FILTER_PARAMS = ('location', 'property_type', 'min_price', 'max_price', 'bedrooms', 'min_bedrooms', 'max_bedrooms')
+
+def property_filters(args):
+    """Engine attribute filters from query parameters; raises ValueError on non-numeric bounds
+    
+    location and property_type accept comma-separated values.
+    """
+    filters = {}
+    if args.get('location'):
+        filters['location'] = args.get('location').split(',')
+    if args.get('property_type'):
+        filters['type'] = args.get('property_type').split(',')
+    for param in ('min_price', 'max_price', 'min_bedrooms', 'max_bedrooms'):
+        if args.get(param):
+            filters[param] = float(args.get(param))
+    if args.get('bedrooms'):
+        filters['min_bedrooms'] = filters['max_bedrooms'] = float(args.get('bedrooms'))
+    return filters
+
+def filters_key(filters):
+    """Hashable form of attribute filters, for cache keys"""
+    return tuple(sorted((name, tuple(value) if isinstance(value, list) else value) for name, value in filters.items()))
+
+def trending_fallback(engine, n, filters=None):
+    """Trending properties returned to users without interaction history"""
+    metrics.increment('recommender_trending_fallbacks_total')
+    with metrics.stage('trending'):
+        trending = engine.get_trending_properties(n, filters=filters)
+    results = []
+    with metrics.stage('property_details'):
+        for prop_id, score in trending:
+            item = property_item(engine, prop_id, score=round(float(score), 3), reason='trending')
+            if item:
+                results.append(item)
+    return results
 
 @app.route('/recommendations', methods=['GET'])
 def get_recommendations():
     """Get personalized recommendations for a user"""
     try:
+        # Read the engine once so a concurrent swap can't change it mid-request
+        engine = recommendation_engine
         user_id = request.args.get('user_id')
         rec_type = request.args.get('type', 'hybrid')
         n = int(request.args.get('n', 5))
@@ -57,105 +502,225 @@ def get_recommendations():
         if not user_id:
             return jsonify({'error': 'user_id is required'}), 400
         
-        if not recommendation_engine:
+        if not engine:
             return jsonify({'error': 'Recommendation engine not initialized'}), 500
         
+        try:
+            filters = property_filters(request.args)
+        except ValueError:
+            return jsonify({'error': 'Price and bedroom filters must be numbers'}), 400
+        
         # Check if user exists in synthetic data
-        mapped_user_id = user_id
-        if user_id not in recommendation_engine.rating_matrix.index:
-            # Try to map real user ID to synthetic user ID
-            if len(user_id) == 24:  # MongoDB ObjectId length
-                mapped_user_id = recommendation_engine.map_real_user_to_synthetic(user_id)
-                if mapped_user_id:
-                    logger.info(f"Using mapped user ID: {mapped_user_id} for real user: {user_id}")
+        with metrics.stage('resolve_user'):
+            mapped_user_id = resolve_user_id(engine, user_id)
+        if not mapped_user_id:
+            # Return trending properties instead of error
+            results = trending_fallback(engine, n, filters)
+            return jsonify({
+                'user_id': user_id,
+                'type': 'trending_fallback',
+                'recommendations': results,
+                'total_count': len(results),
+                **({'filters': filters} if filters else {})
+            })
+        
+        if rec_type not in ('collaborative', 'content', 'hybrid', 'item', 'mf'):
+            return jsonify({'error': 'Invalid recommendation type. Use: collaborative, content, hybrid, item, or mf'}), 400
+        
+        if rec_type == 'mf' and engine.mf_model is None:
+            return jsonify({'error': 'Matrix factorization model not loaded (set RECOMMENDER_MF_MODEL)'}), 400
+        
+        if rec_type == 'item' and not ensure_item_neighbors(engine):
+            return jsonify({'error': 'Item neighbors are being built; retry shortly'}), 503, {'Retry-After': '30'}
+        
+        cache_key = (mapped_user_id, rec_type, n, engine.data_version)
+        if filters:
+            cache_key += (filters_key(filters),)
+        results = result_cache.get(cache_key)
+        
+        if results is None:
+            # Serve from the precomputed snapshot when it covers this request
+            # (its hybrid lists use the default weights, without item-based or MF scores)
+            recs = None
+            snapshot = recommendation_snapshot
+            weights = hybrid_weights(engine)
+            if snapshot is not None and mapped_user_id not in engine.updated_users and not filters:
+                if rec_type != 'hybrid' or not any(weights.values()):
+                    with metrics.stage('snapshot_lookup'):
+                        recs = snapshot.lookup(mapped_user_id, rec_type, n)
+            
+            # Otherwise score live, batched with concurrent requests when enabled
+            # (scoring then runs on the batcher thread, so the profile shows the wait)
+            if recs is None and micro_batcher is not None and not filters:
+                with metrics.stage('micro_batch'):
+                    recs = micro_batcher.submit(engine, mapped_user_id, rec_type, n, weights)
+            
+            # Or on its own based on type using mapped user ID, scoring
+            # only the listings that pass the attribute filters
+            if recs is None:
+                if rec_type == 'collaborative':
+                    recs = list(engine.collaborative_filtering(mapped_user_id, n, filters=filters).items())
+                elif rec_type == 'content':
+                    recs = list(engine.content_based_filtering(mapped_user_id, n, filters=filters).items())
+                elif rec_type == 'item':
+                    recs = list(engine.item_based_filtering(mapped_user_id, n, filters=filters).items())
+                elif rec_type == 'mf':
+                    recs = list(engine.mf_recommendations(mapped_user_id, n, filters=filters).items())
                 else:
-                    logger.warning(f"Failed to map user {user_id}, falling back to trending properties")
+                    recs = engine.hybrid_recommendations(mapped_user_id, n, **weights, filters=filters)
             
-            if not mapped_user_id or mapped_user_id not in recommendation_engine.rating_matrix.index:
-                logger.warning(f"User {user_id} not found in synthetic data, falling back to trending properties")
-                # Return trending properties instead of error
-                trending_recs = recommendation_engine.get_trending_properties(n)
-                
-                # Build response with property details
-                results = []
-                for prop_id, score in trending_recs:
-                    prop_details = recommendation_engine.get_property_details(prop_id)
-                    if prop_details:
-                        results.append({
-                            'property_id': prop_id,
-                            'score': score,
-                            'type': prop_details['type'],
-                            'price': prop_details['price'],
-                            'location': prop_details['location'],
-                            'bedrooms': prop_details['bedrooms'],
-                            'bathrooms': prop_details['bathrooms'],
-                            'reason': 'trending'
-                        })
-                
-                return jsonify({
-                    'user_id': user_id,
-                    'type': 'trending_fallback',
-                    'recommendations': results,
-                    'total_count': len(results)
-                })
-        
-        # Get recommendations based on type using mapped user ID
-        if rec_type == 'collaborative':
-            recs = recommendation_engine.collaborative_filtering(mapped_user_id, n)
-            recs = list(recs.items())
-        elif rec_type == 'content':
-            recs = recommendation_engine.content_based_filtering(mapped_user_id, n)
-            recs = list(recs.items())
-        elif rec_type == 'hybrid':
-            recs = recommendation_engine.hybrid_recommendations(mapped_user_id, n)
-        else:
-            return jsonify({'error': 'Invalid recommendation type. Use: collaborative, content, or hybrid'}), 400
+            # Build response with property details
+            results = format_recommendations(engine, recs)
+            result_cache.put(cache_key, results)
         
-        # Build response with property details
-        results = []
-        for prop_id, score in recs:
-            prop_info = recommendation_engine.df_properties[
-                recommendation_engine.df_properties['property_id'] == prop_id
-            ]
+        with metrics.stage('serialize'):
+            return jsonify({
+                'user_id': user_id,
+                'type': rec_type,
+                'recommendations': results,
+                'total_count': len(results),
+                **({'filters': filters} if filters else {})
+            })
+        
+    except Exception as e:
+        logger.error(f"Error getting recommendations: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/recommendations/batch', methods=['POST'])
+def get_batch_recommendations():
+    """Get recommendations for many users in one call"""
+    try:
+        engine = recommendation_engine
+        data = request.get_json(silent=True) or {}
+        user_ids = data.get('user_ids')
+        rec_type = data.get('type', 'hybrid')
+        n = int(data.get('n', 5))
+        stream = bool(data.get('stream', False))
+        
+        if not isinstance(user_ids, list) or not user_ids:
+            return jsonify({'error': 'user_ids must be a non-empty list'}), 400
+        
+        if rec_type not in ('collaborative', 'content', 'hybrid', 'item', 'mf'):
+            return jsonify({'error': 'Invalid recommendation type. Use: collaborative, content, hybrid, item, or mf'}), 400
+        
+        if not engine:
+            return jsonify({'error': 'Recommendation engine not initialized'}), 500
+        
+        if rec_type == 'mf' and engine.mf_model is None:
+            return jsonify({'error': 'Matrix factorization model not loaded (set RECOMMENDER_MF_MODEL)'}), 400
+        
+        if rec_type == 'item' and not ensure_item_neighbors(engine):
+            return jsonify({'error': 'Item neighbors are being built; retry shortly'}), 503, {'Retry-After': '30'}
+        
+        chunk_size = int(os.environ.get('RECOMMENDER_BATCH_CHUNK', 256))
+        user_ids = [str(user_id) for user_id in user_ids]
+        mapped_ids = {user_id: resolve_user_id(engine, user_id) for user_id in user_ids}
+        fallback = None
+        
+        def user_results(chunk):
+            """Score one chunk of users and yield one response entry per user"""
+            nonlocal fallback
+            mapped_chunk = list({mapped for mapped in (mapped_ids[u] for u in chunk) if mapped})
+            recs = engine.batch_recommendations(mapped_chunk, rec_type, n, chunk_size, **hybrid_weights(engine))
             
-            if not prop_info.empty:
-                prop_data = prop_info.iloc[0]
-                results.append({
-                    'property_id': prop_id,
-                    'score': round(float(score), 3),
-                    'type': prop_data['type'],
-                    'price': int(prop_data['price']),
-                    'location': prop_data['location'],
-                    'bedrooms': int(prop_data['bedrooms']),
-                    'bathrooms': int(prop_data['bathrooms'])
-                })
+            for user_id in chunk:
+                mapped_user_id = mapped_ids[user_id]
+                if mapped_user_id in recs:
+                    results = format_recommendations(engine, recs[mapped_user_id])
+                    yield {'user_id': user_id, 'type': rec_type,
+                           'recommendations': results, 'total_count': len(results)}
+                else:
+                    if fallback is None:
+                        fallback = trending_fallback(engine, n)
+                    yield {'user_id': user_id, 'type': 'trending_fallback',
+                           'recommendations': fallback, 'total_count': len(fallback)}
+        
+        if stream:
+            def generate():
+                for start in range(0, len(user_ids), chunk_size):
+                    for entry in user_results(user_ids[start:start + chunk_size]):
+                        yield json.dumps(entry) + '\n'
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
         
+        results = list(user_results(user_ids))
         return jsonify({
-            'user_id': user_id,
             'type': rec_type,
-            'recommendations': results,
+            'results': results,
             'total_count': len(results)
         })
         
     except Exception as e:
-        logger.error(f"Error getting recommendations: {e}")
+        logger.error(f"Error getting batch recommendations: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/recommendations/export', methods=['GET'])
+def export_recommendations():
+    """Stream recommendations for every user as NDJSON, resumable from a cursor"""
+    try:
+        engine = recommendation_engine
+        rec_type = request.args.get('type', 'hybrid')
+        n = int(request.args.get('n', 5))
+        cursor = int(request.args.get('cursor', 0))
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+        data_version = request.args.get('data_version')
+        
+        if rec_type not in ('collaborative', 'content', 'hybrid', 'item', 'mf'):
+            return jsonify({'error': 'Invalid recommendation type. Use: collaborative, content, hybrid, item, or mf'}), 400
+        
+        if not engine:
+            return jsonify({'error': 'Recommendation engine not initialized'}), 500
+        
+        if rec_type == 'mf' and engine.mf_model is None:
+            return jsonify({'error': 'Matrix factorization model not loaded (set RECOMMENDER_MF_MODEL)'}), 400
+        
+        if rec_type == 'item' and not ensure_item_neighbors(engine):
+            return jsonify({'error': 'Item neighbors are being built; retry shortly'}), 503, {'Retry-After': '30'}
+        
+        # Cursors are positions in the user order of one data version
+        if data_version and data_version != engine.data_version:
+            return jsonify({'error': 'Data version changed; restart the export from cursor 0',
+                            'data_version': engine.data_version}), 409
+        
+        chunk_size = int(os.environ.get('RECOMMENDER_BATCH_CHUNK', 256))
+        weights = hybrid_weights(engine)
+        
+        def generate():
+            for next_cursor, user_id, recs in engine.iter_recommendations(rec_type, n, chunk_size, cursor, limit, **weights):
+                results = format_recommendations(engine, recs)
+                yield json.dumps({'user_id': user_id, 'type': rec_type, 'recommendations': results,
+                                  'total_count': len(results), 'cursor': next_cursor}) + '\n'
+        
+        response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        response.headers['X-Data-Version'] = engine.data_version
+        response.headers['X-Total-Users'] = str(len(engine.user_ids))
+        return response
+        
+    except Exception as e:
+        logger.error(f"Error exporting recommendations: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/similar-properties', methods=['GET'])
 def get_similar_properties():
     """Get similar properties based on content similarity"""
     try:
+        engine = recommendation_engine
         property_id = request.args.get('property_id')
         n = int(request.args.get('n', 5))
         
         if not property_id:
             return jsonify({'error': 'property_id is required'}), 400
         
-        if not recommendation_engine:
+        if not engine:
             return jsonify({'error': 'Recommendation engine not initialized'}), 500
         
-        # Get similar properties
-        similar_props = recommendation_engine.get_similar_properties(property_id, n)
+        try:
+            filters = property_filters(request.args)
+        except ValueError:
+            return jsonify({'error': 'Price and bedroom filters must be numbers'}), 400
+        
+        # Get similar properties, among the listings that pass the attribute filters
+        with metrics.stage('similar_properties'):
+            similar_props = engine.get_similar_properties(property_id, n, filters)
         
         if not similar_props:
             return jsonify({
@@ -166,77 +731,147 @@ def get_similar_properties():
         
         # Build response with property details
         results = []
-        for prop_id, score in similar_props:
-            prop_info = recommendation_engine.df_properties[
-                recommendation_engine.df_properties['property_id'] == prop_id
-            ]
-            
-            if not prop_info.empty:
-                prop_data = prop_info.iloc[0]
-                results.append({
-                    'property_id': prop_id,
-                    'similarity_score': round(float(score), 3),
-                    'type': prop_data['type'],
-                    'price': int(prop_data['price']),
-                    'location': prop_data['location'],
-                    'bedrooms': int(prop_data['bedrooms']),
-                    'bathrooms': int(prop_data['bathrooms'])
-                })
+        with metrics.stage('property_details'):
+            for prop_id, score in similar_props:
+                item = property_item(engine, prop_id, similarity_score=round(float(score), 3))
+                if item:
+                    results.append(item)
+        
+        with metrics.stage('serialize'):
+            return jsonify({
+                'property_id': property_id,
+                'similar_properties': results,
+                'total_count': len(results)
+            })
+        
+    except Exception as e:
+        logger.error(f"Error getting similar properties: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/properties/<property_id>', methods=['PUT'])
+def upsert_property(property_id):
+    """Add or update a listing in the recommendation data"""
+    try:
+        engine = recommendation_engine
+        if not engine:
+            return jsonify({'error': 'Recommendation engine not initialized'}), 500
+        
+        data = request.get_json(silent=True) or {}
+        required = ['type', 'price', 'location', 'bedrooms', 'bathrooms']
+        missing = [field for field in required if field not in data]
+        if missing:
+            return jsonify({'error': f"Missing fields: {', '.join(missing)}"}), 400
+        
+        property_data = {field: data[field] for field in required}
+        property_data['property_id'] = property_id
+        
+        if submit_update('upsert_property', property_data) is None:
+            return jsonify({'error': 'Failed to update property'}), 500
+        
+        return jsonify({'message': 'Property updated', 'property_id': property_id})
+        
+    except Exception as e:
+        logger.error(f"Error updating property {property_id}: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/properties/<property_id>', methods=['DELETE'])
+def remove_property(property_id):
+    """Remove a listing from the recommendation data"""
+    try:
+        engine = recommendation_engine
+        if not engine:
+            return jsonify({'error': 'Recommendation engine not initialized'}), 500
+        
+        if submit_update('remove_property', property_id) is None:
+            return jsonify({'error': f'Property {property_id} not found'}), 404
+        
+        return jsonify({'message': 'Property removed', 'property_id': property_id})
+        
+    except Exception as e:
+        logger.error(f"Error removing property {property_id}: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/interactions', methods=['POST'])
+def ingest_interactions():
+    """Append one or more interaction events without a full data reload"""
+    try:
+        if not recommendation_engine:
+            return jsonify({'error': 'Recommendation engine not initialized'}), 500
+        
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            events = data.get('interactions', [data])
+        else:
+            events = data
+        
+        if not isinstance(events, list) or not events:
+            return jsonify({'error': 'Expected an interaction object or a non-empty list of interactions'}), 400
+        
+        # Validate every event before touching the engine
+        cleaned = []
+        for i, event in enumerate(events):
+            if not isinstance(event, dict) or not event.get('user_id') or not event.get('property_id'):
+                return jsonify({'error': f'Interaction {i}: user_id and property_id are required'}), 400
+            try:
+                rating = float(event.get('rating'))
+            except (TypeError, ValueError):
+                return jsonify({'error': f'Interaction {i}: rating must be a number'}), 400
+            if not 1 <= rating <= 5:
+                return jsonify({'error': f'Interaction {i}: rating must be between 1 and 5'}), 400
+            cleaned_event = {
+                'user_id': str(event['user_id']),
+                'property_id': str(event['property_id']),
+                'rating': rating,
+                'interaction_type': str(event.get('interaction_type', 'view'))
+            }
+            # Optional event time (Unix seconds or ISO 8601); defaults to the time of ingestion
+            if event.get('timestamp') is not None:
+                try:
+                    timestamp = to_epoch_seconds([event['timestamp']])[0]
+                except (TypeError, ValueError):
+                    timestamp = np.nan
+                if np.isnan(timestamp):
+                    return jsonify({'error': f'Interaction {i}: timestamp must be Unix seconds or an ISO 8601 date'}), 400
+                cleaned_event['timestamp'] = float(timestamp)
+            cleaned.append(cleaned_event)
+        
+        # The updated engine is built aside and swapped in with one assignment
+        engine = submit_update('interactions', cleaned)
+        if engine is None:
+            return jsonify({'error': 'Failed to ingest interactions'}), 500
         
         return jsonify({
-            'property_id': property_id,
-            'similar_properties': results,
-            'total_count': len(results)
+            'message': 'Interactions ingested',
+            'accepted': len(cleaned),
+            'data_version': engine.data_version
         })
         
     except Exception as e:
-        logger.error(f"Error getting similar properties: {e}")
+        logger.error(f"Error ingesting interactions: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/user-preferences', methods=['GET'])
 def get_user_preferences():
     """Get user preferences based on interaction history"""
     try:
+        engine = recommendation_engine
         user_id = request.args.get('user_id')
         
         if not user_id:
             return jsonify({'error': 'user_id is required'}), 400
         
-        if not recommendation_engine:
+        if not engine:
             return jsonify({'error': 'Recommendation engine not initialized'}), 500
         
-        # Get user interactions
-        user_interactions = recommendation_engine.df_interactions[
-            recommendation_engine.df_interactions['user_id'] == user_id
-        ]
+        preferences = engine.get_user_preferences(user_id)
         
-        if user_interactions.empty:
+        if not preferences:
             return jsonify({
                 'user_id': user_id,
                 'preferences': {},
                 'message': 'No interaction history found'
             })
         
-        # Analyze preferences
-        property_ids = user_interactions['property_id'].unique()
-        user_properties = recommendation_engine.df_properties[
-            recommendation_engine.df_properties['property_id'].isin(property_ids)
-        ]
-        
-        preferences = {
-            'favorite_types': user_properties['type'].value_counts().to_dict(),
-            'favorite_locations': user_properties['location'].value_counts().to_dict(),
-            'avg_price_range': {
-                'min': int(user_properties['price'].min()),
-                'max': int(user_properties['price'].max()),
-                'avg': int(user_properties['price'].mean())
-            },
-            'bedroom_preference': user_properties['bedrooms'].mode().iloc[0] if not user_properties['bedrooms'].empty else None,
-            'bathroom_preference': user_properties['bathrooms'].mode().iloc[0] if not user_properties['bathrooms'].empty else None,
-            'avg_rating': float(user_interactions['rating'].mean()),
-            'interaction_count': len(user_interactions)
-        }
-        
         return jsonify({
             'user_id': user_id,
             'preferences': preferences
@@ -250,50 +885,27 @@ def get_user_preferences():
 def get_trending_properties():
     """Get trending properties based on interaction patterns"""
     try:
+        engine = recommendation_engine
         n = int(request.args.get('n', 10))
         
-        if not recommendation_engine:
+        if not engine:
             return jsonify({'error': 'Recommendation engine not initialized'}), 500
         
-        # Calculate trending score based on interactions
-        property_interactions = recommendation_engine.df_interactions.groupby('property_id').agg({
-            'rating': ['mean', 'count'],
-            'interaction_type': 'count'
-        }).reset_index()
-        
-        # Flatten column names
-        property_interactions.columns = ['property_id', 'avg_rating', 'rating_count', 'total_interactions']
-        
-        # Calculate trending score (weighted by both rating and interaction count)
-        property_interactions['trending_score'] = (
-            property_interactions['avg_rating'] * 0.7 + 
-            (property_interactions['total_interactions'] / property_interactions['total_interactions'].max()) * 5 * 0.3
-        )
-        
-        # Get top trending properties
-        trending = property_interactions.nlargest(n, 'trending_score')
-        
-        # Build response with property details
+        # Ranked from the engine's maintained counters (mean rating plus relative interaction count)
         results = []
-        for _, row in trending.iterrows():
-            prop_id = row['property_id']
-            prop_info = recommendation_engine.df_properties[
-                recommendation_engine.df_properties['property_id'] == prop_id
-            ]
-            
-            if not prop_info.empty:
-                prop_data = prop_info.iloc[0]
-                results.append({
-                    'property_id': prop_id,
-                    'trending_score': round(float(row['trending_score']), 3),
-                    'avg_rating': round(float(row['avg_rating']), 2),
-                    'interaction_count': int(row['total_interactions']),
-                    'type': prop_data['type'],
-                    'price': int(prop_data['price']),
-                    'location': prop_data['location'],
-                    'bedrooms': int(prop_data['bedrooms']),
-                    'bathrooms': int(prop_data['bathrooms'])
-                })
+        for prop_id, score in engine.get_trending_properties(n, mode='rating'):
+            stats = engine.trending.stats(prop_id)
+            item = property_item(
+                engine,
+                prop_id,
+                trending_score=round(float(score), 3),
+                avg_rating=round(stats['avg_rating'], 2),
+                # Time-decayed counts are fractional
+                interaction_count=round(stats['rating_count'], 3) if engine.trending.half_life
+                else int(stats['rating_count'])
+            )
+            if item:
+                results.append(item)
         
         return jsonify({
             'trending_properties': results,
@@ -308,7 +920,12 @@ def get_trending_properties():
 def reload_data():
     """Reload recommendation data (for development/testing)"""
     try:
-        if initialize_engine():
+        if update_forwarder is not None:
+            reloaded = update_forwarder('reload', None) is not None
+        else:
+            reloaded = initialize_engine()
+        
+        if reloaded:
             return jsonify({'message': 'Data reloaded successfully'})
         else:
             return jsonify({'error': 'Failed to reload data'}), 500
@@ -316,7 +933,108 @@ def reload_data():
         logger.error(f"Error reloading data: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+# Longest /admin/profile/sample run, in seconds
+MAX_SAMPLE_SECONDS = 60
+
+# One profile at a time; profiling hooks are only installed while it runs
+profile_lock = threading.Lock()
+
+def admin_authorized():
+    """Check the admin bearer token; admin routes 404 unless RECOMMENDER_ADMIN_TOKEN is set"""
+    token = os.environ.get('RECOMMENDER_ADMIN_TOKEN')
+    if not token:
+        abort(404)
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    return hmac.compare_digest(supplied.encode(), token.encode())
+
+def profile_response(result):
+    """The profile report as JSON, or as bare collapsed stacks with format=collapsed"""
+    if request.args.get('format') == 'collapsed':
+        return Response(result['collapsed'], mimetype='text/plain')
+    return jsonify(result)
+
+@app.route('/admin/profile', methods=['GET'])
+def profile_request():
+    """Run one GET request under a deterministic profiler and report its call stacks
+    
+    path is the URL-encoded request to run, e.g. /recommendations?user_id=user_1.
+    Stack weights are microseconds of self time. With micro-batching enabled,
+    scoring happens on the batcher thread; use /admin/profile/sample instead.
+    """
+    if not admin_authorized():
+        return jsonify({'error': 'Invalid admin token'}), 403
+    
+    try:
+        target = request.args.get('path', '')
+        if not target.startswith('/') or target.startswith('/admin'):
+            return jsonify({'error': 'path must be a non-admin request path, e.g. /recommendations?user_id=user_1'}), 400
+        
+        if not profile_lock.acquire(blocking=False):
+            return jsonify({'error': 'A profile is already running'}), 409
+        try:
+            client = app.test_client()
+            stack_profiler = profiler.StackProfiler()
+            start = time.perf_counter()
+            response = stack_profiler.run(client.get, target)
+            duration = time.perf_counter() - start
+        finally:
+            profile_lock.release()
+        
+        return profile_response({
+            'mode': 'request',
+            'path': target,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            **profiler.report(stack_profiler.weights(), unit='us')
+        })
+        
+    except Exception as e:
+        logger.error(f"Error profiling request: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@app.route('/admin/profile/sample', methods=['GET'])
+def profile_sample():
+    """Sample the stacks of every request running in this process for a number of seconds
+    
+    Stack weights are sample counts, taken every interval_ms (default 5). In
+    multi-process serving only the worker that answers this request is sampled.
+    """
+    if not admin_authorized():
+        return jsonify({'error': 'Invalid admin token'}), 403
+    
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval_ms = float(request.args.get('interval_ms', 5))
+        if not 0 < seconds <= MAX_SAMPLE_SECONDS or interval_ms <= 0:
+            return jsonify({'error': f'seconds must be in (0, {MAX_SAMPLE_SECONDS}] and interval_ms positive'}), 400
+        
+        if not profile_lock.acquire(blocking=False):
+            return jsonify({'error': 'A profile is already running'}), 409
+        try:
+            stacks, rounds = profiler.sample_stacks(seconds, interval_ms / 1000.0)
+        finally:
+            profile_lock.release()
+        
+        return profile_response({
+            'mode': 'sample',
+            'duration_ms': round(seconds * 1000, 3),
+            'interval_ms': interval_ms,
+            'rounds': rounds,
+            **profiler.report(stacks, unit='samples')
+        })
+        
+    except ValueError:
+        return jsonify({'error': 'seconds and interval_ms must be numbers'}), 400
+    except Exception as e:
+        logger.error(f"Error sampling requests: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 if __name__ == '__main__':
+    # Multi-process serving mode (see recommendation_server.py)
+    if int(os.environ.get('RECOMMENDER_WORKERS', 1)) > 1:
+        import recommendation_server
+        sys.exit(recommendation_server.main())
+    
     # Initialize the recommendation engine
     if not initialize_engine():
         logger.error("Failed to initialize recommendation engine. Exiting.")
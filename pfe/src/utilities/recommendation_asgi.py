@@ -0,0 +1,250 @@
+import io
+import os
+import sys
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+import recommendation_api
+import metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def wsgi_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope and its fully read body"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+class RecommendationASGI:
+    """asyncio front end for the recommendation_api endpoints
+
+    The event loop never scores. /health and cached /recommendations hits
+    are answered directly on the loop. Everything else runs the Flask
+    routes in a thread pool. Identical concurrent GETs (same path, query
+    and data version) are single-flighted: the first runs, the rest await
+    its response.
+    """
+
+    # Read-only endpoints whose concurrent identical requests share one computation
+    COALESCED_PATHS = ('/recommendations', '/similar-properties', '/user-preferences', '/trending-properties')
+
+    def __init__(self, app=None, max_workers=None):
+        self.app = app or recommendation_api.app
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or min(32, (os.cpu_count() or 1) + 4),
+            thread_name_prefix='recommender'
+        )
+        self.in_flight = {}
+        self.coalesced = 0
+
+    def start_wsgi(self, scope, body):
+        """Call the WSGI app; returns (status, headers, iterable)"""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [
+                (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers
+            ]
+
+        iterable = self.app(wsgi_environ(scope, body), start_response)
+        return response['status'], response['headers'], iterable
+
+    def call_wsgi(self, scope, body):
+        """Call the WSGI app and collect the whole response body"""
+        status, headers, iterable = self.start_wsgi(scope, body)
+        try:
+            return status, headers, b''.join(iterable)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    async def single_flight(self, key, scope, body):
+        """Run identical concurrent requests once and hand every caller the same response"""
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, self.call_wsgi, scope, body)
+            self.in_flight[key] = future
+            future.add_done_callback(lambda done: self.in_flight.pop(key, None))
+        # Shielded so one caller disconnecting doesn't cancel the others' result
+        return await asyncio.shield(future)
+
+    async def stream_wsgi(self, scope, body, send):
+        """Run a request in the pool, forwarding body chunks as the app produces them
+        
+        The whole response is produced in one pool thread (Flask's streamed
+        generators are bound to the thread's request context) and handed to
+        the loop through a bounded queue.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue(maxsize=16)
+        abandoned = threading.Event()
+        
+        def produce():
+            def put(item):
+                asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+            try:
+                status, headers, iterable = self.start_wsgi(scope, body)
+                put((status, headers))
+                try:
+                    for chunk in iterable:
+                        if abandoned.is_set():
+                            break
+                        if chunk:
+                            put(chunk)
+                finally:
+                    if hasattr(iterable, 'close'):
+                        iterable.close()
+            finally:
+                put(None)
+        
+        producer = loop.run_in_executor(self.executor, produce)
+        started = await chunks.get()
+        if started is None:
+            await producer
+            raise Exception("WSGI app produced no response")
+        
+        try:
+            await send({'type': 'http.response.start', 'status': started[0], 'headers': started[1]})
+            while (chunk := await chunks.get()) is not None:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        except Exception:
+            # Client went away: stop the producer and let it drain
+            abandoned.set()
+            while await chunks.get() is not None:
+                pass
+            raise
+        finally:
+            await producer
+
+    async def send_response(self, send, status, headers, body):
+        """Send a complete response"""
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def send_json(self, send, payload):
+        """Send a JSON body encoded exactly as jsonify encodes it in the Flask routes"""
+        response = self.app.json.response(payload)
+        await self.send_response(send, response.status_code, [
+            (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()
+        ], response.get_data())
+
+    async def lifespan(self, receive, send):
+        """Initialize the engine in the pool on startup; stop the pool on shutdown"""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                ready = recommendation_api.recommendation_engine is not None
+                if not ready:
+                    ready = await asyncio.get_running_loop().run_in_executor(
+                        self.executor, recommendation_api.initialize_engine
+                    )
+                if ready:
+                    await send({'type': 'lifespan.startup.complete'})
+                else:
+                    await send({'type': 'lifespan.startup.failed',
+                                'message': 'Failed to initialize recommendation engine'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+
+        method, path = scope['method'], scope['path']
+        query = scope.get('query_string', b'')
+
+        if method == 'GET' and path == '/health':
+            await self.send_json(send, {
+                **recommendation_api.health_status(),
+                'async': {'in_flight': len(self.in_flight), 'coalesced': self.coalesced}
+            })
+            return
+
+        if method == 'GET' and path == '/recommendations':
+            args = parse_qs(query.decode('latin-1'))
+            cached = None
+            # Profiled requests go through Flask, where the stage breakdown is collected;
+            # filtered results are cached under their own keys
+            if args.get('profile') != ['1'] and not any(param in args for param in recommendation_api.FILTER_PARAMS):
+                try:
+                    cached = recommendation_api.cached_recommendations(
+                        args.get('user_id', [None])[0], args.get('type', ['hybrid'])[0], int(args.get('n', [5])[0])
+                    )
+                except ValueError:
+                    pass
+            if cached is not None:
+                await self.send_json(send, cached)
+                metrics.increment('recommender_requests_total', endpoint='get_recommendations', status='200')
+                return
+
+        if method == 'GET' and path in self.COALESCED_PATHS:
+            engine = recommendation_api.recommendation_engine
+            key = (path, query, engine.data_version if engine else None)
+            await self.send_response(send, *await self.single_flight(key, scope, body))
+            return
+
+        await self.stream_wsgi(scope, body, send)
+
+app = RecommendationASGI(max_workers=int(os.environ.get('RECOMMENDER_ASYNC_WORKERS', 0)) or None)
+
+def main():
+    """Serve the ASGI app with uvicorn"""
+    try:
+        import uvicorn
+    except ImportError:
+        logger.error("uvicorn is required to run the async service (pip install uvicorn)")
+        return 1
+
+    port = int(os.environ.get('PORT', 5000))
+    logger.info(f"Starting async recommendation API on port {port}")
+    uvicorn.run(app, host=os.environ.get('HOST', '0.0.0.0'), port=port)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
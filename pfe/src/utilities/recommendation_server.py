@@ -0,0 +1,309 @@
+import gc
+import os
+import sys
+import time
+import queue
+import shutil
+import signal
+import socket
+import tempfile
+import itertools
+import multiprocessing
+import logging
+from werkzeug.serving import make_server
+import recommendation_api
+from enhanced_recommender import PropertyRecommendationEngine
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+GENERATION_PREFIX = 'generation-'
+
+# Writes that workers hand to the master without waiting for them to be published
+BACKGROUND_UPDATES = ('item_neighbors',)
+
+def generation_path(state_root, generation):
+    """Directory holding the engine state of one published generation"""
+    return os.path.join(state_root, f"{GENERATION_PREFIX}{generation:06d}")
+
+class ServingWorker:
+    """WSGI wrapper run in each worker process
+
+    Before every request it compares its loaded generation with the shared
+    counter and, when the master has published a newer one, memory-maps that
+    state and swaps it in. The state carries every prepared index and the
+    trending and recency state, so switching rebuilds nothing. The worker
+    then records the generation in its slot of the shared loaded array,
+    which tells the master the older generations are no longer needed.
+    Writes are forwarded to the master and answered once the generation
+    containing them has been published.
+    """
+
+    def __init__(self, slot, state_root, generation, loaded, updates, replies, reply_timeout):
+        self.slot = slot
+        self.state_root = state_root
+        self.generation = generation
+        self.loaded_generations = loaded
+        self.updates = updates
+        self.replies = replies
+        self.reply_timeout = reply_timeout
+        self.loaded = 0
+        self.tickets = itertools.count(1)
+
+    def sync(self):
+        """Switch to the newest published generation if this worker is behind"""
+        generation = self.generation.value
+        if generation == self.loaded:
+            return
+        if generation == 0:
+            raise Exception("No generation published yet")
+        engine = PropertyRecommendationEngine(sparse=True)
+        if not engine.load_state(generation_path(self.state_root, generation)):
+            raise Exception(f"Failed to load generation {generation}")
+        recommendation_api.prepare_engine(engine)
+        recommendation_api.install_engine(engine, recommendation_api.load_snapshot(engine))
+        self.loaded = generation
+        self.loaded_generations[self.slot] = generation
+        logger.info(f"Worker {self.slot} (pid {os.getpid()}) serving generation {generation}, "
+                    f"data version {engine.data_version}")
+
+    def forward(self, kind, payload):
+        """Hand a write to the master and wait until it is published; returns the new engine or None
+        
+        Background writes (BACKGROUND_UPDATES) are queued without waiting and return None.
+        """
+        if kind in BACKGROUND_UPDATES:
+            self.updates.put((None, None, kind, payload))
+            return None
+        ticket = next(self.tickets)
+        self.updates.put((self.slot, ticket, kind, payload))
+        while True:
+            # Replies to earlier requests that timed out are skipped
+            reply_ticket, applied = self.replies.get(timeout=self.reply_timeout)
+            if reply_ticket == ticket:
+                break
+        if not applied:
+            return None
+        self.sync()
+        return recommendation_api.recommendation_engine
+
+    def __call__(self, environ, start_response):
+        self.sync()
+        return recommendation_api.app(environ, start_response)
+
+def run_worker(slot, listener, state_root, generation, loaded, updates, replies, reply_timeout):
+    """Worker process: serve requests from the shared listening socket"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    worker = ServingWorker(slot, state_root, generation, loaded, updates, replies, reply_timeout)
+    recommendation_api.update_forwarder = worker.forward
+
+    # Workers are forked before the master builds the first generation
+    while generation.value == 0:
+        time.sleep(0.1)
+    worker.sync()
+
+    host, port = listener.getsockname()[:2]
+    server = make_server(host, port, worker, fd=listener.fileno())
+    server.serve_forever()
+
+class ServingMaster:
+    """Pre-fork master: owns the writable engine and publishes state generations
+
+    The master prepares the engine once and writes it as a binary state
+    directory (engine_store format, including the similarity index, item
+    neighbors and MF factors). Workers memory-map that directory read-only,
+    so its pages live once in the page cache however many workers run.
+
+    Writes and reloads go through the master. It applies them to its own
+    engine, writes the result as the next generation, then bumps the shared
+    counter. Every request that starts after the bump, in any worker, is
+    served from the new generation. Writing a generation costs a pass over
+    the whole state, so a publish waits at least publish_interval seconds
+    and at least as long as the previous publish took: writes arriving in
+    between are applied together and published once, and the master never
+    spends more than half its time writing generations. A generation is
+    deleted only after every worker has loaded a newer one.
+    """
+
+    def __init__(self, workers, host='0.0.0.0', port=5000, state_root=None, reply_timeout=60.0,
+                 publish_interval=0.05):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.owns_state_root = state_root is None
+        self.state_root = state_root or tempfile.mkdtemp(prefix='recommender-state-')
+        self.reply_timeout = reply_timeout
+        self.publish_interval = publish_interval
+        self.published_at = 0.0
+        self.publish_seconds = 0.0
+        self.context = multiprocessing.get_context('fork')
+        self.generation = self.context.Value('q', 0)
+        # Generation each worker has loaded, 0 while it has none
+        self.loaded = self.context.Array('q', workers)
+        self.updates = self.context.Queue()
+        self.replies = [self.context.Queue() for _ in range(workers)]
+        self.processes = {}
+        self.listener = None
+        self.engine = None
+        self.running = False
+
+    def publish(self, engine):
+        """Write the engine as the next generation and point every worker at it"""
+        generation = self.generation.value + 1
+        started = time.monotonic()
+        if not engine.save_state(generation_path(self.state_root, generation)):
+            raise Exception(f"Failed to write generation {generation}")
+        self.generation.value = generation
+        self.published_at = time.monotonic()
+        self.publish_seconds = self.published_at - started
+        self.engine = engine
+        self.remove_old_generations()
+        logger.info(f"Published generation {generation}, data version {engine.data_version}")
+
+    def remove_old_generations(self):
+        """Delete the generations older than every worker's loaded one
+        
+        A worker switching generations loads the newest published one, which
+        is never older than what it has loaded, so nothing it may still be
+        reading is removed. Unlinked files stay valid for processes that
+        still map them.
+        """
+        oldest = min(min(self.loaded[:]), self.generation.value)
+        for name in os.listdir(self.state_root):
+            if name.startswith(GENERATION_PREFIX) and name[len(GENERATION_PREFIX):].isdigit():
+                if int(name[len(GENERATION_PREFIX):]) < oldest:
+                    shutil.rmtree(os.path.join(self.state_root, name), ignore_errors=True)
+
+    def start_worker(self, slot):
+        """Fork one worker process onto the shared socket"""
+        # Keep the collector in the child from touching (and so copying) inherited objects
+        gc.freeze()
+        self.loaded[slot] = 0
+        process = self.context.Process(
+            target=run_worker,
+            args=(slot, self.listener, self.state_root, self.generation, self.loaded, self.updates,
+                  self.replies[slot], self.reply_timeout),
+            daemon=True
+        )
+        process.start()
+        self.processes[slot] = process
+
+    def apply_updates(self, batch):
+        """Apply queued writes in order, publish once, then answer the waiting workers"""
+        engine = self.engine
+        changed = False
+        results = []
+        for slot, ticket, kind, payload in batch:
+            try:
+                if kind == 'reload':
+                    updated = recommendation_api.build_engine()
+                else:
+                    updated = recommendation_api.apply_engine_update(engine, kind, payload)
+            except Exception as e:
+                logger.error(f"Error applying {kind} update: {e}")
+                updated = None
+            if updated is not None and updated is not engine:
+                engine = updated
+                changed = True
+            results.append((slot, ticket, updated is not None))
+
+        if changed:
+            try:
+                self.publish(engine)
+            except Exception as e:
+                logger.error(f"Error publishing generation: {e}")
+                results = [(slot, ticket, False) for slot, ticket, _ in results]
+
+        for slot, ticket, applied in results:
+            if slot is not None:
+                self.replies[slot].put((ticket, applied))
+
+    def request_reload(self, signum, frame):
+        """SIGHUP: rebuild from the data files and publish a new generation"""
+        self.updates.put((None, None, 'reload', None))
+
+    def stop(self, signum, frame):
+        """SIGTERM/SIGINT: stop serving"""
+        self.running = False
+
+    def serve(self):
+        """Fork the workers, prepare the engine and coordinate updates until stopped"""
+        # Fork while the master is still small; workers wait for the first generation
+        self.listener = socket.create_server((self.host, self.port), backlog=1024)
+        for slot in range(self.workers):
+            self.start_worker(slot)
+        self.publish(recommendation_api.build_engine())
+        logger.info(f"Serving on {self.host}:{self.port} with {self.workers} workers "
+                    f"(state in {self.state_root})")
+
+        signal.signal(signal.SIGHUP, self.request_reload)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    batch = [self.updates.get(timeout=1.0)]
+                except queue.Empty:
+                    self.respawn_workers()
+                    self.remove_old_generations()
+                    continue
+                except InterruptedError:
+                    continue
+                # Collect every write that arrives until the next publish is due
+                due = self.published_at + max(self.publish_interval, self.publish_seconds)
+                while True:
+                    try:
+                        batch.append(self.updates.get(timeout=max(0.0, due - time.monotonic())))
+                    except queue.Empty:
+                        if time.monotonic() >= due:
+                            break
+                    except InterruptedError:
+                        continue
+                self.apply_updates(batch)
+        finally:
+            self.shutdown()
+
+    def respawn_workers(self):
+        """Replace workers that exited"""
+        for slot, process in list(self.processes.items()):
+            if not process.is_alive():
+                logger.warning(f"Worker {slot} (pid {process.pid}) exited with {process.exitcode}, restarting")
+                self.start_worker(slot)
+
+    def shutdown(self):
+        """Stop the workers and remove state this master created"""
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join(timeout=5)
+        if self.listener is not None:
+            self.listener.close()
+        if self.owns_state_root:
+            shutil.rmtree(self.state_root, ignore_errors=True)
+        logger.info("Recommendation server stopped")
+
+def main():
+    """Run the multi-process recommendation server configured from the environment"""
+    workers = int(os.environ.get('RECOMMENDER_WORKERS', os.cpu_count() or 1))
+    master = ServingMaster(
+        workers,
+        host=os.environ.get('HOST', '0.0.0.0'),
+        port=int(os.environ.get('PORT', 5000)),
+        state_root=os.environ.get('RECOMMENDER_STATE_ROOT'),
+        reply_timeout=float(os.environ.get('RECOMMENDER_UPDATE_TIMEOUT', 60)),
+        publish_interval=float(os.environ.get('RECOMMENDER_PUBLISH_INTERVAL', 0.05))
+    )
+    try:
+        master.serve()
+    except Exception as e:
+        logger.error(f"Error running recommendation server: {e}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import os
+import numpy as np
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+
+def write_snapshot(path, data_version, n, recommendations):
+    """Write precomputed top-N lists to a compact .npz snapshot
+
+    recommendations maps rec_type -> {user_id: [(property_id, score), ...]}.
+    Lists are stored as fixed-width (users x n) index/score arrays into one
+    shared property id table, padded with -1.
+    """
+    user_ids = sorted({user_id for recs in recommendations.values() for user_id in recs})
+    property_ids = sorted({
+        prop_id
+        for recs in recommendations.values()
+        for items in recs.values()
+        for prop_id, _ in items
+    })
+    user_rows = {user_id: idx for idx, user_id in enumerate(user_ids)}
+    property_codes = {prop_id: idx for idx, prop_id in enumerate(property_ids)}
+
+    arrays = {
+        'format': np.array(SNAPSHOT_FORMAT),
+        'data_version': np.array(data_version),
+        'n': np.array(n),
+        'rec_types': np.array(sorted(recommendations)),
+        'user_ids': np.array(user_ids),
+        'property_ids': np.array(property_ids)
+    }
+    for rec_type, recs in recommendations.items():
+        items = np.full((len(user_ids), n), -1, dtype=np.int32)
+        scores = np.zeros((len(user_ids), n), dtype=np.float32)
+        has_row = np.zeros(len(user_ids), dtype=bool)
+        for user_id, recs_list in recs.items():
+            row = user_rows[user_id]
+            has_row[row] = True
+            for col, (prop_id, score) in enumerate(recs_list[:n]):
+                items[row, col] = property_codes[prop_id]
+                scores[row, col] = score
+        arrays[f'{rec_type}_items'] = items
+        arrays[f'{rec_type}_scores'] = scores
+        arrays[f'{rec_type}_users'] = has_row
+
+    # Write next to the target and rename, so readers never see a partial file
+    tmp_path = f"{path}.tmp.npz"
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote snapshot {path}: {len(user_ids)} users, types={sorted(recommendations)}, n={n}")
+
+class RecommendationSnapshot:
+    """Read-only precomputed recommendations with O(1) per-user lookups"""
+
+    def __init__(self, path):
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['format']) != SNAPSHOT_FORMAT:
+                raise ValueError(f"Unsupported snapshot format {int(data['format'])}")
+            self.data_version = str(data['data_version'])
+            self.n = int(data['n'])
+            self.rec_types = [str(rec_type) for rec_type in data['rec_types']]
+            self.property_ids = data['property_ids'].astype(object)
+            self.user_rows = {str(user_id): idx for idx, user_id in enumerate(data['user_ids'])}
+            self.items = {rec_type: data[f'{rec_type}_items'] for rec_type in self.rec_types}
+            self.scores = {rec_type: data[f'{rec_type}_scores'] for rec_type in self.rec_types}
+            self.has_row = {rec_type: data[f'{rec_type}_users'] for rec_type in self.rec_types}
+        self.path = path
+
+    def __len__(self):
+        return len(self.user_rows)
+
+    def lookup(self, user_id, rec_type, n):
+        """Return the stored (property_id, score) list, or None to fall back to live scoring
+
+        Collaborative and content rankings are served as prefixes for any
+        n <= the snapshot's n. Hybrid rankings depend on n (they blend 2n
+        candidates per method), so they are only served for exactly n.
+        """
+        row = self.user_rows.get(user_id)
+        if row is None or rec_type not in self.items or not self.has_row[rec_type][row]:
+            return None
+        if n > self.n or (rec_type == 'hybrid' and n != self.n):
+            return None
+
+        items = self.items[rec_type][row, :n]
+        scores = self.scores[rec_type][row, :n]
+        return [
+            (self.property_ids[idx], float(score))
+            for idx, score in zip(items, scores)
+            if idx >= 0
+        ]
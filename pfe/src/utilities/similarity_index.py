@@ -0,0 +1,193 @@
+import numpy as np
+import logging
+from ranking import top_k_block
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class PropertySimilarityIndex:
+    """Top-K cosine neighbor lists for every property, maintained incrementally"""
+
+    def __init__(self, k=50, block_size=1024):
+        self.k = k
+        self.block_size = block_size
+        self.ids = []
+        self.row_index = {}
+        self.size = 0
+        self.vectors = np.zeros((0, 0))
+        self.active = np.zeros(0, dtype=bool)
+        self.neighbors = np.zeros((0, k), dtype=np.int64)
+        self.scores = np.zeros((0, k))
+
+    @staticmethod
+    def _normalize(vectors):
+        """L2-normalize rows so dot products are cosine similarities"""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float64))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _ensure_capacity(self, rows, dim):
+        """Grow the row arrays geometrically so appends stay amortized O(1)"""
+        capacity = len(self.active)
+        if rows <= capacity and self.vectors.shape[1] == dim:
+            return
+        new_capacity = max(rows, 2 * capacity, 16)
+
+        vectors = np.zeros((new_capacity, dim))
+        vectors[:self.size] = self.vectors[:self.size]
+        active = np.zeros(new_capacity, dtype=bool)
+        active[:self.size] = self.active[:self.size]
+        neighbors = np.full((new_capacity, self.k), -1, dtype=np.int64)
+        neighbors[:self.size] = self.neighbors[:self.size]
+        scores = np.full((new_capacity, self.k), -np.inf)
+        scores[:self.size] = self.scores[:self.size]
+
+        self.vectors, self.active, self.neighbors, self.scores = vectors, active, neighbors, scores
+
+    def _top_k(self, rows, similarities):
+        """Write the sorted top-K of each similarity row into the neighbor lists"""
+        # Never list self or removed properties as neighbors
+        similarities[np.arange(len(rows)), rows] = np.nan
+        similarities[:, ~self.active[:self.size]] = np.nan
+
+        top, top_scores = top_k_block(similarities, self.k)
+        k = top.shape[1]
+
+        self.neighbors[rows] = -1
+        self.scores[rows] = -np.inf
+        self.neighbors[rows, :k] = top
+        self.scores[rows, :k] = top_scores
+
+    def _recompute(self, rows):
+        """Rebuild the neighbor lists of the given rows against all properties"""
+        rows = np.asarray(rows, dtype=np.int64)
+        for start in range(0, len(rows), self.block_size):
+            block = rows[start:start + self.block_size]
+            similarities = self.vectors[block] @ self.vectors[:self.size].T
+            self._top_k(block, similarities)
+
+    def build(self, property_ids, features):
+        """Build neighbor lists for all properties from their feature vectors"""
+        vectors = self._normalize(features)
+        self.ids = list(property_ids)
+        self.row_index = {prop_id: idx for idx, prop_id in enumerate(self.ids)}
+        self.size = 0
+        self.vectors = np.zeros((0, vectors.shape[1]))
+        self.active = np.zeros(0, dtype=bool)
+        self._ensure_capacity(len(self.ids), vectors.shape[1])
+        self.size = len(self.ids)
+        self.vectors[:self.size] = vectors
+        self.active[:self.size] = True
+
+        self._recompute(np.arange(self.size))
+        logger.info(f"Built similarity index: {self.size} properties, k={self.k}")
+
+    def arrays(self):
+        """The index as plain arrays (see engine_store.save_state)"""
+        return {
+            'ids': np.asarray([str(prop_id) for prop_id in self.ids], dtype=str),
+            'vectors': self.vectors[:self.size],
+            'active': self.active[:self.size],
+            'neighbors': self.neighbors[:self.size],
+            'scores': self.scores[:self.size]
+        }
+
+    @classmethod
+    def from_arrays(cls, k, arrays):
+        """Rebuild an index from arrays() output without recomputing any neighbors"""
+        index = cls(k=k)
+        index.ids = list(arrays['ids'].astype(object))
+        index.size = len(index.ids)
+        index.vectors = arrays['vectors']
+        index.active = arrays['active']
+        index.neighbors = arrays['neighbors']
+        index.scores = arrays['scores']
+        index.row_index = {prop_id: idx for idx, prop_id in enumerate(index.ids) if index.active[idx]}
+        return index
+
+    def copy(self):
+        """Independent copy, so edits can be made without touching an index in use"""
+        index = PropertySimilarityIndex(k=self.k, block_size=self.block_size)
+        index.ids = list(self.ids)
+        index.row_index = dict(self.row_index)
+        index.size = self.size
+        index.vectors, index.active = np.array(self.vectors), np.array(self.active)
+        index.neighbors, index.scores = np.array(self.neighbors), np.array(self.scores)
+        return index
+
+    def _ensure_writable(self):
+        """Copy arrays that are read-only memory maps before modifying them in place"""
+        if not self.vectors.flags.writeable:
+            self.vectors, self.active = np.array(self.vectors), np.array(self.active)
+            self.neighbors, self.scores = np.array(self.neighbors), np.array(self.scores)
+
+    def __contains__(self, property_id):
+        return property_id in self.row_index
+
+    def get_neighbors(self, property_id, n=5):
+        """Return up to n (property_id, score) pairs, or None for unknown properties"""
+        row = self.row_index.get(property_id)
+        if row is None:
+            return None
+        return [
+            (self.ids[idx], float(score))
+            for idx, score in zip(self.neighbors[row, :n], self.scores[row, :n])
+            if idx >= 0
+        ]
+
+    def upsert(self, property_id, features):
+        """Add or update one property, touching only the rows it affects"""
+        vector = self._normalize(features)[0]
+        row = self.row_index.get(property_id)
+        self._ensure_writable()
+
+        if row is None:
+            row = self.size
+            self._ensure_capacity(row + 1, len(vector))
+            self.ids.append(property_id)
+            self.row_index[property_id] = row
+            self.size += 1
+            stale = np.zeros(self.size, dtype=bool)
+        else:
+            # Rows that listed the old vector may now rank it lower
+            stale = np.any(self.neighbors[:self.size] == row, axis=1)
+
+        self.vectors[row] = vector
+        self.active[row] = True
+        similarities = self.vectors[:self.size] @ vector
+
+        # Own neighbor list
+        self._top_k(np.array([row]), similarities[np.newaxis, :].copy())
+
+        # Rows where the property now beats the current K-th neighbor
+        entering = (similarities > self.scores[:self.size, -1]) & self.active[:self.size] & ~stale
+        entering[row] = False
+        entering_rows = np.flatnonzero(entering)
+        if len(entering_rows):
+            self.neighbors[entering_rows, -1] = row
+            self.scores[entering_rows, -1] = similarities[entering_rows]
+            order = np.argsort(-self.scores[entering_rows], axis=1, kind='stable')
+            self.neighbors[entering_rows] = np.take_along_axis(self.neighbors[entering_rows], order, axis=1)
+            self.scores[entering_rows] = np.take_along_axis(self.scores[entering_rows], order, axis=1)
+
+        stale[row] = False
+        if stale.any():
+            self._recompute(np.flatnonzero(stale))
+
+    def remove(self, property_id):
+        """Remove one property and repair only the lists that contained it"""
+        row = self.row_index.pop(property_id, None)
+        if row is None:
+            return False
+
+        self._ensure_writable()
+        self.active[row] = False
+        self.neighbors[row] = -1
+        self.scores[row] = -np.inf
+
+        stale = np.flatnonzero(np.any(self.neighbors[:self.size] == row, axis=1))
+        if len(stale):
+            self._recompute(stale)
+        return True
@@ -2,6 +2,7 @@ import pandas as pd
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 import sys
+from ranking import top_k_mask, top_k_items
 
 # Load synthetic data
 df_users = pd.read_csv('synthetic_users.csv')
@@ -12,7 +13,7 @@ df_interactions = pd.read_csv('synthetic_interactions.csv')
 rating_matrix = df_interactions.pivot_table(index='user_id', columns='property_id', values='rating')
 
 # --- Collaborative Filtering ---
-def collaborative_recommendations(user_id, rating_matrix, n=5):
+def collaborative_recommendations(user_id, rating_matrix, n=5, k_neighbors=None):
     if user_id not in rating_matrix.index:
         print(f"User {user_id} not found.")
         return []
@@ -20,22 +21,21 @@ def collaborative_recommendations(user_id, rating_matrix, n=5):
     user_idx = rating_matrix.index.get_loc(user_id)
     user_vector = filled_matrix.iloc[user_idx].values.reshape(1, -1)
     similarities = cosine_similarity(user_vector, filled_matrix)[0]
-    similar_users_idx = np.argsort(similarities)[::-1][1:]
-    similar_users = filled_matrix.index[similar_users_idx]
-    unrated_properties = rating_matrix.loc[user_id][rating_matrix.loc[user_id].isna()].index
-    scores = {}
-    for prop in unrated_properties:
-        weighted_sum = 0
-        sim_sum = 0
-        for sim_user, sim_score in zip(similar_users, similarities[similar_users_idx]):
-            rating = rating_matrix.loc[sim_user, prop]
-            if not np.isnan(rating):
-                weighted_sum += sim_score * rating
-                sim_sum += sim_score
-        if sim_sum > 0:
-            scores[prop] = weighted_sum / sim_sum
-    top_n = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:n]
-    return dict(top_n)
+    similarities[user_idx] = 0.0
+    # Optional top-k neighbor cutoff
+    if k_neighbors and k_neighbors < len(similarities):
+        similarities[~top_k_mask(similarities[np.newaxis, :], k_neighbors)[0]] = 0.0
+    # Predicted rating = sum(sim * rating) / sum(sim) over neighbors who rated the property
+    rated_mask = rating_matrix.notna().values
+    weighted_sum = similarities @ filled_matrix.values
+    sim_sum = similarities @ rated_mask
+    unrated = ~rated_mask[user_idx]
+    scores = {
+        prop: weighted_sum[j] / sim_sum[j]
+        for j, prop in enumerate(rating_matrix.columns)
+        if unrated[j] and sim_sum[j] > 0
+    }
+    return dict(top_k_items(scores, n))
 
 # --- Content-Based Filtering ---
 def content_based_recommendations(user_id, n=5):
@@ -65,15 +65,14 @@ def content_based_recommendations(user_id, n=5):
         if row['location'] == favorite_location:
             score += 0.5
         scores[row['property_id']] = score
-    top_n = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:n]
-    return dict(top_n)
+    return dict(top_k_items(scores, n))
 
 # --- Hybrid Recommender ---
 def hybrid_recommendations(user_id, n=5):
     collab = collaborative_recommendations(user_id, rating_matrix, n*2)
     content = content_based_recommendations(user_id, n*2)
     # Combine scores (normalize to 0-1)
-    all_props = set(collab.keys()) | set(content.keys())
+    all_props = list(dict.fromkeys([*collab, *content]))
     if not all_props:
         return []
     max_collab = max(collab.values()) if collab else 1
@@ -83,8 +82,7 @@ def hybrid_recommendations(user_id, n=5):
         c_score = collab.get(prop, 0) / max_collab
         cb_score = content.get(prop, 0) / max_content
         hybrid_scores[prop] = (c_score + cb_score) / 2
-    top_n = sorted(hybrid_scores.items(), key=lambda x: x[1], reverse=True)[:n]
-    return top_n
+    return top_k_items(hybrid_scores, n)
 
 # --- Utility to print recommendations ---
 def print_recommendations(user_id, recs, title):
@@ -0,0 +1,67 @@
+import numpy as np
+from scipy import sparse
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _index_dtype(size):
+    return np.int32 if size <= np.iinfo(np.int32).max else np.int64
+
+def take_rows(matrix, rows, n_columns):
+    """CSR block of the given sorted rows, empty for rows past the end of matrix
+
+    n_columns may exceed the matrix width, for blocks of a grown matrix.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    existing = rows[rows < matrix.shape[0]]
+    lengths = np.zeros(len(rows), dtype=np.int64)
+    lengths[:len(existing)] = matrix.indptr[existing + 1] - matrix.indptr[existing]
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    positions = np.repeat(matrix.indptr[existing] - indptr[:len(existing)], lengths[:len(existing)])
+    positions += np.arange(indptr[-1])
+    dtype = _index_dtype(max(indptr[-1], n_columns))
+    return sparse.csr_matrix(
+        (matrix.data[positions], matrix.indices[positions].astype(dtype), indptr.astype(dtype)),
+        shape=(len(rows), n_columns)
+    )
+
+def replace_rows(matrix, rows, block, shape):
+    """CSR matrix grown to shape with the given sorted rows replaced by the rows of block
+
+    Rows past the end of matrix are new. Untouched rows are copied as whole
+    runs, so the cost is one copy of the stored arrays plus the size of
+    block, with no arithmetic on the entries.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    n_old = matrix.shape[0]
+    lengths = np.zeros(shape[0], dtype=np.int64)
+    lengths[:n_old] = np.diff(matrix.indptr)
+    lengths[rows] = np.diff(block.indptr)
+    indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+
+    # Runs of kept rows interleaved with the replacement rows
+    data, indices = [], []
+    previous = 0
+    for i, row in enumerate(rows):
+        end = min(row, n_old)
+        data.append(matrix.data[matrix.indptr[previous]:matrix.indptr[end]])
+        indices.append(matrix.indices[matrix.indptr[previous]:matrix.indptr[end]])
+        data.append(block.data[block.indptr[i]:block.indptr[i + 1]])
+        indices.append(block.indices[block.indptr[i]:block.indptr[i + 1]])
+        previous = max(previous, min(row + 1, n_old))
+    data.append(matrix.data[matrix.indptr[previous]:])
+    indices.append(matrix.indices[matrix.indptr[previous]:])
+
+    dtype = _index_dtype(max(indptr[-1], shape[1]))
+    return sparse.csr_matrix(
+        (np.concatenate(data), np.concatenate(indices).astype(dtype, copy=False), indptr.astype(dtype)),
+        shape=shape
+    )
+
+def replace_columns(matrix, columns, block, shape):
+    """CSC counterpart of replace_rows: block is a CSR of the new columns, one row per column"""
+    return replace_rows(matrix.T, columns, block, (shape[1], shape[0])).T.tocsc(copy=False)
@@ -0,0 +1,29 @@
+import os
+import pytest
+import recommendation_api
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+@pytest.fixture
+def client(monkeypatch):
+    """API test client over an engine built from the bundled synthetic CSVs"""
+    monkeypatch.chdir(DATA_DIR)
+    monkeypatch.setattr(recommendation_api, 'update_forwarder', None)
+    assert recommendation_api.initialize_engine()
+    return recommendation_api.app.test_client()
+
+def test_fractional_rating_is_stored_unrounded(client):
+    before = recommendation_api.recommendation_engine
+    column = before.item_index['property_1']
+    rating_sum = before.trending.counters['rating_sum'][column]
+
+    response = client.post('/interactions', json={
+        'user_id': 'fractional_user', 'property_id': 'property_1', 'rating': 3.5, 'interaction_type': 'view'
+    })
+    assert response.status_code == 200
+
+    engine = recommendation_api.recommendation_engine
+    row = engine.user_index['fractional_user']
+    assert engine.interaction_matrix[row, column] == 3.5
+    assert engine.trending.counters['rating_sum'][column] == rating_sum + 3.5
+    assert engine.all_interactions()['rating'].iloc[-1] == 3.5
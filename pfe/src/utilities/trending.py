@@ -0,0 +1,201 @@
+import time
+import numpy as np
+import pandas as pd
+import logging
+from ranking import top_k
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Per-property counters; every interaction carries a rating, so rating_count
+# is also the property's interaction count
+COUNTERS = ('views', 'favorites', 'contacts', 'rating_sum', 'rating_count')
+
+# Interaction type counted by each event counter
+TYPE_COUNTERS = {'view': 'views', 'favorite': 'favorites', 'contact': 'contacts'}
+
+# Smallest top list kept per mode; deeper requests extend it
+MIN_TOP_DEPTH = 100
+
+# Decayed counters are rebased once new event weights pass 2**REBASE_HALF_LIVES
+REBASE_HALF_LIVES = 256
+
+def to_epoch_seconds(values):
+    """Float Unix timestamps from epoch numbers or date strings/datetimes (naive values are UTC)"""
+    values = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=np.float64)
+    parsed = pd.to_datetime(values, utc=True, format='mixed')
+    return (parsed - pd.Timestamp(0, tz='UTC')).dt.total_seconds().to_numpy(dtype=np.float64)
+
+def _average_rating(counters):
+    """Mean rating per property, 0 for properties without ratings"""
+    average = np.zeros_like(counters['rating_sum'])
+    np.divide(counters['rating_sum'], counters['rating_count'], out=average, where=counters['rating_count'] > 0)
+    return average
+
+def popularity_score(counters):
+    """Engine trending score: weighted views, interaction count and mean rating"""
+    return 0.4 * counters['views'] + 0.3 * counters['rating_count'] + 0.3 * _average_rating(counters)
+
+def rating_score(counters):
+    """API trending score: mean rating plus interaction count relative to the busiest property"""
+    interactions = counters['rating_count']
+    busiest = interactions.max() if len(interactions) else 0.0
+    share = interactions / busiest if busiest > 0 else np.zeros_like(interactions)
+    return _average_rating(counters) * 0.7 + share * 5 * 0.3
+
+# Trending score formulas, by mode
+SCORERS = {'popularity': popularity_score, 'rating': rating_score}
+
+class TrendingCounters:
+    """Per-property interaction counters with cached top-N orders
+
+    Counters are float arrays aligned with the rating store's property
+    order. Instances are never modified after they are built:
+    with_interactions and decayed return new counters, which lets an engine
+    swap them in the same way it swaps its rating store. Each scoring mode
+    is ranked on first use and its top list kept.
+
+    With a half_life (seconds) the counters are exponentially time-decayed
+    by forward decay: an event at time t adds 2**((t - reference) /
+    half_life) rather than 1, so recording an event is O(1) and never
+    touches older counts, and the counts as of now are the counters times
+    2**(-(now - reference) / half_life). Decayed top lists are re-ranked at
+    most every refresh_seconds, at a cost that depends on the number of
+    properties, not on the length of the event log.
+
+    unlisted, a boolean mask over property_ids, marks properties that keep
+    their counts but are never ranked, such as removed listings.
+    """
+
+    def __init__(self, property_ids, counters=None, half_life=None, reference=None, refresh_seconds=60.0,
+                 unlisted=None):
+        self.property_ids = property_ids
+        self.counters = counters or {name: np.zeros(len(property_ids)) for name in COUNTERS}
+        self.half_life = half_life
+        self.reference = reference if reference is not None else time.time()
+        self.refresh_seconds = refresh_seconds
+        self.unlisted = unlisted
+        self._top = {}
+
+    @classmethod
+    def from_interactions(cls, interactions, property_ids, half_life=None, refresh_seconds=60.0):
+        """Count a full interaction frame, with property_ids as the property order"""
+        reference = None
+        if 'timestamp' in interactions and len(interactions):
+            reference = float(np.max(interactions['timestamp']))
+        trending = cls(property_ids, half_life=half_life, reference=reference, refresh_seconds=refresh_seconds)
+        trending._add(interactions)
+        return trending
+
+    def event_weights(self, interactions):
+        """Forward-decay weight of each interaction row (1 without a half life)
+
+        Rows without a timestamp count as happening now.
+        """
+        if not self.half_life:
+            return np.ones(len(interactions))
+        if 'timestamp' in interactions:
+            timestamps = np.asarray(interactions['timestamp'], dtype=np.float64)
+        else:
+            timestamps = np.full(len(interactions), time.time())
+        return np.exp2((timestamps - self.reference) / self.half_life)
+
+    def _add(self, interactions, codes=None):
+        """Add interaction rows to the counters in place; codes are their property positions, if known"""
+        if codes is None:
+            codes = self.property_ids.get_indexer(interactions['property_id'])
+        if (codes < 0).any():
+            raise ValueError("Interactions reference properties missing from the property order")
+        size = len(self.property_ids)
+        types = np.asarray(interactions['interaction_type'], dtype=object)
+        ratings = np.asarray(interactions['rating'], dtype=np.float64)
+        weights = self.event_weights(interactions)
+        for interaction_type, name in TYPE_COUNTERS.items():
+            matches = types == interaction_type
+            self.counters[name] += np.bincount(codes[matches], weights=weights[matches], minlength=size)
+        self.counters['rating_sum'] += np.bincount(codes, weights=ratings * weights, minlength=size)
+        self.counters['rating_count'] += np.bincount(codes, weights=weights, minlength=size)
+
+    def with_interactions(self, interactions, property_ids, codes=None):
+        """New counters with interaction rows added; property_ids may extend the current order
+
+        codes, the rows' positions in property_ids, saves looking them up.
+        """
+        grow = len(property_ids) - len(self.property_ids)
+        unlisted = None
+        if self.unlisted is not None:
+            unlisted = np.concatenate([self.unlisted, np.zeros(grow, dtype=bool)])
+        trending = TrendingCounters(property_ids, {
+            name: np.concatenate([values, np.zeros(grow)]) for name, values in self.counters.items()
+        }, self.half_life, self.reference, self.refresh_seconds, unlisted)
+
+        # Move the reference forward before new event weights could overflow
+        if self.half_life and len(interactions):
+            latest = float(np.max(trending.event_weights(interactions)))
+            if latest > 2.0 ** REBASE_HALF_LIVES:
+                trending = trending.decayed(1.0 / latest)
+                trending.reference += np.log2(latest) * self.half_life
+
+        trending._add(interactions, codes)
+        return trending
+
+    def excluding(self, unlisted):
+        """Counters sharing these counts whose top lists skip the properties marked in unlisted"""
+        return TrendingCounters(self.property_ids, self.counters, self.half_life, self.reference,
+                                self.refresh_seconds, unlisted)
+
+    def decayed(self, factor):
+        """New counters with every count scaled by factor, e.g. 0.5 to halve old activity"""
+        return TrendingCounters(self.property_ids, {
+            name: values * factor for name, values in self.counters.items()
+        }, self.half_life, self.reference, self.refresh_seconds, self.unlisted)
+
+    def current(self, now=None, indices=None):
+        """Counters as of now, of every property or only those at indices
+
+        Without decay or indices these are the stored counters themselves.
+        """
+        counters = self.counters
+        if indices is not None:
+            counters = {name: values[indices] for name, values in counters.items()}
+        if not self.half_life:
+            return counters
+        now = time.time() if now is None else now
+        factor = np.exp2(-(now - self.reference) / self.half_life)
+        return {name: values * factor for name, values in counters.items()}
+
+    def top(self, n=10, mode='popularity'):
+        """Top n (property_id, score) pairs for a scoring mode; ties keep property order"""
+        now = time.time()
+        cached = self._top.get(mode)
+        # A shorter cached list is still complete if it holds every property
+        if (cached is None or (cached[2] < n and len(cached[0]) == cached[2])
+                or (self.half_life and now - cached[3] > self.refresh_seconds)):
+            depth = max(n, MIN_TOP_DEPTH)
+            indices, scores = top_k(SCORERS[mode](self.current(now)), depth, exclude=self.unlisted)
+            cached = self._top[mode] = (indices, scores, depth, now)
+        indices, scores = cached[0][:n], cached[1][:n]
+        return [(self.property_ids[idx], float(score)) for idx, score in zip(indices, scores)]
+
+    def top_among(self, indices, n=10, mode='popularity'):
+        """Top n (property_id, score) pairs among the properties at sorted indices; not cached
+
+        Costs O(len(indices)). Scores of the 'rating' mode are relative to
+        the busiest of these properties.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        exclude = self.unlisted[indices] if self.unlisted is not None else None
+        top, scores = top_k(SCORERS[mode](self.current(indices=indices)), n, exclude=exclude)
+        return [(self.property_ids[idx], float(score)) for idx, score in zip(indices[top], scores)]
+
+    def stats(self, property_id):
+        """Counters of one property, with its mean rating; None if it has no interactions"""
+        idx = self.property_ids.get_indexer([property_id])[0]
+        if idx < 0:
+            return None
+        stats = {name: float(values[idx]) for name, values in self.current().items()}
+        stats['avg_rating'] = stats['rating_sum'] / stats['rating_count'] if stats['rating_count'] else 0.0
+        return stats